@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+##############################################################################
+##                                                                          ##
+##          MATLAB Independent, Small & Safe, High Integrity Tools          ##
+##                                                                          ##
+##              Copyright (C) 2020, Florian Schanda                         ##
+##                                                                          ##
+##  This file is part of MISS_HIT.                                          ##
+##                                                                          ##
+##  MATLAB Independent, Small & Safe, High Integrity Tools (MISS_HIT) is    ##
+##  free software: you can redistribute it and/or modify it under the       ##
+##  terms of the GNU General Public License as published by the Free        ##
+##  Software Foundation, either version 3 of the License, or (at your       ##
+##  option) any later version.                                              ##
+##                                                                          ##
+##  MISS_HIT is distributed in the hope that it will be useful,             ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+##  GNU General Public License for more details.                            ##
+##                                                                          ##
+##  You should have received a copy of the GNU General Public License       ##
+##  along with MISS_HIT. If not, see <http://www.gnu.org/licenses/>.        ##
+##                                                                          ##
+##############################################################################
+
+# Support for only looking at the lines that have changed, e.g. in a
+# code review. The changes come from a unified diff, either given as
+# a file or produced by git.
+
+import os
+import re
+import difflib
+import subprocess
+
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Changed_Lines:
+    """ The changed lines of each file mentioned in a unified diff
+
+    Lines are numbered as in the new version of each file. For
+    lines that were removed, we count the line that now follows
+    them as changed.
+    """
+    def __init__(self):
+        self.files = {}
+        # Changed lines for each file (by absolute path)
+
+        self.abspath = {}
+        # Cache of absolute paths, since we're asked for the same
+        # file many times
+
+    @staticmethod
+    def from_diff(text, root):
+        """ Changes from the unified diff text. File names in the diff
+            are relative to root.
+        """
+        assert isinstance(text, str)
+        assert isinstance(root, str)
+
+        rv = Changed_Lines()
+        lines = None
+        old_left = 0
+        new_left = 0
+        new_line = 0
+
+        for line in text.splitlines():
+            if old_left > 0 or new_left > 0:
+                # We're inside a hunk
+                if line.startswith("+"):
+                    lines.add(new_line)
+                    new_line += 1
+                    new_left -= 1
+                elif line.startswith("-"):
+                    lines.add(new_line)
+                    old_left -= 1
+                elif line.startswith("\\"):
+                    # No newline at end of file
+                    pass
+                else:
+                    new_line += 1
+                    old_left -= 1
+                    new_left -= 1
+
+            elif line.startswith("+++ "):
+                name = line[4:].split("\t")[0].strip()
+                if name == "/dev/null":
+                    lines = None
+                    continue
+                if name.startswith("b/") and \
+                   not os.path.exists(os.path.join(root, name)):
+                    name = name[2:]
+                filename = os.path.abspath(os.path.join(root, name))
+                lines = rv.files.setdefault(filename, set())
+
+            elif line.startswith("@@ ") and lines is not None:
+                match = HUNK_HEADER.match(line)
+                if match is None:
+                    raise ValueError("malformed hunk header '%s'" % line)
+                old_left = int(match.group(2) or "1")
+                new_left = int(match.group(4) or "1")
+                new_line = int(match.group(3))
+                if new_left == 0:
+                    # Only removed lines; the line given is the one
+                    # before them
+                    new_line += 1
+
+        return rv
+
+    @staticmethod
+    def from_git(ref):
+        """ Changes between the given git ref and the working tree """
+        assert isinstance(ref, str)
+
+        def git(*args, cwd=None):
+            try:
+                result = subprocess.run(["git"] + list(args),
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        encoding="utf-8",
+                                        cwd=cwd,
+                                        check=False)
+            except OSError as err:
+                raise ValueError("cannot run git: %s" % err) from err
+            if result.returncode != 0:
+                raise ValueError(result.stderr.strip())
+            return result.stdout
+
+        root = git("rev-parse", "--show-toplevel").strip()
+        diff = git("diff",
+                   "--no-color",
+                   "--no-ext-diff",
+                   "--unified=0",
+                   "--src-prefix=a/",
+                   "--dst-prefix=b/",
+                   ref,
+                   "--",
+                   cwd=root)
+
+        return Changed_Lines.from_diff(diff, root)
+
+    @staticmethod
+    def load(spec):
+        """ Changes from a diff file, or else a git ref """
+        assert isinstance(spec, str)
+
+        if os.path.isfile(spec):
+            with open(spec, "r", encoding="utf-8") as fd:
+                return Changed_Lines.from_diff(fd.read(), os.getcwd())
+        else:
+            return Changed_Lines.from_git(spec)
+
+    def lines(self, filename):
+        """ Returns the set of changed lines, or None if the file has
+            not changed at all.
+        """
+        assert isinstance(filename, str)
+
+        if filename not in self.abspath:
+            self.abspath[filename] = os.path.abspath(filename)
+        return self.files.get(self.abspath[filename], None)
+
+    def is_changed(self, filename, line):
+        """ Tests if the given line has changed """
+        assert isinstance(filename, str)
+        assert isinstance(line, int)
+
+        lines = self.lines(filename)
+        return lines is not None and line in lines
+
+
+def restrict_fixes(original, fixed, lines):
+    """ Returns the fixed text, but only with the fixed regions that
+        touch the given lines of the original text.
+    """
+    assert isinstance(original, str)
+    assert isinstance(fixed, str)
+    assert isinstance(lines, set)
+
+    old = original.splitlines(True)
+    new = fixed.splitlines(True)
+    rv = []
+
+    # Most fixes only change whitespace, so we match up the lines of
+    # both texts ignoring whitespace. This gives us pieces of the
+    # form (i1, i2, j1, j2): old[i1:i2] became new[j1:j2], with one
+    # piece for each line we could match up.
+    matcher = difflib.SequenceMatcher(None,
+                                      ["".join(line.split()) for line in old],
+                                      ["".join(line.split()) for line in new],
+                                      autojunk=False)
+    pieces = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ("equal", "replace") and i2 - i1 == j2 - j1:
+            pieces += [(i, i + 1, j, j + 1)
+                       for i, j in zip(range(i1, i2), range(j1, j2))]
+        else:
+            pieces.append((i1, i2, j1, j2))
+
+    # Adjacent pieces that the fixes change form one fixed region
+    # (e.g. a re-indented block), which we keep or drop as a whole,
+    # so that we never apply half of a fix.
+    region = None
+
+    def finish_region():
+        i1, i2, j1, j2 = region
+        if i1 == i2:
+            # New lines are inserted between two lines
+            touched = i1 in lines or i1 + 1 in lines
+        else:
+            touched = any(line in lines for line in range(i1 + 1, i2 + 1))
+
+        if touched:
+            rv.extend(new[j1:j2])
+        else:
+            rv.extend(old[i1:i2])
+
+    for i1, i2, j1, j2 in pieces:
+        if old[i1:i2] == new[j1:j2]:
+            if region:
+                finish_region()
+                region = None
+            rv += old[i1:i2]
+        elif region:
+            region = (region[0], i2, region[2], j2)
+        else:
+            region = (i1, i2, j1, j2)
+    if region:
+        finish_region()
+
+    return "".join(rv)
+
+
+def changed_lines_test_main():
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    # pylint: enable=import-outside-toplevel
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("diff",
+                    help="Unified diff")
+    options = ap.parse_args()
+
+    changes = Changed_Lines.load(options.diff)
+    root = os.getcwd()
+    for filename in sorted(changes.files):
+        lines = sorted(changes.files[filename])
+        ranges = []
+        for line in lines:
+            if ranges and ranges[-1][1] == line - 1:
+                ranges[-1][1] = line
+            else:
+                ranges.append([line, line])
+        print("%s: %s" % (os.path.relpath(filename, root),
+                          ", ".join(str(first) if first == last
+                                    else "%u-%u" % (first, last)
+                                    for first, last in ranges)))
+
+
+if __name__ == "__main__":
+    changed_lines_test_main()
@@ -135,6 +135,13 @@ class MISS_HIT_Back_End:
     def process_wp(cls, wp):
         raise errors.ICE("unimplemented process_wp function")
 
+    def select_wp(self, wp):
+        # pylint: disable=unused-argument
+
+        # Returns false for work packages that should be skipped
+        # entirely
+        return True
+
     def process_result(self, result):
         pass
 
@@ -226,6 +233,8 @@ def execute(mh, options, extra_options, back_end, process_slx=True):
         else:
             pass
 
+    work_list = [wp for wp in work_list if back_end.select_wp(wp)]
+
     if options.single:
         for wp in work_list:
             for result in process_fn(wp):
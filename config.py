@@ -24,6 +24,13 @@
 ##                                                                          ##
 ##############################################################################
 
+import re
+import fnmatch
+import os
+import types
+
+from errors import ICE
+
 DEFAULT_NAMING_SCHEME = "([A-Z]+|[A-Z][a-z]*)(_([A-Z]+|[A-Z][a-z]*|[0-9]+))*"
 # Underscore-separated acronyms or capitalised words. For example
 # "Kitten_Class" or "LASER", but not "potatoFarmer".
@@ -43,9 +50,17 @@ BASE_CONFIG = {
     "file_length"                : 1000,
     "line_length"                : 80,
     "tab_width"                  : 4,
+    "generated_marker"           : set(),
+    "generated_path"             : set(),
+    "generated_file_length"      : 0,
+    "generated_line_length"      : 0,
     "metrics"                    : {}
 }
 
+GENERATED_HEADER_LINES = 10
+# How many lines at the start of a file we search for a
+# generated_marker.
+
 STYLE_RULES = {
     "file_length" : ("Ensures files do not get too big."),
     "line_length" : ("Ensures lines do not get too long."),
@@ -147,6 +162,133 @@ FUNCTION_METRICS = sorted(metric
                           if METRICS[metric]["kind"] == "function")
 
 
+def fingerprint(value):
+    # Returns a hashable version of the given configuration (or part
+    # of it). Equal configurations have equal fingerprints.
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return tuple(sorted((key, fingerprint(value[key]))
+                            for key in value))
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(fingerprint(item) for item in value)
+    elif isinstance(value, (list, tuple)):
+        return tuple(fingerprint(item) for item in value)
+    else:
+        return value
+
+
+def freeze(value):
+    # Returns a read-only copy of the given configuration value
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return types.MappingProxyType({key: freeze(value[key])
+                                       for key in value})
+    elif isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    else:
+        return value
+
+
+def thaw(value):
+    # Undoes freeze, returning a plain (and mutable) copy
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return {key: thaw(value[key]) for key in value}
+    elif isinstance(value, frozenset):
+        return set(thaw(item) for item in value)
+    elif isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    else:
+        return value
+
+
+class Compiled_Config(dict):
+    """ A configuration that can no longer change
+
+    This is what the tools see for each file. It is still a dict, but
+    it also contains things that we can work out once (instead of
+    for every file or even every identifier), such as which metrics
+    are enabled and the naming regexes. Use compile_config to get
+    one. Nested dictionaries, sets and lists are frozen as well.
+    """
+    def __init__(self, cfg, key):
+        assert isinstance(cfg, dict)
+        super().__init__({name: freeze(cfg[name]) for name in cfg})
+
+        self.key = key
+        # The fingerprint of the configuration
+
+        self.enabled_metrics = frozenset(
+            metric
+            for metric in METRICS
+            if not cfg["metrics"].get(metric, {}).get("disable", False))
+        # The metrics to collect
+
+        self.metric_limits = {metric: cfg["metrics"][metric]["max"]
+                              for metric in cfg["metrics"]
+                              if "max" in cfg["metrics"][metric]}
+        # The upper limit of each metric we check
+
+        self.naming_regex = {}
+        # Compiled naming regex for each kind of name, on demand
+
+        self.naming_memo = {}
+        # Result of valid_name for each (kind, name) we have seen
+
+        self.memo = {}
+        # Other things that tools work out from the configuration,
+        # e.g. which style rules to use
+
+    def valid_name(self, kind, name):
+        key = (kind, name)
+        if key not in self.naming_memo:
+            if kind not in self.naming_regex:
+                self.naming_regex[kind] = re.compile(
+                    "^(" + self["regex_" + kind + "_name"] + ")$")
+            self.naming_memo[key] = \
+                self.naming_regex[kind].match(name) is not None
+        return self.naming_memo[key]
+
+    def __reduce__(self):
+        # We're sent to other processes as a plain dictionary, and
+        # compiled again (once per process) on the other side. We
+        # send the fingerprint along, so that it is not worked out
+        # again for each work package.
+        return (restore_config, (self.key, thaw(self)))
+
+    def read_only(self, *args, **kwargs):
+        raise ICE("attempted to modify a compiled configuration")
+
+    __setitem__ = read_only
+    __delitem__ = read_only
+    clear       = read_only
+    pop         = read_only
+    popitem     = read_only
+    setdefault  = read_only
+    update      = read_only
+
+
+COMPILED_CONFIGS = {}
+# All compiled configurations of this process, by fingerprint
+
+
+def compile_config(cfg):
+    """ Returns the compiled version of the given configuration """
+    assert isinstance(cfg, dict)
+
+    if isinstance(cfg, Compiled_Config):
+        return cfg
+
+    return restore_config(fingerprint(cfg), cfg)
+
+
+def restore_config(key, cfg):
+    # Returns the compiled configuration with the given fingerprint,
+    # compiling cfg if this process has not seen it yet
+    if key not in COMPILED_CONFIGS:
+        COMPILED_CONFIGS[key] = Compiled_Config(cfg, key)
+    return COMPILED_CONFIGS[key]
+
+
 def active(cfg, rule):
     assert isinstance(cfg, dict)
     assert isinstance(rule, str)
@@ -160,7 +302,9 @@ def metric_enabled(cfg, metric):
     assert isinstance(metric, str)
     assert metric in METRICS
 
-    if metric not in cfg["metrics"]:
+    if isinstance(cfg, Compiled_Config):
+        return metric in cfg.enabled_metrics
+    elif metric not in cfg["metrics"]:
         return True
 
     return not cfg["metrics"][metric].get("disable", False)
@@ -174,7 +318,9 @@ def metric_check(cfg, metric):
     assert isinstance(metric, str)
     assert metric in METRICS
 
-    if metric not in cfg["metrics"]:
+    if isinstance(cfg, Compiled_Config):
+        return metric in cfg.metric_limits
+    elif metric not in cfg["metrics"]:
         return False
 
     return "max" in cfg["metrics"][metric]
@@ -186,7 +332,60 @@ def metric_upper_limit(cfg, metric):
     assert metric in METRICS
     assert METRICS[metric]["type"] == "int"
 
-    if metric in cfg["metrics"]:
+    if isinstance(cfg, Compiled_Config):
+        return cfg.metric_limits.get(metric, None)
+    elif metric in cfg["metrics"]:
         return cfg["metrics"][metric]["max"]
     else:
         return None
+
+
+def valid_name(cfg, kind, name):
+    """ Returns true if the name matches the naming scheme for the
+        given kind of name (class, function, nested or method).
+    """
+    assert isinstance(cfg, dict)
+    assert kind in ("class", "function", "nested", "method")
+    assert isinstance(name, str)
+
+    if isinstance(cfg, Compiled_Config):
+        return cfg.valid_name(kind, name)
+    else:
+        return re.match("^(" + cfg["regex_" + kind + "_name"] + ")$",
+                        name) is not None
+
+
+def generated(cfg, filename, lines):
+    """ Returns true if the given file looks like generated code,
+        and should be analysed using the light profile.
+    """
+    assert isinstance(cfg, dict)
+    assert isinstance(filename, str)
+    assert isinstance(lines, list)
+
+    # Path globs are matched against the file name and the path
+    canonical_filename = filename.replace("\\", "/")
+    for glob in cfg["generated_path"]:
+        if fnmatch.fnmatch(canonical_filename, glob) or \
+           fnmatch.fnmatch(os.path.basename(canonical_filename), glob):
+            return True
+
+    # Header markers are searched for in the first few lines
+    if cfg["generated_marker"]:
+        for line in lines[:GENERATED_HEADER_LINES]:
+            if any(marker in line for marker in cfg["generated_marker"]):
+                return True
+
+    # Size heuristic: files that are much too big to have been
+    # written by hand
+    if cfg["generated_file_length"] and \
+       len(lines) > cfg["generated_file_length"]:
+        return True
+
+    # Shape heuristic: very long lines are typically lookup tables
+    # or other data dumped by a code generator
+    if cfg["generated_line_length"] and \
+       any(len(line) > cfg["generated_line_length"] for line in lines):
+        return True
+
+    return False
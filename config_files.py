@@ -31,6 +31,8 @@ from copy import deepcopy
 import config
 import m_lexer
 
+from m_language import *
+
 from errors import ICE, Error, Location
 
 
@@ -63,14 +65,14 @@ class Config_Parser:
 
         while self.nt:
             # Skip comments
-            while self.nt and self.nt.kind == "COMMENT":
+            while self.nt and self.nt.kind == COMMENT:
                 self.nt = self.lexer.token()
 
             # Join new-lines
             if (self.nt and
                 self.ct and
-                self.nt.kind == "NEWLINE" and
-                self.ct.kind == "NEWLINE"):
+                self.nt.kind == NEWLINE and
+                self.ct.kind == NEWLINE):
                 self.nt = self.lexer.token()
             else:
                 break
@@ -79,22 +81,27 @@ class Config_Parser:
         self.next()
         if self.ct is None:
             self.mh.error(self.lexer.get_file_loc(),
-                          "expected %s, reached EOF instead" % kind)
+                          "expected %s, reached EOF instead" %
+                          TOKEN_KIND_NAME[kind])
         elif self.ct.kind != kind:
             self.mh.error(self.ct.location,
-                          "expected %s, found %s instead" % (kind,
-                                                             self.ct.kind))
+                          "expected %s, found %s instead" %
+                          (TOKEN_KIND_NAME[kind],
+                           TOKEN_KIND_NAME[self.ct.kind]))
         elif value and self.ct.value != value:
             self.mh.error(self.ct.location,
                           "expected %s(%s), found %s(%s) instead" %
-                          (kind, value, self.ct.kind, self.ct.value))
+                          (TOKEN_KIND_NAME[kind],
+                           value,
+                           TOKEN_KIND_NAME[self.ct.kind],
+                           self.ct.value))
 
     def match_eof(self):
         self.next()
         if self.ct is not None:
             self.mh.error(self.ct.location,
                           "expected end of file, found %s instead" %
-                          self.ct.kind)
+                          TOKEN_KIND_NAME[self.ct.kind])
 
     def peek(self, kind, value=None):
         if self.nt and self.nt.kind == kind:
@@ -106,14 +113,14 @@ class Config_Parser:
             return False
 
     def parse_generic_entry(self, cfg):
-        self.match("IDENTIFIER")
+        self.match(IDENTIFIER)
         t_key = self.ct
         key = self.ct.value
         value = None
-        self.match("COLON")
+        self.match(COLON)
 
         if key == "enable_rule":
-            self.match("STRING")
+            self.match(STRING)
             value = self.ct.value
             if value not in config.STYLE_RULES:
                 self.mh.error(self.ct.location,
@@ -125,7 +132,7 @@ class Config_Parser:
                           "unknown option %s" % key)
 
         elif isinstance(cfg[key], int):
-            self.match("NUMBER")
+            self.match(NUMBER)
             try:
                 value = int(self.ct.value)
             except ValueError:
@@ -133,7 +140,7 @@ class Config_Parser:
                               "%s option requires an integer" % key)
 
         elif isinstance(cfg[key], bool):
-            self.match("NUMBER")
+            self.match(NUMBER)
             if self.ct.value in ("0", "1"):
                 value = self.ct.value == "1"
             else:
@@ -142,7 +149,7 @@ class Config_Parser:
                               key)
 
         elif isinstance(cfg[key], set):
-            self.match("STRING")
+            self.match(STRING)
             value = self.ct.value
 
             if key == "exclude_dir":
@@ -159,7 +166,7 @@ class Config_Parser:
                     # TODO: Use difflib to find a likely one
 
         elif isinstance(cfg[key], str):
-            self.match("STRING")
+            self.match(STRING)
             value = self.ct.value
 
             if key.startswith("regex"):
@@ -186,13 +193,13 @@ class Config_Parser:
             cfg[key] = value
 
     def parse_metric_entry(self, cfg):
-        self.match("IDENTIFIER", "metric")
+        self.match(IDENTIFIER, "metric")
 
-        if self.peek("OPERATOR", "*"):
-            self.match("OPERATOR", "*")
+        if self.peek(OPERATOR, "*"):
+            self.match(OPERATOR, "*")
             metric_name = None
         else:
-            self.match("STRING")
+            self.match(STRING)
             metric_name = self.ct.value
 
             if metric_name in config.METRICS:
@@ -201,16 +208,16 @@ class Config_Parser:
                 self.mh.error(self.ct.location,
                               "unknown metric '%s'" % metric_name)
 
-        self.match("COLON")
+        self.match(COLON)
 
-        self.match("IDENTIFIER")
+        self.match(IDENTIFIER)
         if self.ct.value == "limit":
             if metric_name is None:
                 self.mh.error(self.ct.location,
                               "cannot specify limit for all metrics"
                               " simultaneously")
 
-            self.match("NUMBER")
+            self.match(NUMBER)
             if metric_info["type"] != "int":
                 raise ICE("logic error: metric that is not an int")
 
@@ -245,18 +252,18 @@ class Config_Parser:
 
     def parse_file(self, cfg):
         while self.nt:
-            if self.nt.kind == "NEWLINE":
-                self.match("NEWLINE")
+            if self.nt.kind == NEWLINE:
+                self.match(NEWLINE)
                 continue
 
-            if self.peek("IDENTIFIER", "metric"):
+            if self.peek(IDENTIFIER, "metric"):
                 self.parse_metric_entry(cfg)
             else:
                 self.parse_generic_entry(cfg)
 
             # Finished with this thing, now we expect a newline or EOF
             if self.nt:
-                self.match("NEWLINE")
+                self.match(NEWLINE)
             else:
                 self.match_eof()
 
@@ -432,4 +439,10 @@ def get_config(filename):
                                                                      dirname,
                                                                      hint))
 
-    return CONFIG_TREE[dirname]["config"]
+    # Each directory is compiled once, and directories with the same
+    # configuration share the result
+    if "compiled" not in CONFIG_TREE[dirname]:
+        CONFIG_TREE[dirname]["compiled"] = \
+            config.compile_config(CONFIG_TREE[dirname]["config"])
+
+    return CONFIG_TREE[dirname]["compiled"]
@@ -28,6 +28,8 @@ import os
 import sys
 import html
 
+from m_language import COMMENT, CONTINUATION
+
 
 class Location:
     """ This fully describes where a message originates from.
@@ -102,7 +104,7 @@ class Error(Exception):
 class Justification:
     def __init__(self, token):
         # assert isinstance(token, m_lexer.MATLAB_Token)
-        assert token.kind in ("COMMENT", "CONTINUATION")
+        assert token.kind in (COMMENT, CONTINUATION)
 
         self.token = token
         self.used = False
@@ -153,19 +155,30 @@ class Message_Handler:
         self.style_issues = 0
         self.metric_issues = 0
         self.metric_justifications = 0
+        self.baselined_metrics = 0
         self.warnings = 0
         self.errors = 0
         self.justified = 0
+        self.light_files = 0
+        self.unparsed_files = 0
         self.files = set()
         self.excluded_files = set()
         self.seen_files = set()
 
         self.autofix = False
+        self.dry_run = False
+        # If set, fixes are only shown as a diff and nothing is
+        # written, so fixed messages are reported as would-fix
         self.colour = False
         self.show_context = True
         self.show_style = True
         self.sort_messages = True
 
+        self.line_filter = None
+        # If set, a function taking a file name and line number, that
+        # returns true if we should report messages there. Errors
+        # and messages without a line are always reported.
+
         self.messages = {}        # file -> line -> [message]
         self.justifications = {}  # file -> line -> [justification]
 
@@ -175,6 +188,7 @@ class Message_Handler:
     def fork(self):
         rv = Message_Handler(self.tool_id)
         rv.autofix       = self.autofix
+        rv.dry_run       = self.dry_run
         rv.colour        = self.colour
         rv.show_context  = self.show_context
         rv.show_style    = self.show_style
@@ -184,6 +198,7 @@ class Message_Handler:
     def integrate(self, other):
         assert isinstance(other, Message_Handler)
         assert self.autofix       == other.autofix
+        assert self.dry_run       == other.dry_run
         assert self.colour        == other.colour
         assert self.show_context  == other.show_context
         assert self.show_style    == other.show_style
@@ -192,9 +207,12 @@ class Message_Handler:
         self.style_issues          += other.style_issues
         self.metric_issues         += other.metric_issues
         self.metric_justifications += other.metric_justifications
+        self.baselined_metrics     += other.baselined_metrics
         self.warnings              += other.warnings
         self.errors                += other.errors
         self.justified             += other.justified
+        self.light_files           += other.light_files
+        self.unparsed_files        += other.unparsed_files
         self.files                 |= other.files
         self.excluded_files        |= other.excluded_files
         self.seen_files            |= other.seen_files
@@ -246,6 +264,17 @@ class Message_Handler:
         del self.justifications[canonical_filename]
 
     def process_message(self, message):
+        # Drop messages on lines we are not interested in
+        #
+        # False alarm from pylint
+        # pylint: disable=not-callable
+        if self.line_filter and \
+           message.kind not in ("lex error", "error") and \
+           message.location.line is not None and \
+           not self.line_filter(message.location.filename,
+                                message.location.line):
+            return
+
         # Count the message
         if message.justified:
             self.justified += 1
@@ -283,7 +312,7 @@ class Message_Handler:
         mtext = message.message
 
         if message.fixed and self.autofix:
-            mtext += " [fixed]"
+            mtext += " [would fix]" if self.dry_run else " [fixed]"
 
         if message.location.blockname is None:
             full_location = message.location.filename
@@ -342,10 +371,19 @@ class Message_Handler:
         if self.metric_justifications > 0:
             stats.append("%u justified metric deviations(s)" %
                          self.metric_justifications)
+        if self.baselined_metrics > 0:
+            stats.append("%u metric deviation(s) in baseline" %
+                         self.baselined_metrics)
         tmp += ", ".join(stats)
         if self.excluded_files:
             tmp += ("; %u file(s) excluded from analysis" %
                     len(self.excluded_files))
+        if self.light_files:
+            tmp += ("; %u file(s) analysed as generated code" %
+                    self.light_files)
+        if self.unparsed_files:
+            tmp += ("; %u file(s) not parsed (syntax errors not reported)" %
+                    self.unparsed_files)
         print(tmp)
 
     def register_message(self, msg):
@@ -379,7 +417,7 @@ class Message_Handler:
 
     def register_justification(self, token):
         # assert isinstance(token, m_lexer.MATLAB_Token)
-        assert token.kind in ("COMMENT", "CONTINUATION")
+        assert token.kind in (COMMENT, CONTINUATION)
 
         if token.location.filename not in self.files:
             raise ICE("attempted to add justification to an unknown file")
@@ -500,6 +538,7 @@ class HTML_Message_Handler(Message_Handler):
     def fork(self):
         rv = HTML_Message_Handler(self.tool_id, self.filename)
         rv.autofix       = self.autofix
+        rv.dry_run       = self.dry_run
         rv.colour        = self.colour
         rv.show_context  = self.show_context
         rv.show_style    = self.show_style
@@ -542,7 +581,7 @@ class HTML_Message_Handler(Message_Handler):
 
         mtext = message.message
         if message.fixed and self.autofix:
-            mtext += " [fixed]"
+            mtext += " [would fix]" if self.dry_run else " [fixed]"
 
         self.fd.write("<div class=\"message\">")
         if message.location.col_start:
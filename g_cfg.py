@@ -235,15 +235,18 @@ def debug_cfg(cunit, mh):
     assert isinstance(cunit, Compilation_Unit)
     assert isinstance(mh, Message_Handler)
 
-    class Function_Visitor(AST_Visitor):
-        def visit(self, node, n_parent, relation):
-            if isinstance(node, (Function_Definition,
-                                 Script_File)):
-                # pylint: disable=unused-variable
-                cfg = build_cfg(node)
-                # if isinstance(n_fdef, Function_Definition):
-                #     graph.debug_write_dot(str(n_fdef.n_sig.n_name))
-                # else:
-                #     graph.debug_write_dot(n_fdef.name)
-
-    cunit.visit(None, Function_Visitor(), "Root")
+    class Function_Visitor(Dispatch_Visitor):
+        # pylint: disable=unused-argument
+
+        def visit_function(self, node, n_parent, relation):
+            # pylint: disable=unused-variable
+            cfg = build_cfg(node)
+            # if isinstance(n_fdef, Function_Definition):
+            #     graph.debug_write_dot(str(n_fdef.n_sig.n_name))
+            # else:
+            #     graph.debug_write_dot(n_fdef.name)
+
+        DISPATCH = {Function_Definition : visit_function,
+                    Script_File         : visit_function}
+
+    traverse(cunit, Function_Visitor())
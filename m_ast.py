@@ -24,10 +24,10 @@
 ##############################################################################
 
 import subprocess
-import re
+import sys
 
 import config
-from m_language import TOKEN_KINDS
+from m_language import *
 from m_language_builtins import HIGH_IMPACT_BUILTIN_FUNCTIONS
 from errors import ICE, Location
 
@@ -37,17 +37,17 @@ from errors import ICE, Location
 ##############################################################################
 
 TOKENS_WITH_IMPLICIT_VALUE = frozenset([
-    "COMMA",
-    "SEMICOLON",
-    "COLON",
-    "BRA", "KET",      # ( )
-    "C_BRA", "C_KET",  # { }
-    "M_BRA", "M_KET",  # [ ] for matrices
-    "A_BRA", "A_KET",  # [ ] for assignment targets
-    "ASSIGNMENT",
-    "SELECTION",
-    "AT",
-    "METACLASS"
+    COMMA,
+    SEMICOLON,
+    COLON,
+    BRA, KET,      # ( )
+    C_BRA, C_KET,  # { }
+    M_BRA, M_KET,  # [ ] for matrices
+    A_BRA, A_KET,  # [ ] for assignment targets
+    ASSIGNMENT,
+    SELECTION,
+    AT,
+    METACLASS
 ])
 assert TOKENS_WITH_IMPLICIT_VALUE <= TOKEN_KINDS
 
@@ -126,7 +126,7 @@ class MATLAB_Token:
         assert isinstance(contains_quotes, bool)
         assert isinstance(block_comment, bool)
         assert isinstance(annotation, bool)
-        assert not contains_quotes or kind in ("STRING", "CARRAY")
+        assert not contains_quotes or kind in (STRING, CARRAY)
 
         self.kind               = kind
         self.raw_text           = raw_text
@@ -141,20 +141,25 @@ class MATLAB_Token:
         if value is None:
             if self.kind in TOKENS_WITH_IMPLICIT_VALUE:
                 self.value = None
-            elif self.kind == "CONTINUATION":
+            elif self.kind == CONTINUATION:
                 self.value = self.raw_text[3:].strip()
-            elif self.kind == "COMMENT":
+            elif self.kind == COMMENT:
                 if self.block_comment:
                     self.value = self.raw_text.strip()
                 else:
                     self.value = self.raw_text[1:].strip()
-            elif self.kind in ("CARRAY", "STRING"):
+            elif self.kind in (CARRAY, STRING):
                 if self.contains_quotes:
                     self.value = self.raw_text[1:-1]
                 else:
                     self.value = self.raw_text
-            elif self.kind == "BANG":
+            elif self.kind == BANG:
                 self.value = self.raw_text[1:]
+            elif self.kind in (IDENTIFIER, KEYWORD):
+                # Identifiers and keywords are interned, so that
+                # comparing their values is (almost always) just an
+                # identity check.
+                self.value = sys.intern(self.raw_text)
             else:
                 self.value = self.raw_text
         else:
@@ -175,10 +180,12 @@ class MATLAB_Token:
     def __repr__(self):
         star = "*" if self.anonymous else ""
 
-        if self.value is None or self.kind == "NEWLINE":
-            return "Token%s(%s)" % (star, self.kind)
+        if self.value is None or self.kind == NEWLINE:
+            return "Token%s(%s)" % (star, TOKEN_KIND_NAME[self.kind])
         else:
-            return "Token%s(%s, <<%s>>)" % (star, self.kind, self.value)
+            return "Token%s(%s, <<%s>>)" % (star,
+                                            TOKEN_KIND_NAME[self.kind],
+                                            self.value)
 
 
 ##############################################################################
@@ -186,24 +193,168 @@ class MATLAB_Token:
 ##############################################################################
 
 
-NODE_UID = [0]
+class Handler_Cache(dict):
+    """ Maps node classes to visitor handlers, looked up on demand """
+    def __init__(self, lookup):
+        super().__init__()
+        self.lookup = lookup
+
+    def __missing__(self, node_class):
+        handler = self.lookup(node_class)
+        self[node_class] = handler
+        return handler
 
 
 class AST_Visitor:
+    # pylint: disable=unused-argument
+
     def visit(self, node, n_parent, relation):
         pass
 
     def visit_end(self, node, n_parent, relation):
         pass
 
+    @classmethod
+    def find_handler(cls, node_class, end):
+        # Returns the function (taking self, node, n_parent and
+        # relation) to call for nodes of the given class, or None if
+        # there is nothing to do.
+        if not end:
+            return cls.visit
+        elif cls.wants_visit_end():
+            return cls.visit_end
+        else:
+            return None
+
+    @classmethod
+    def wants_visit_end(cls):
+        return cls.visit_end is not AST_Visitor.visit_end
+
+    @classmethod
+    def handlers(cls):
+        # Returns the handler caches for visit and visit_end. They are
+        # built once per visitor class.
+        if "handler_cache" not in cls.__dict__:
+            cls.handler_cache = (
+                Handler_Cache(lambda node_class: cls.find_handler(node_class,
+                                                                  False)),
+                Handler_Cache(lambda node_class: cls.find_handler(node_class,
+                                                                  True)))
+        return cls.handler_cache
+
+
+class Dispatch_Visitor(AST_Visitor):
+    """ Visitor that calls handlers registered per node class
+
+    Subclasses fill in DISPATCH (for visit) and DISPATCH_END (for
+    visit_end), mapping node classes to functions taking (self,
+    node, n_parent, relation). The handler for the most specific
+    class in a node's MRO is used, and nodes without handler are
+    skipped. Subclasses should not override visit or visit_end.
+    """
+    DISPATCH     = {}
+    DISPATCH_END = {}
+
+    @classmethod
+    def find_handler(cls, node_class, end):
+        table = cls.DISPATCH_END if end else cls.DISPATCH
+        for base in node_class.__mro__:
+            if base in table:
+                return table[base]
+        return None
+
+    @classmethod
+    def wants_visit_end(cls):
+        return bool(cls.DISPATCH_END)
+
+    def visit(self, node, n_parent, relation):
+        handler = self.handlers()[0][node.__class__]
+        if handler is not None:
+            handler(self, node, n_parent, relation)
+
+    def visit_end(self, node, n_parent, relation):
+        handler = self.handlers()[1][node.__class__]
+        if handler is not None:
+            handler(self, node, n_parent, relation)
+
+
+def traverse(n_root, function, relation="Root", n_parent=None):
+    """ Visit all nodes under (and including) n_root
+
+    The visitor is called in depth-first order: visit for each node,
+    then all its children (in the order given by CHILDREN), and then
+    visit_end. We use an explicit stack instead of recursion, so
+    this is not limited by Python's recursion limit.
+    """
+    assert isinstance(n_root, Node)
+    assert isinstance(function, AST_Visitor)
+    assert isinstance(relation, str)
+    assert n_parent is None or isinstance(n_parent, Node)
+
+    handlers, handlers_end = function.handlers()
+
+    want_end = function.wants_visit_end()
+    # Most visitors do not care about visit_end, in which case we
+    # don't need to put nodes on the stack a second time.
+
+    stack = [(n_root, n_parent, relation)]
+    # Work list of (node, parent, relation). We also push entries of
+    # the form ((node, parent, relation), None, None) below the
+    # children of a node, so that we call visit_end after them.
+
+    while stack:
+        node, n_parent, relation = stack.pop()
+        if relation is None:
+            node, n_parent, relation = node
+            handler = handlers_end[node.__class__]
+            if handler is not None:
+                handler(function, node, n_parent, relation)
+            continue
+
+        handler = handlers[node.__class__]
+        if handler is not None:
+            handler(function, node, n_parent, relation)
+        if want_end:
+            stack.append(((node, n_parent, relation), None, None))
+
+        for attr, child_relation in node.CHILDREN_REVERSED:
+            child = getattr(node, attr)
+            if child is None:
+                continue
+            elif child.__class__ is list:
+                for n_child in reversed(child):
+                    stack.append((n_child, node, child_relation))
+            else:
+                stack.append((child, node, child_relation))
+
 
 class Node:
     """ Root class for AST. Everything is a Node. """
+    __slots__ = ("uid", "n_parent", "indent_level")
+    CHILDREN  = ()
+    # The child slots of this node, in visiting order: pairs of
+    # attribute name and relation. An attribute may hold a node, a
+    # list of nodes, or None.
+
+    CHILDREN_REVERSED = ()
+    # The same, in reverse order. This is computed automatically,
+    # and is what traverse needs to push children on its stack.
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.CHILDREN_REVERSED = tuple(reversed(cls.CHILDREN))
+
     def __init__(self):
-        NODE_UID[0] += 1
-        self.uid = NODE_UID[0]
+        self.uid = None
+        # Unique within the tree. Nodes are numbered by finish_tree,
+        # from a counter kept by whoever builds the tree.
+
         self.n_parent = None
 
+        self.indent_level = None
+        # Cached result of get_indentation. This is normally filled in
+        # for the entire tree by set_indentation after parsing.
+
     def loc(self):
         raise ICE("cannot produce error location")
 
@@ -214,33 +365,13 @@ class Node:
     def debug_parse_tree(self):
         pass
 
-    def _visit(self, parent, function, relation):
-        # This function must not be overwritten
-        assert parent is None or isinstance(parent, Node)
-        assert isinstance(function, AST_Visitor)
-        assert isinstance(relation, str)
-        function.visit(self, parent, relation)
-
-    def _visit_end(self, parent, function, relation):
-        # This function must not be overwritten
-        assert parent is None or isinstance(parent, Node)
-        assert isinstance(function, AST_Visitor)
-        assert isinstance(relation, str)
-        function.visit_end(self, parent, relation)
-
-    def _visit_list(self, the_list, function, relation):
-        # This function must not be overwritten
-        for the_node in the_list:
-            the_node.visit(self, function, relation)
-
     def visit(self, parent, function, relation):
-        # This function should be over-written by each node to
-        # implement the visitor pattern.
-        self._visit(parent, function, relation)
-        self._visit_end(parent, function, relation)
+        # This function must not be overwritten. Children are
+        # described by CHILDREN instead.
+        traverse(self, function, relation, parent)
 
     def pp_node(self, fd=None):
-        self.visit(None, Text_Visitor(fd), "Root")
+        traverse(self, Text_Visitor(fd))
 
     def causes_indentation(self):
         if isinstance(self, If_Statement):
@@ -262,14 +393,66 @@ class Node:
         # Indentation is the same level as the parent. + 1 if the
         # parent itself causes children to be indented.
 
-        if self.n_parent:
-            indent = self.n_parent.get_indentation()
-            if self.n_parent.causes_indentation():
-                indent += 1
-        else:
-            indent = 0
+        if self.indent_level is not None:
+            return self.indent_level
+
+        # We don't know yet (e.g. because this is a partial tree from
+        # a file with parse errors). We walk up to the first node
+        # with a known level, and then fill in the levels on the way
+        # back down.
+        chain = []
+        node = self
+        while node is not None and node.indent_level is None:
+            chain.append(node)
+            node = node.n_parent
+
+        for node in reversed(chain):
+            if node.n_parent is None:
+                node.indent_level = 0
+            elif node.n_parent.causes_indentation():
+                node.indent_level = node.n_parent.indent_level + 1
+            else:
+                node.indent_level = node.n_parent.indent_level
+
+        return self.indent_level
+
+    def set_indentation(self):
+        # Work out the indentation level of this node and all nodes
+        # below it, in one top-down pass. This must be called again
+        # if the tree is re-arranged.
+        traverse(self, Indentation_Visitor())
+
+    def finish_tree(self, next_uid):
+        # Works out indentation levels (as set_indentation), and gives
+        # all nodes that do not have an id yet one, counting from
+        # next_uid. This is one pass over the tree. Returns the next
+        # free id.
+        assert isinstance(next_uid, int)
+        visitor = Tree_Finishing_Visitor(next_uid)
+        traverse(self, visitor)
+        return visitor.next_uid
+
+
+class Indentation_Visitor(AST_Visitor):
+    # pylint: disable=unused-argument
+
+    def visit(self, node, n_parent, relation):
+        # Parents are visited before their children, so this only
+        # ever looks one level up.
+        node.indent_level = None
+        node.get_indentation()
+
+
+class Tree_Finishing_Visitor(Indentation_Visitor):
+    def __init__(self, next_uid):
+        super().__init__()
+        self.next_uid = next_uid
 
-        return indent
+    def visit(self, node, n_parent, relation):
+        super().visit(node, n_parent, relation)
+        if node.uid is None:
+            node.uid = self.next_uid
+            self.next_uid += 1
 
 
 ##############################################################################
@@ -281,9 +464,12 @@ class Entity(Node):
     """ Not needed yet - but will become the special nodes we store
         information about symbols.
     """
+    __slots__ = ()
 
 
 class Expression(Node):
+    __slots__ = ("t_bracket_open", "t_bracket_close")
+
     def __init__(self):
         super().__init__()
 
@@ -294,8 +480,8 @@ class Expression(Node):
     def set_enclosing_brackets(self, t_open, t_close):
         assert isinstance(t_open, MATLAB_Token)
         assert isinstance(t_close, MATLAB_Token)
-        assert t_open.kind == "BRA"
-        assert t_close.kind == "KET"
+        assert t_open.kind == BRA
+        assert t_close.kind == KET
 
         self.t_bracket_open = t_open
         self.t_bracket_open.set_ast(self)
@@ -308,6 +494,8 @@ class Expression(Node):
 
 
 class Name(Expression):
+    __slots__ = ()
+
     def is_simple_dotted_name(self):
         return False
 
@@ -316,20 +504,22 @@ class Name(Expression):
 
 
 class Literal(Expression):
-    pass
+    __slots__ = ()
 
 
 class Definition(Node):
-    pass
+    __slots__ = ()
 
 
 class Pragma(Node):
+    __slots__ = ("t_pragma", "t_kind")
+
     def __init__(self, t_pragma, t_kind):
         super().__init__()
         assert isinstance(t_pragma, MATLAB_Token)
-        assert t_pragma.kind == "KEYWORD" and t_pragma.value == "pragma"
+        assert t_pragma.kind == KEYWORD and t_pragma.value == "pragma"
         assert isinstance(t_kind, MATLAB_Token)
-        assert t_kind.kind == "IDENTIFIER"
+        assert t_kind.kind == IDENTIFIER
 
         self.t_pragma = t_pragma
         self.t_pragma.set_ast(self)
@@ -349,20 +539,24 @@ class Pragma(Node):
 
 
 class Statement(Node):
+    __slots__ = ()
+
     def set_parent(self, n_parent):
         assert isinstance(n_parent, Sequence_Of_Statements)
         super().set_parent(n_parent)
 
 
 class Simple_Statement(Statement):
-    pass
+    __slots__ = ()
 
 
 class Compound_Statement(Statement):
-    pass
+    __slots__ = ()
 
 
 class Compilation_Unit(Node):
+    __slots__ = ("name", "error_location", "file_length")
+
     # pylint: disable=unused-argument
     def __init__(self, name, loc, file_length):
         super().__init__()
@@ -396,6 +590,10 @@ class Compilation_Unit(Node):
 
 
 class Script_File(Compilation_Unit):
+    __slots__ = ("n_statements", "l_functions")
+    CHILDREN  = (("n_statements", "Statements"),
+                 ("l_functions", "Functions"))
+
     def __init__(self,
                  name, loc, file_length,
                  n_statements, l_functions, l_pragmas):
@@ -431,18 +629,16 @@ class Script_File(Compilation_Unit):
         for n_function in self.l_functions:
             n_function.debug_parse_tree()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_statements.visit(self, function, "Statements")
-        self._visit_list(self.l_functions, function, "Functions")
-        self._visit_end(parent, function, relation)
-
     def sty_check_naming(self, mh, cfg):
         for n_function in self.l_functions:
             n_function.sty_check_naming(mh, cfg)
 
 
 class Function_File(Compilation_Unit):
+    __slots__ = ("l_functions", "is_separate", "l_pragmas")
+    CHILDREN  = (("l_pragmas", "Pragmas"),
+                 ("l_functions", "Functions"))
+
     def __init__(self,
                  name, loc, file_length,
                  l_functions, is_separate, l_pragmas):
@@ -475,18 +671,17 @@ class Function_File(Compilation_Unit):
         for n_function in self.l_functions:
             n_function.debug_parse_tree()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_pragmas, function, "Pragmas")
-        self._visit_list(self.l_functions, function, "Functions")
-        self._visit_end(parent, function, relation)
-
     def sty_check_naming(self, mh, cfg):
         for n_function in self.l_functions:
             n_function.sty_check_naming(mh, cfg)
 
 
 class Class_File(Compilation_Unit):
+    __slots__ = ("n_classdef", "l_functions", "l_pragmas")
+    CHILDREN  = (("l_pragmas", "Pragmas"),
+                 ("n_classdef", "Classdef"),
+                 ("l_functions", "Functions"))
+
     def __init__(self,
                  name, loc, file_length,
                  n_classdef, l_functions, l_pragmas):
@@ -529,13 +724,6 @@ class Class_File(Compilation_Unit):
                 if isinstance(n_item, Function_Definition):
                     n_item.debug_parse_tree()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_pragmas, function, "Pragmas")
-        self.n_classdef.visit(self, function, "Classdef")
-        self._visit_list(self.l_functions, function, "Functions")
-        self._visit_end(parent, function, relation)
-
     def sty_check_naming(self, mh, cfg):
         self.n_classdef.sty_check_naming(mh, cfg)
         for n_function in self.l_functions:
@@ -547,10 +735,20 @@ class Class_File(Compilation_Unit):
 
 
 class Class_Definition(Definition):
+    __slots__ = ("t_classdef", "n_name", "l_attr", "l_super", "l_properties",
+                 "l_events", "l_enumerations", "l_methods")
+    CHILDREN  = (("n_name", "Name"),
+                 ("l_super", "Superclasses"),
+                 ("l_attr", "Attributes"),
+                 ("l_properties", "Properties"),
+                 ("l_events", "Events"),
+                 ("l_enumerations", "Enumerations"),
+                 ("l_methods", "Methods"))
+
     def __init__(self, t_classdef):
         super().__init__()
         assert isinstance(t_classdef, MATLAB_Token)
-        assert t_classdef.kind == "KEYWORD" and \
+        assert t_classdef.kind == KEYWORD and \
             t_classdef.value == "classdef"
 
         self.t_classdef = t_classdef
@@ -607,17 +805,6 @@ class Class_Definition(Definition):
         assert isinstance(n_parent, Class_File)
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self._visit_list(self.l_super, function, "Superclasses")
-        self._visit_list(self.l_attr, function, "Attributes")
-        self._visit_list(self.l_properties, function, "Properties")
-        self._visit_list(self.l_events, function, "Events")
-        self._visit_list(self.l_enumerations, function, "Enumerations")
-        self._visit_list(self.l_methods, function, "Methods")
-        self._visit_end(parent, function, relation)
-
     def add_block(self, n_block):
         assert isinstance(n_block, Special_Block)
 
@@ -643,11 +830,18 @@ class Class_Definition(Definition):
 
 
 class Function_Definition(Definition):
+    __slots__ = ("t_fun", "t_end", "n_sig", "l_validation", "n_body",
+                 "l_nested")
+    CHILDREN  = (("n_sig", "Signature"),
+                 ("l_validation", "Validation"),
+                 ("n_body", "Body"),
+                 ("l_nested", "Nested"))
+
     def __init__(self, t_fun, n_sig,
                  l_validation, n_body, l_nested):
         super().__init__()
         assert isinstance(t_fun, MATLAB_Token)
-        assert t_fun.kind == "KEYWORD" and t_fun.value == "function"
+        assert t_fun.kind == KEYWORD and t_fun.value == "function"
         assert isinstance(n_sig, Function_Signature)
         assert isinstance(l_validation, list)
         for n in l_validation:
@@ -697,7 +891,7 @@ class Function_Definition(Definition):
 
     def set_end(self, t_end):
         assert isinstance(t_end, MATLAB_Token)
-        assert t_end.kind == "KEYWORD" and t_end.value == "end"
+        assert t_end.kind == KEYWORD and t_end.value == "end"
 
         self.t_end = t_end
         self.t_end.set_ast(self)
@@ -712,14 +906,6 @@ class Function_Definition(Definition):
         for n_function in self.l_nested:
             n_function.debug_parse_tree()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_sig.visit(self, function, "Signature")
-        self._visit_list(self.l_validation, function, "Validation")
-        self.n_body.visit(self, function, "Body")
-        self._visit_list(self.l_nested, function, "Nested")
-        self._visit_end(parent, function, relation)
-
     def sty_check_naming(self, mh, cfg):
         self.n_sig.sty_check_naming(mh, cfg)
         for n_function in self.l_nested:
@@ -744,6 +930,11 @@ class Function_Definition(Definition):
 
 
 class Function_Signature(Node):
+    __slots__ = ("n_name", "l_inputs", "l_outputs")
+    CHILDREN  = (("n_name", "Name"),
+                 ("l_inputs", "Inputs"),
+                 ("l_outputs", "Outputs"))
+
     def __init__(self):
         super().__init__()
 
@@ -795,13 +986,6 @@ class Function_Signature(Node):
         # implemented functions.
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self._visit_list(self.l_inputs, function, "Inputs")
-        self._visit_list(self.l_outputs, function, "Outputs")
-        self._visit_end(parent, function, relation)
-
     def sty_check_naming(self, mh, cfg):
         # We need to work out what we are. Options are:
         # 1. Ordinary function
@@ -849,6 +1033,9 @@ class Function_Signature(Node):
 
 
 class Sequence_Of_Statements(Node):
+    __slots__ = ("l_statements",)
+    CHILDREN  = (("l_statements", "Statements"),)
+
     def __init__(self, l_statements):
         super().__init__()
         assert isinstance(l_statements, list)
@@ -876,17 +1063,16 @@ class Sequence_Of_Statements(Node):
                                      Function_Definition))
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_statements, function, "Statements")
-        self._visit_end(parent, function, relation)
-
 
 class Name_Value_Pair(Node):
     """ AST for items of the various attribute lists inside classdefs
 
     For example (Access = protected)
     """
+    __slots__ = ("n_name", "t_eq", "n_value")
+    CHILDREN  = (("n_name", "Name"),
+                 ("n_value", "Value"))
+
     def __init__(self, n_name):
         super().__init__()
         assert isinstance(n_name, Identifier)
@@ -906,7 +1092,7 @@ class Name_Value_Pair(Node):
 
     def set_value(self, t_eq, n_value):
         assert isinstance(t_eq, MATLAB_Token)
-        assert t_eq.kind == "ASSIGNMENT"
+        assert t_eq.kind == ASSIGNMENT
         assert isinstance(n_value, Expression)
 
         self.t_eq = t_eq
@@ -922,22 +1108,19 @@ class Name_Value_Pair(Node):
         # directly on a classdef.
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        if self.n_value:
-            self.n_value.visit(self, function, "Value")
-        self._visit_end(parent, function, relation)
-
 
 class Special_Block(Node):
     """ AST for properties, methods, events, enumeration and argument
         validation blocks.
     """
+    __slots__ = ("t_kw", "l_attr", "l_items")
+    CHILDREN  = (("l_attr", "Attributes"),
+                 ("l_items", "Items"))
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value in ("properties",
+        assert t_kw.kind == KEYWORD and t_kw.value in ("properties",
                                                          "methods",
                                                          "events",
                                                          "enumeration",
@@ -972,12 +1155,6 @@ class Special_Block(Node):
                                      Function_Definition))
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_attr, function, "Attributes")
-        self._visit_list(self.l_items, function, "Items")
-        self._visit_end(parent, function, relation)
-
     def kind(self):
         return self.t_kw.value
 
@@ -1016,6 +1193,13 @@ class Entity_Constraints(Node):
     """ AST for a class property or argument validation found inside
         a properties or arguments block.
     """
+    __slots__ = ("n_name", "l_dim_constraint", "n_class_name",
+                 "l_fun_constraint", "n_default_value")
+    CHILDREN  = (("n_name", "Name"),
+                 ("n_class_name", "Class"),
+                 ("l_fun_constraint", "Functions"),
+                 ("n_default_value", "Default"))
+
     def __init__(self):
         super().__init__()
 
@@ -1057,7 +1241,7 @@ class Entity_Constraints(Node):
         assert len(l_dim_constraint) >= 2
         for n_dim_constraint in l_dim_constraint:
             assert isinstance(n_dim_constraint, MATLAB_Token)
-            assert n_dim_constraint.kind in ("NUMBER", "COLON")
+            assert n_dim_constraint.kind in (NUMBER, COLON)
 
         self.l_dim_constraint = l_dim_constraint
         for t_dim_constraint in self.l_dim_constraint:
@@ -1086,23 +1270,17 @@ class Entity_Constraints(Node):
         assert n_parent.kind() in ("properties", "arguments")
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        if self.n_class_name:
-            self.n_class_name.visit(self, function, "Class")
-        self._visit_list(self.l_fun_constraint, function, "Functions")
-        if self.n_default_value:
-            self.n_default_value.visit(self, function, "Default")
-        self._visit_end(parent, function, relation)
-
 
 class Argument_Validation_Delegation(Node):
     """ AST for a the .? special syntax found inside argument blocks.
     """
+    __slots__ = ("t_op", "n_name", "n_class_name")
+    CHILDREN  = (("n_name", "Name"),
+                 ("n_class_name", "Class"))
+
     def __init__(self, t_op):
         super().__init__()
-        assert isinstance(t_op, MATLAB_Token) and t_op.kind == "NVP_DELEGATE"
+        assert isinstance(t_op, MATLAB_Token) and t_op.kind == NVP_DELEGATE
 
         self.t_op = t_op
         self.t_op.set_ast(self)
@@ -1134,15 +1312,13 @@ class Argument_Validation_Delegation(Node):
         assert n_parent.kind() == "arguments"
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self.n_class_name.visit(self, function, "Class")
-        self._visit_end(parent, function, relation)
-
 
 class Class_Enumeration(Node):
     """ AST for enumeration literal/constructors inside classdefs """
+    __slots__ = ("n_name", "l_args")
+    CHILDREN  = (("n_name", "Name"),
+                 ("l_args", "Arguments"))
+
     def __init__(self, n_name):
         super().__init__()
         assert isinstance(n_name, Identifier)
@@ -1168,19 +1344,17 @@ class Class_Enumeration(Node):
         assert n_parent.kind() == "enumeration"
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self._visit_list(self.l_args, function, "Arguments")
-        self._visit_end(parent, function, relation)
-
 
 class Action(Node):
     """ AST node for actions in if or switch statements. """
+    __slots__ = ("t_kw", "n_expr", "n_body")
+    CHILDREN  = (("n_expr", "Guard"),
+                 ("n_body", "Body"))
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD"
+        assert t_kw.kind == KEYWORD
         assert t_kw.value in ("if", "elseif", "else", "case", "otherwise")
 
         self.t_kw = t_kw
@@ -1219,16 +1393,11 @@ class Action(Node):
             assert isinstance(n_parent, Switch_Statement)
         super().set_parent(n_parent)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        if self.n_expr:
-            self.n_expr.visit(self, function, "Guard")
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
 
 class Row(Node):
     """ AST for matrix or cell array rows. """
+    __slots__ = ("l_items",)
+    CHILDREN  = (("l_items", "Items"),)
 
     # Open question: are empty rows allowed?
 
@@ -1252,11 +1421,6 @@ class Row(Node):
         n_item.set_parent(self)
         self.l_items.append(n_item)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_items, function, "Items")
-        self._visit_end(parent, function, relation)
-
 
 ##############################################################################
 # Names
@@ -1268,6 +1432,10 @@ class Reference(Name):
         or a function call. Will be re-written later to Array_Index (TODO)
         or Function_Call by semantic analysis.
     """
+    __slots__ = ("n_ident", "l_args")
+    CHILDREN  = (("n_ident", "Name"),
+                 ("l_args", "Arguments"))
+
     def __init__(self, n_ident):
         super().__init__()
         assert isinstance(n_ident, Name)
@@ -1292,12 +1460,6 @@ class Reference(Name):
         for n_arg in self.l_args:
             n_arg.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_ident.visit(self, function, "Name")
-        self._visit_list(self.l_args, function, "Arguments")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         if self.l_args:
             return "%s(%s)" % (self.n_ident, ", ".join(map(str, self.l_args)))
@@ -1306,6 +1468,10 @@ class Reference(Name):
 
 
 class Cell_Reference(Name):
+    __slots__ = ("n_ident", "l_args")
+    CHILDREN  = (("n_ident", "Name"),
+                 ("l_args", "Arguments"))
+
     def __init__(self, n_ident):
         super().__init__()
         assert isinstance(n_ident, Name)
@@ -1326,12 +1492,6 @@ class Cell_Reference(Name):
         self.l_args.append(n_arg)
         n_arg.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_ident.visit(self, function, "Name")
-        self._visit_list(self.l_args, function, "Arguments")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         if self.l_args:
             return "%s{%s}" % (self.n_ident, ", ".join(map(str, self.l_args)))
@@ -1340,15 +1500,17 @@ class Cell_Reference(Name):
 
 
 class Identifier(Name):
+    __slots__ = ("t_ident",)
+
     def __init__(self, t_ident):
         super().__init__()
         assert isinstance(t_ident, MATLAB_Token)
-        assert t_ident.kind == "IDENTIFIER" or \
-            (t_ident.kind == "OPERATOR" and t_ident.value == "~") or \
-            (t_ident.kind == "KEYWORD" and t_ident.value == "end") or \
-            (t_ident.kind == "KEYWORD" and t_ident.value == "import") or \
-            (t_ident.kind == "KEYWORD" and t_ident.value == "arguments") or \
-            t_ident.kind == "BANG"
+        assert t_ident.kind == IDENTIFIER or \
+            (t_ident.kind == OPERATOR and t_ident.value == "~") or \
+            (t_ident.kind == KEYWORD and t_ident.value == "end") or \
+            (t_ident.kind == KEYWORD and t_ident.value == "import") or \
+            (t_ident.kind == KEYWORD and t_ident.value == "arguments") or \
+            t_ident.kind == BANG
 
         self.t_ident = t_ident
         self.t_ident.set_ast(self)
@@ -1358,17 +1520,16 @@ class Identifier(Name):
         return self.t_ident.location
 
     def __str__(self):
-        if self.t_ident.kind == "BANG":
+        if self.t_ident.kind == BANG:
             return "system"
         else:
             return self.t_ident.value
 
     def is_simple_dotted_name(self):
-        return self.t_ident.kind == "IDENTIFIER"
+        return self.t_ident.kind == IDENTIFIER
 
     def sty_check_naming(self, mh, cfg, kind):
-        regex = cfg["regex_" + kind + "_name"]
-        if not re.match("^(" + regex + ")$", self.t_ident.value):
+        if not config.valid_name(cfg, kind, self.t_ident.value):
             mh.style_issue(self.t_ident.location,
                            "violates naming scheme for %s" % kind)
 
@@ -1379,10 +1540,14 @@ class Identifier(Name):
 
 
 class Selection(Name):
+    __slots__ = ("t_selection", "n_prefix", "n_field")
+    CHILDREN  = (("n_prefix", "Prefix"),
+                 ("n_field", "Field"))
+
     def __init__(self, t_selection, n_prefix, n_field):
         super().__init__()
         assert isinstance(t_selection, MATLAB_Token)
-        assert t_selection.kind == "SELECTION"
+        assert t_selection.kind == SELECTION
         assert isinstance(n_prefix, Name)
         assert isinstance(n_field, Identifier)
 
@@ -1401,12 +1566,6 @@ class Selection(Name):
     def loc(self):
         return self.t_selection.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_prefix.visit(self, function, "Prefix")
-        self.n_field.visit(self, function, "Field")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "%s.%s" % (self.n_prefix, self.n_field)
 
@@ -1415,10 +1574,14 @@ class Selection(Name):
 
 
 class Dynamic_Selection(Name):
+    __slots__ = ("t_selection", "n_prefix", "n_field")
+    CHILDREN  = (("n_prefix", "Prefix"),
+                 ("n_field", "Field"))
+
     def __init__(self, t_selection, n_prefix, n_field):
         super().__init__()
         assert isinstance(t_selection, MATLAB_Token)
-        assert t_selection.kind == "SELECTION"
+        assert t_selection.kind == SELECTION
         assert isinstance(n_prefix, Name)
         assert isinstance(n_field, Expression)
 
@@ -1437,21 +1600,19 @@ class Dynamic_Selection(Name):
     def loc(self):
         return self.t_selection.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_prefix.visit(self, function, "Prefix")
-        self.n_field.visit(self, function, "Field")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "%s.(%s)" % (self.n_prefix, self.n_field)
 
 
 class Superclass_Reference(Name):
+    __slots__ = ("t_at", "n_prefix", "n_reference")
+    CHILDREN  = (("n_prefix", "Prefix"),
+                 ("n_reference", "Reference"))
+
     def __init__(self, t_at, n_prefix, n_reference):
         super().__init__()
         assert isinstance(t_at, MATLAB_Token)
-        assert t_at.kind == "AT"
+        assert t_at.kind == AT
         assert isinstance(n_prefix, Name)
         assert isinstance(n_reference, Name)
 
@@ -1470,12 +1631,6 @@ class Superclass_Reference(Name):
     def loc(self):
         return self.t_at.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_prefix.visit(self, function, "Prefix")
-        self.n_reference.visit(self, function, "Reference")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "%s@%s" % (self.n_prefix, self.n_reference)
 
@@ -1486,10 +1641,12 @@ class Superclass_Reference(Name):
 
 
 class For_Loop_Statement(Compound_Statement):
+    __slots__ = ("t_for", "n_ident", "n_body")
+
     def __init__(self, t_for):
         super().__init__()
         assert isinstance(t_for, MATLAB_Token)
-        assert t_for.kind == "KEYWORD" and t_for.value in ("for",
+        assert t_for.kind == KEYWORD and t_for.value in ("for",
                                                            "parfor")
 
         self.t_for = t_for
@@ -1517,15 +1674,16 @@ class For_Loop_Statement(Compound_Statement):
         self.n_body = n_body
         self.n_body.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        raise ICE("reached visit procedure for abstract base class for"
-                  " for-loops")
-
 
 class General_For_Statement(For_Loop_Statement):
+    __slots__ = ("n_expr",)
+    CHILDREN  = (("n_ident", "Identifier"),
+                 ("n_expr", "Expression"),
+                 ("n_body", "Body"))
+
     def __init__(self, t_for):
         super().__init__(t_for)
-        assert t_for.kind == "KEYWORD" and t_for.value == "for"
+        assert t_for.kind == KEYWORD and t_for.value == "for"
 
         self.n_expr = None
         # An expression returning some kind of matrix which defines
@@ -1537,18 +1695,17 @@ class General_For_Statement(For_Loop_Statement):
         self.n_expr = n_expr
         self.n_expr.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_ident.visit(self, function, "Identifier")
-        self.n_expr.visit(self, function, "Expression")
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
 
 class Parallel_For_Statement(For_Loop_Statement):
+    __slots__ = ("n_range", "n_workers")
+    CHILDREN  = (("n_ident", "Identifier"),
+                 ("n_range", "Range"),
+                 ("n_workers", "Workers"),
+                 ("n_body", "Body"))
+
     def __init__(self, t_for):
         super().__init__(t_for)
-        assert t_for.kind == "KEYWORD" and t_for.value == "parfor"
+        assert t_for.kind == KEYWORD and t_for.value == "parfor"
 
         self.n_range = None
         # The range expression for the loop bounds
@@ -1568,21 +1725,16 @@ class Parallel_For_Statement(For_Loop_Statement):
         self.n_workers = n_workers
         self.n_workers.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_ident.visit(self, function, "Identifier")
-        self.n_range.visit(self, function, "Range")
-        if self.n_workers:
-            self.n_workers.visit(self, function, "Workers")
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
 
 class While_Statement(Compound_Statement):
+    __slots__ = ("t_while", "n_guard", "n_body")
+    CHILDREN  = (("n_guard", "Guard"),
+                 ("n_body", "Body"))
+
     def __init__(self, t_while, n_guard):
         super().__init__()
         assert isinstance(t_while, MATLAB_Token)
-        assert t_while.kind == "KEYWORD" and t_while.value == "while"
+        assert t_while.kind == KEYWORD and t_while.value == "while"
         assert isinstance(n_guard, Expression)
 
         self.t_while = t_while
@@ -1605,14 +1757,11 @@ class While_Statement(Compound_Statement):
         self.n_body = n_body
         self.n_body.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_guard.visit(self, function, "Guard")
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
 
 class If_Statement(Compound_Statement):
+    __slots__ = ("l_actions", "has_else")
+    CHILDREN  = (("l_actions", "Action"),)
+
     def __init__(self, l_actions):
         super().__init__()
         assert isinstance(l_actions, list)
@@ -1639,17 +1788,16 @@ class If_Statement(Compound_Statement):
     def loc(self):
         return self.l_actions[0].loc()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_actions, function, "Action")
-        self._visit_end(parent, function, relation)
-
 
 class Switch_Statement(Compound_Statement):
+    __slots__ = ("t_kw", "n_expr", "l_actions", "has_otherwise")
+    CHILDREN  = (("n_expr", "Guard"),
+                 ("l_actions", "Action"))
+
     def __init__(self, t_kw, n_switch_expr):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "switch"
+        assert t_kw.kind == KEYWORD and t_kw.value == "switch"
         assert isinstance(n_switch_expr, Expression)
 
         self.t_kw = t_kw
@@ -1680,18 +1828,17 @@ class Switch_Statement(Compound_Statement):
         if n_action.kind() == "otherwise":
             self.has_otherwise = True
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_expr.visit(self, function, "Guard")
-        self._visit_list(self.l_actions, function, "Action")
-        self._visit_end(parent, function, relation)
-
 
 class Try_Statement(Compound_Statement):
+    __slots__ = ("t_try", "t_catch", "n_ident", "n_body", "n_handler")
+    CHILDREN  = (("n_body", "Body"),
+                 ("n_ident", "Identifier"),
+                 ("n_handler", "Handler"))
+
     def __init__(self, t_try):
         super().__init__()
         assert isinstance(t_try, MATLAB_Token)
-        assert t_try.kind == "KEYWORD" and t_try.value == "try"
+        assert t_try.kind == KEYWORD and t_try.value == "try"
 
         self.t_try = t_try
         self.t_try.set_ast(self)
@@ -1721,7 +1868,7 @@ class Try_Statement(Compound_Statement):
         self.n_body.set_parent(self)
 
     def set_handler_body(self, t_catch, n_handler):
-        assert t_catch.kind == "KEYWORD" and t_catch.value == "catch"
+        assert t_catch.kind == KEYWORD and t_catch.value == "catch"
         assert isinstance(n_handler, Sequence_Of_Statements)
 
         self.t_catch = t_catch
@@ -1735,21 +1882,15 @@ class Try_Statement(Compound_Statement):
         self.n_ident = n_ident
         self.n_ident.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_body.visit(self, function, "Body")
-        if self.n_ident:
-            self.n_ident.visit(self, function, "Identifier")
-        if self.n_handler:
-            self.n_handler.visit(self, function, "Handler")
-        self._visit_end(parent, function, relation)
-
 
 class SPMD_Statement(Compound_Statement):
+    __slots__ = ("t_spmd", "n_body")
+    CHILDREN  = (("n_body", "Body"),)
+
     def __init__(self, t_spmd):
         super().__init__()
         assert isinstance(t_spmd, MATLAB_Token)
-        assert t_spmd.kind == "KEYWORD" and t_spmd.value == "spmd"
+        assert t_spmd.kind == KEYWORD and t_spmd.value == "spmd"
 
         self.t_spmd = t_spmd
         self.t_spmd.set_ast(self)
@@ -1767,11 +1908,6 @@ class SPMD_Statement(Compound_Statement):
         self.n_body = n_body
         self.n_body.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
 
 ##############################################################################
 # Simple Statements
@@ -1779,10 +1915,14 @@ class SPMD_Statement(Compound_Statement):
 
 
 class Simple_Assignment_Statement(Simple_Statement):
+    __slots__ = ("t_eq", "n_lhs", "n_rhs")
+    CHILDREN  = (("n_lhs", "LHS"),
+                 ("n_rhs", "RHS"))
+
     def __init__(self, t_eq, n_lhs, n_rhs):
         super().__init__()
         assert isinstance(t_eq, MATLAB_Token)
-        assert t_eq.kind == "ASSIGNMENT"
+        assert t_eq.kind == ASSIGNMENT
         assert isinstance(n_lhs, Name)
         assert isinstance(n_rhs, Expression)
 
@@ -1801,14 +1941,12 @@ class Simple_Assignment_Statement(Simple_Statement):
     def loc(self):
         return self.t_eq.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_lhs.visit(self, function, "LHS")
-        self.n_rhs.visit(self, function, "RHS")
-        self._visit_end(parent, function, relation)
-
 
 class Compound_Assignment_Statement(Simple_Statement):
+    __slots__ = ("t_eq", "l_lhs", "n_rhs")
+    CHILDREN  = (("l_lhs", "LHS"),
+                 ("n_rhs", "RHS"))
+
     # TODO: Rewrite single targets to Simple_Assignment_Statement
     def __init__(self):
         super().__init__()
@@ -1832,7 +1970,7 @@ class Compound_Assignment_Statement(Simple_Statement):
 
     def set_token_eq(self, t_eq):
         assert isinstance(t_eq, MATLAB_Token)
-        assert t_eq.kind == "ASSIGNMENT"
+        assert t_eq.kind == ASSIGNMENT
 
         self.t_eq = t_eq
         self.t_eq.set_ast(self)
@@ -1853,14 +1991,11 @@ class Compound_Assignment_Statement(Simple_Statement):
         self.n_rhs = n_rhs
         self.n_rhs.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_lhs, function, "LHS")
-        self.n_rhs.visit(self, function, "RHS")
-        self._visit_end(parent, function, relation)
-
 
 class Naked_Expression_Statement(Simple_Statement):
+    __slots__ = ("n_expr",)
+    CHILDREN  = (("n_expr", "Expression"),)
+
     def __init__(self, n_expr):
         super().__init__()
         assert isinstance(n_expr, Expression)
@@ -1872,17 +2007,14 @@ class Naked_Expression_Statement(Simple_Statement):
     def loc(self):
         return self.n_expr.loc()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_expr.visit(self, function, "Expression")
-        self._visit_end(parent, function, relation)
-
 
 class Return_Statement(Simple_Statement):
+    __slots__ = ("t_kw",)
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "return"
+        assert t_kw.kind == KEYWORD and t_kw.value == "return"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1893,10 +2025,12 @@ class Return_Statement(Simple_Statement):
 
 
 class Break_Statement(Simple_Statement):
+    __slots__ = ("t_kw",)
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "break"
+        assert t_kw.kind == KEYWORD and t_kw.value == "break"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1907,10 +2041,12 @@ class Break_Statement(Simple_Statement):
 
 
 class Continue_Statement(Simple_Statement):
+    __slots__ = ("t_kw",)
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "continue"
+        assert t_kw.kind == KEYWORD and t_kw.value == "continue"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1921,10 +2057,13 @@ class Continue_Statement(Simple_Statement):
 
 
 class Global_Statement(Simple_Statement):
+    __slots__ = ("t_kw", "l_names")
+    CHILDREN  = (("l_names", "Names"),)
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "global"
+        assert t_kw.kind == KEYWORD and t_kw.value == "global"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1942,17 +2081,15 @@ class Global_Statement(Simple_Statement):
         n_name.set_parent(self)
         self.l_names.append(n_name)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_names, function, "Names")
-        self._visit_end(parent, function, relation)
-
 
 class Persistent_Statement(Simple_Statement):
+    __slots__ = ("t_kw", "l_names")
+    CHILDREN  = (("l_names", "Names"),)
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "persistent"
+        assert t_kw.kind == KEYWORD and t_kw.value == "persistent"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1970,17 +2107,14 @@ class Persistent_Statement(Simple_Statement):
         n_name.set_parent(self)
         self.l_names.append(n_name)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_names, function, "Names")
-        self._visit_end(parent, function, relation)
-
 
 class Import_Statement(Simple_Statement):
+    __slots__ = ("t_kw", "l_chain")
+
     def __init__(self, t_kw):
         super().__init__()
         assert isinstance(t_kw, MATLAB_Token)
-        assert t_kw.kind == "KEYWORD" and t_kw.value == "import"
+        assert t_kw.kind == KEYWORD and t_kw.value == "import"
 
         self.t_kw = t_kw
         self.t_kw.set_ast(self)
@@ -1997,25 +2131,28 @@ class Import_Statement(Simple_Statement):
         assert isinstance(l_chain, list)
         for t_item in l_chain:
             assert isinstance(t_item, MATLAB_Token)
-            assert t_item.kind == "IDENTIFIER" or \
-                (t_item.kind == "OPERATOR" and t_item.value == ".*")
+            assert t_item.kind == IDENTIFIER or \
+                (t_item.kind == OPERATOR and t_item.value == ".*")
 
         self.l_chain = l_chain
         for t_item in self.l_chain:
             t_item.set_ast(self)
 
     def get_chain_strings(self):
-        return [t.value if t.kind == "IDENTIFIER" else "*"
+        return [t.value if t.kind == IDENTIFIER else "*"
                 for t in self.l_chain]
 
 
 class Metric_Justification_Pragma(Pragma):
+    __slots__ = ("t_tool", "t_metric", "n_reason", "applies")
+    CHILDREN  = (("n_reason", "Reason"),)
+
     def __init__(self, t_pragma, t_kind, t_tool, t_metric, n_reason):
         super().__init__(t_pragma, t_kind)
         assert isinstance(t_tool, MATLAB_Token)
-        assert t_tool.kind == "IDENTIFIER" and t_tool.value == "metric"
+        assert t_tool.kind == IDENTIFIER and t_tool.value == "metric"
         assert isinstance(t_metric, MATLAB_Token)
-        assert t_metric.kind == "STRING"
+        assert t_metric.kind == STRING
         assert isinstance(n_reason, (String_Literal, Binary_Operation))
 
         self.t_tool = t_tool
@@ -2044,11 +2181,6 @@ class Metric_Justification_Pragma(Pragma):
     def reason(self):
         return self.n_reason.evaluate_static_string_expression()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_reason.visit(self, function, "Reason")
-        self._visit_end(parent, function, relation)
-
 
 ##############################################################################
 # Literals
@@ -2056,10 +2188,12 @@ class Metric_Justification_Pragma(Pragma):
 
 
 class Number_Literal(Literal):
+    __slots__ = ("t_value",)
+
     def __init__(self, t_value):
         super().__init__()
         assert isinstance(t_value, MATLAB_Token)
-        assert t_value.kind == "NUMBER"
+        assert t_value.kind == NUMBER
 
         self.t_value = t_value
         self.t_value.set_ast(self)
@@ -2073,10 +2207,12 @@ class Number_Literal(Literal):
 
 
 class Char_Array_Literal(Literal):
+    __slots__ = ("t_string",)
+
     def __init__(self, t_string):
         super().__init__()
         assert isinstance(t_string, MATLAB_Token)
-        assert t_string.kind in ("CARRAY", "BANG")
+        assert t_string.kind in (CARRAY, BANG)
 
         self.t_string = t_string
         self.t_string.set_ast(self)
@@ -2092,10 +2228,12 @@ class Char_Array_Literal(Literal):
 
 
 class String_Literal(Literal):
+    __slots__ = ("t_string",)
+
     def __init__(self, t_string):
         super().__init__()
         assert isinstance(t_string, MATLAB_Token)
-        assert t_string.kind == "STRING"
+        assert t_string.kind == STRING
 
         self.t_string = t_string
         self.t_string.set_ast(self)
@@ -2117,10 +2255,12 @@ class String_Literal(Literal):
 
 
 class Reshape(Expression):
+    __slots__ = ("t_colon",)
+
     def __init__(self, t_colon):
         super().__init__()
         assert isinstance(t_colon, MATLAB_Token)
-        assert t_colon.kind == "COLON"
+        assert t_colon.kind == COLON
 
         self.t_colon = t_colon
         self.t_colon.set_ast(self)
@@ -2141,6 +2281,12 @@ class Reshape(Expression):
 
 
 class Range_Expression(Expression):
+    __slots__ = ("t_first_colon", "t_second_colon", "n_first", "n_last",
+                 "n_stride")
+    CHILDREN  = (("n_first", "First"),
+                 ("n_stride", "Stride"),
+                 ("n_last", "Last"))
+
     def __init__(self,
                  n_first, t_first_colon, n_last,
                  t_second_colon=None, n_stride=None):
@@ -2150,7 +2296,7 @@ class Range_Expression(Expression):
         assert isinstance(t_first_colon, MATLAB_Token)
         if t_second_colon:
             assert isinstance(t_second_colon, MATLAB_Token)
-            assert t_second_colon.kind == "COLON"
+            assert t_second_colon.kind == COLON
             assert isinstance(n_stride, Expression)
         else:
             assert n_stride is None
@@ -2181,14 +2327,6 @@ class Range_Expression(Expression):
     def loc(self):
         return self.t_first_colon.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_first.visit(self, function, "First")
-        if self.n_stride:
-            self.n_stride.visit(self, function, "Stride")
-        self.n_last.visit(self, function, "Last")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         if self.n_stride:
             return "%s:%s:%s" % (self.n_first, self.n_stride, self.n_last)
@@ -2197,10 +2335,13 @@ class Range_Expression(Expression):
 
 
 class Matrix_Expression(Expression):
+    __slots__ = ("t_open", "t_close", "l_rows")
+    CHILDREN  = (("l_rows", "Rows"),)
+
     def __init__(self, t_open):
         super().__init__()
         assert isinstance(t_open, MATLAB_Token)
-        assert t_open.kind == "M_BRA"
+        assert t_open.kind == M_BRA
 
         self.t_open = t_open
         self.t_open.set_ast(self)
@@ -2221,22 +2362,20 @@ class Matrix_Expression(Expression):
 
     def set_closing_bracket(self, t_close):
         assert isinstance(t_close, MATLAB_Token)
-        assert t_close.kind == "M_KET"
+        assert t_close.kind == M_KET
 
         self.t_close = t_close
         self.t_close.set_ast(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_rows, function, "Rows")
-        self._visit_end(parent, function, relation)
-
 
 class Cell_Expression(Expression):
+    __slots__ = ("t_open", "t_close", "l_rows")
+    CHILDREN  = (("l_rows", "Rows"),)
+
     def __init__(self, t_open):
         super().__init__()
         assert isinstance(t_open, MATLAB_Token)
-        assert t_open.kind == "C_BRA"
+        assert t_open.kind == C_BRA
 
         self.t_open = t_open
         self.t_open.set_ast(self)
@@ -2257,18 +2396,17 @@ class Cell_Expression(Expression):
 
     def set_closing_bracket(self, t_close):
         assert isinstance(t_close, MATLAB_Token)
-        assert t_close.kind == "C_KET"
+        assert t_close.kind == C_KET
 
         self.t_close = t_close
         self.t_close.set_ast(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_rows, function, "Rows")
-        self._visit_end(parent, function, relation)
-
 
 class Function_Call(Expression):
+    __slots__ = ("variant", "n_name", "l_args")
+    CHILDREN  = (("n_visible_name", "Name"),
+                 ("l_args", "Arguments"))
+
     def __init__(self, n_name, l_args, variant="normal"):
         super().__init__()
         assert isinstance(n_name, Name)
@@ -2298,16 +2436,18 @@ class Function_Call(Expression):
         # List of parameters. Char literals for command form or shell
         # escapes, expressions otherwise.
 
+    @property
+    def n_visible_name(self):
+        # The name as seen by visitors. Shell escapes do not have
+        # one, since the user did not write it.
+        if self.variant == "escape":
+            return None
+        else:
+            return self.n_name
+
     def loc(self):
         return self.n_name.loc()
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        if self.variant != "escape":
-            self.n_name.visit(self, function, "Name")
-        self._visit_list(self.l_args, function, "Arguments")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         if self.variant == "normal":
             return "%s(%s)" % (self.n_name,
@@ -2323,11 +2463,14 @@ class Unary_Operation(Expression):
     """ AST for unary operations. While most of them are prefix,
         in MATLAB we have some postfix operators.
     """
+    __slots__ = ("precedence", "t_op", "n_expr")
+    CHILDREN  = (("n_expr", "Expression"),)
+
     def __init__(self, precedence, t_op, n_expr):
         super().__init__()
         assert 1 <= precedence <= 12
         assert isinstance(t_op, MATLAB_Token)
-        assert t_op.kind == "OPERATOR"
+        assert t_op.kind == OPERATOR
         assert t_op.value in ("+", "-", "~", ".'", "'")
         assert isinstance(n_expr, Expression)
 
@@ -2350,11 +2493,6 @@ class Unary_Operation(Expression):
     def loc(self):
         return self.t_op.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_expr.visit(self, function, "Expression")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         if self.t_op.value in (".'", "'"):
             # Postfix
@@ -2365,11 +2503,15 @@ class Unary_Operation(Expression):
 
 
 class Binary_Operation(Expression):
+    __slots__ = ("precedence", "t_op", "n_lhs", "n_rhs")
+    CHILDREN  = (("n_lhs", "LHS"),
+                 ("n_rhs", "RHS"))
+
     def __init__(self, precedence, t_op, n_lhs, n_rhs):
         super().__init__()
         assert 1 <= precedence <= 12
         assert isinstance(t_op, MATLAB_Token)
-        assert t_op.kind == "OPERATOR"
+        assert t_op.kind == OPERATOR
         assert isinstance(n_lhs, Expression)
         assert isinstance(n_rhs, Expression)
 
@@ -2396,12 +2538,6 @@ class Binary_Operation(Expression):
     def loc(self):
         return self.t_op.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_lhs.visit(self, function, "LHS")
-        self.n_rhs.visit(self, function, "RHS")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "(%s %s %s)" % (self.n_lhs, self.t_op.value, self.n_rhs)
 
@@ -2414,6 +2550,8 @@ class Binary_Operation(Expression):
 
 
 class Binary_Logical_Operation(Binary_Operation):
+    __slots__ = ("short_circuit",)
+
     def __init__(self, precedence, t_op, short_circuit, n_lhs, n_rhs):
         # In some contexts a normal & or | takes on short-circuit
         # semantics. Specifically inside an "if" or "while"
@@ -2427,10 +2565,14 @@ class Binary_Logical_Operation(Binary_Operation):
 
 
 class Lambda_Function(Expression):
+    __slots__ = ("t_at", "l_parameters", "n_body")
+    CHILDREN  = (("l_parameters", "Parameters"),
+                 ("n_body", "Body"))
+
     def __init__(self, t_at):
         super().__init__()
         assert isinstance(t_at, MATLAB_Token)
-        assert t_at.kind == "AT"
+        assert t_at.kind == AT
 
         self.t_at = t_at
         self.t_at.set_ast(self)
@@ -2456,22 +2598,19 @@ class Lambda_Function(Expression):
         self.n_body = n_body
         self.n_body.set_parent(self)
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self._visit_list(self.l_parameters, function, "Parameters")
-        self.n_body.visit(self, function, "Body")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "@(%s) %s" % (",".join(map(str, self.l_parameters)),
                              str(self.n_body))
 
 
 class Function_Pointer(Expression):
+    __slots__ = ("t_at", "n_name")
+    CHILDREN  = (("n_name", "Name"),)
+
     def __init__(self, t_at, n_name):
         super().__init__()
         assert isinstance(t_at, MATLAB_Token)
-        assert t_at.kind == "AT"
+        assert t_at.kind == AT
         assert isinstance(n_name, Name)
 
         self.t_at = t_at
@@ -2485,20 +2624,18 @@ class Function_Pointer(Expression):
     def loc(self):
         return self.t_at.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "@" + str(self.n_name)
 
 
 class Metaclass(Expression):
+    __slots__ = ("t_mc", "n_name")
+    CHILDREN  = (("n_name", "Name"),)
+
     def __init__(self, t_mc, n_name):
         super().__init__()
         assert isinstance(t_mc, MATLAB_Token)
-        assert t_mc.kind == "METACLASS"
+        assert t_mc.kind == METACLASS
         assert isinstance(n_name, Name)
 
         self.t_mc = t_mc
@@ -2512,11 +2649,6 @@ class Metaclass(Expression):
     def loc(self):
         return self.t_mc.location
 
-    def visit(self, parent, function, relation):
-        self._visit(parent, function, relation)
-        self.n_name.visit(self, function, "Name")
-        self._visit_end(parent, function, relation)
-
     def __str__(self):
         return "?" + str(self.n_name)
 
@@ -2525,7 +2657,9 @@ class Metaclass(Expression):
 # Debug output: Text
 ###################################################################
 
-class Text_Visitor(AST_Visitor):
+class Text_Visitor(Dispatch_Visitor):
+    # pylint: disable=unused-argument
+
     def __init__(self, fd):
         super().__init__()
         self.indent = 0
@@ -2546,69 +2680,95 @@ class Text_Visitor(AST_Visitor):
             self.write(string)
         self.indent += 1
 
-    def visit(self, node, n_parent, relation):
-        if isinstance(node, Special_Block):
-            self.write_head(node.t_kw.value.capitalize() + " " +
-                            node.__class__.__name__,
-                            relation)
-        elif isinstance(node, Entity_Constraints):
-            self.write_head(node.__class__.__name__,
-                            relation)
-            for dim, t_cons in enumerate(node.l_dim_constraint, 1):
-                if t_cons.kind == "COLON":
-                    self.write("Dimension %u constraint: %s" %
-                               (dim, t_cons.kind))
-                else:
-                    self.write("Dimension %u constraint: %s" %
-                               (dim, t_cons.value))
-        elif isinstance(node, Function_Call):
-            self.write_head(node.variant.capitalize() + " form " +
-                            node.__class__.__name__,
-                            relation)
-        elif isinstance(node, Action):
-            self.write_head(node.kind().capitalize() + " " +
-                            node.__class__.__name__,
-                            relation)
-        elif isinstance(node, Identifier):
-            self.write_head(node.__class__.__name__ +
-                            " <" + node.t_ident.value + ">",
-                            relation)
-        elif isinstance(node, Number_Literal):
-            self.write_head(node.__class__.__name__ +
-                            " <" + node.t_value.value + ">",
-                            relation)
-        elif isinstance(node, Char_Array_Literal):
-            self.write_head(node.__class__.__name__ +
-                            " '" + node.t_string.value + "'",
-                            relation)
-        elif isinstance(node, String_Literal):
-            self.write_head(node.__class__.__name__ +
-                            " \"" + node.t_string.value + "\"",
-                            relation)
-        elif isinstance(node, Unary_Operation):
-            self.write_head(node.__class__.__name__ + " " + node.t_op.value,
-                            relation)
-        elif isinstance(node, Binary_Operation):
-            self.write_head(node.__class__.__name__ + " " + node.t_op.value,
-                            relation)
-            if isinstance(node, Binary_Logical_Operation):
-                self.write("Short-Circuit: %s" % node.short_circuit)
-        elif isinstance(node, Import_Statement):
-            self.write_head(node.__class__.__name__ +
-                            " for " +
-                            ".".join(node.get_chain_strings()),
-                            relation)
-        elif isinstance(node, Metric_Justification_Pragma):
-            self.write_head(node.__class__.__name__ +
-                            " for %s" % node.t_metric.value,
-                            relation)
-        else:
-            self.write_head(node.__class__.__name__,
-                            relation)
-
-    def visit_end(self, node, n_parent, relation):
+    def visit_node(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__,
+                        relation)
+
+    def visit_special_block(self, node, n_parent, relation):
+        self.write_head(node.t_kw.value.capitalize() + " " +
+                        node.__class__.__name__,
+                        relation)
+
+    def visit_entity_constraints(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__,
+                        relation)
+        for dim, t_cons in enumerate(node.l_dim_constraint, 1):
+            if t_cons.kind == COLON:
+                self.write("Dimension %u constraint: %s" %
+                           (dim, TOKEN_KIND_NAME[t_cons.kind]))
+            else:
+                self.write("Dimension %u constraint: %s" %
+                           (dim, t_cons.value))
+
+    def visit_function_call(self, node, n_parent, relation):
+        self.write_head(node.variant.capitalize() + " form " +
+                        node.__class__.__name__,
+                        relation)
+
+    def visit_action(self, node, n_parent, relation):
+        self.write_head(node.kind().capitalize() + " " +
+                        node.__class__.__name__,
+                        relation)
+
+    def visit_identifier(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " <" + node.t_ident.value + ">",
+                        relation)
+
+    def visit_number_literal(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " <" + node.t_value.value + ">",
+                        relation)
+
+    def visit_char_array_literal(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " '" + node.t_string.value + "'",
+                        relation)
+
+    def visit_string_literal(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " \"" + node.t_string.value + "\"",
+                        relation)
+
+    def visit_operation(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ + " " + node.t_op.value,
+                        relation)
+
+    def visit_binary_logical_operation(self, node, n_parent, relation):
+        self.visit_operation(node, n_parent, relation)
+        self.write("Short-Circuit: %s" % node.short_circuit)
+
+    def visit_import_statement(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " for " +
+                        ".".join(node.get_chain_strings()),
+                        relation)
+
+    def visit_justification(self, node, n_parent, relation):
+        self.write_head(node.__class__.__name__ +
+                        " for %s" % node.t_metric.value,
+                        relation)
+
+    DISPATCH = {Node                        : visit_node,
+                Special_Block               : visit_special_block,
+                Entity_Constraints          : visit_entity_constraints,
+                Function_Call               : visit_function_call,
+                Action                      : visit_action,
+                Identifier                  : visit_identifier,
+                Number_Literal              : visit_number_literal,
+                Char_Array_Literal          : visit_char_array_literal,
+                String_Literal              : visit_string_literal,
+                Unary_Operation             : visit_operation,
+                Binary_Operation            : visit_operation,
+                Binary_Logical_Operation    : visit_binary_logical_operation,
+                Import_Statement            : visit_import_statement,
+                Metric_Justification_Pragma : visit_justification}
+
+    def visit_end_node(self, node, n_parent, relation):
         self.indent -= 1
 
+    DISPATCH_END = {Node : visit_end_node}
+
 
 ###################################################################
 # Debug output: Graphviz
@@ -2708,7 +2868,7 @@ def dot(fd, parent, annotation, node):
 
     elif isinstance(node, Import_Statement):
         lbl += "\n"
-        lbl += ".".join(t.value if t.kind == "IDENTIFIER" else "*"
+        lbl += ".".join(t.value if t.kind == IDENTIFIER else "*"
                         for t in node.l_chain)
 
     elif isinstance(node, Sequence_Of_Statements):
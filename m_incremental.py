@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+##############################################################################
+##                                                                          ##
+##          MATLAB Independent, Small & Safe, High Integrity Tools          ##
+##                                                                          ##
+##              Copyright (C) 2020, Florian Schanda                         ##
+##                                                                          ##
+##  This file is part of MISS_HIT.                                          ##
+##                                                                          ##
+##  MATLAB Independent, Small & Safe, High Integrity Tools (MISS_HIT) is    ##
+##  free software: you can redistribute it and/or modify it under the       ##
+##  terms of the GNU General Public License as published by the Free        ##
+##  Software Foundation, either version 3 of the License, or (at your       ##
+##  option) any later version.                                              ##
+##                                                                          ##
+##  MISS_HIT is distributed in the hope that it will be useful,             ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+##  GNU General Public License for more details.                            ##
+##                                                                          ##
+##  You should have received a copy of the GNU General Public License       ##
+##  along with MISS_HIT. If not, see <http://www.gnu.org/licenses/>.        ##
+##                                                                          ##
+##############################################################################
+
+# Incremental re-parsing of a single file, for tools (such as editors)
+# that keep a file open and re-analyse it after every change.
+
+import bisect
+import difflib
+
+from errors import Error, ICE, Message_Handler
+from m_ast import *
+from m_lexer import MATLAB_Lexer, Token_Buffer
+from m_parser import MATLAB_Parser
+
+
+def region_text(lines, start, end):
+    # Returns the text of the given lines, and all whitespace
+    # following it. The lexer merges the newline at the end of a
+    # function with the following empty lines and indentation into
+    # one token, so we need that to produce the same tokens.
+    tail = []
+    for line in lines[end:]:
+        rest = line.lstrip(" \t\n")
+        tail.append(line[:len(line) - len(rest)])
+        if rest:
+            break
+
+    return "".join(lines[start:end]) + "".join(tail)
+
+
+class Function_Region:
+    """ A function (or method) that can be re-parsed on its own
+
+    This is any function terminated with end, that does not share
+    a line with anything else.
+    """
+    def __init__(self, n_fdef, lines):
+        assert isinstance(n_fdef, Function_Definition)
+        assert n_fdef.t_end is not None
+        assert isinstance(lines, list)
+
+        self.n_fdef = n_fdef
+
+        self.start = n_fdef.t_fun.location.line - 1
+        self.end   = n_fdef.t_end.location.line
+        # The lines this function occupies (counting from 0, end is
+        # exclusive)
+
+        self.fingerprint = hash(region_text(lines, self.start, self.end))
+        # Fingerprint of the text of the function
+
+
+class Incremental_Parser:
+    """ Parse tree for a single file, which can be updated after edits
+
+    The initial parse is a normal one. When the file changes (see
+    update) we work out which lines have changed. If all changes
+    are inside functions (or methods) terminated by end, then only
+    these functions are lexed and parsed again, and their new trees
+    are spliced into the existing one. All other nodes and tokens
+    are kept, and their line numbers are adjusted. For all other
+    changes we simply parse the whole file again.
+
+    Messages (e.g. parse errors) are sent to the given message
+    handler, just like for a normal parse. Messages for previous
+    versions of the file are not retracted.
+    """
+    def __init__(self, mh, cfg, filename, content):
+        assert isinstance(mh, Message_Handler)
+        assert isinstance(cfg, dict)
+        assert isinstance(filename, str)
+        assert isinstance(content, str)
+
+        self.mh       = mh
+        self.cfg      = cfg
+        self.filename = filename
+
+        self.lines = []
+        # The text of the file, line by line (including line endings)
+
+        self.tokens = []
+        # All tokens of the file, in order
+
+        self.n_cu = None
+        # The parse tree
+
+        self.next_uid = 1
+        # The next free node id of the parse tree. Nodes of re-parsed
+        # functions are numbered from here.
+
+        self.regions = []
+        # All functions that can be re-parsed on their own, in order
+
+        self.reparsed = None
+        # Names of the functions re-parsed by the last update, or None
+        # if the whole file was parsed.
+
+        self.parse(content)
+
+    def make_lexer(self, mh, content):
+        lexer = MATLAB_Lexer(mh, content, self.filename)
+        if self.cfg["octave"]:
+            lexer.set_octave_mode()
+        if self.cfg["ignore_pragmas"]:
+            lexer.process_pragmas = False
+        return lexer
+
+    def parse(self, content):
+        # Parse the whole file. If this fails (i.e. raises Error) we
+        # keep the previous version.
+        assert isinstance(content, str)
+
+        tbuf = Token_Buffer(self.make_lexer(self.mh, content), self.cfg)
+        parser = MATLAB_Parser(self.mh, tbuf, self.cfg)
+        n_cu = parser.parse_file()
+
+        self.lines    = content.splitlines(keepends=True)
+        self.tokens   = tbuf.tokens
+        self.n_cu     = n_cu
+        self.next_uid = parser.next_uid
+        self.reparsed = None
+        self.find_regions()
+
+    def find_regions(self):
+        candidates = list(self.n_cu.l_functions)
+        if isinstance(self.n_cu, Class_File):
+            for n_block in self.n_cu.n_classdef.l_methods:
+                candidates += [n_item
+                               for n_item in n_block.l_items
+                               if isinstance(n_item, Function_Definition)]
+
+        regions = sorted((Function_Region(n_fdef, self.lines)
+                          for n_fdef in candidates
+                          if n_fdef.t_end),
+                         key = lambda region: region.start)
+
+        # Functions sharing a line with their neighbour (e.g. "end,
+        # function") cannot be re-parsed on their own
+        self.regions = []
+        for idx, region in enumerate(regions):
+            if idx > 0 and regions[idx - 1].end > region.start:
+                continue
+            elif idx + 1 < len(regions) and \
+                 region.end > regions[idx + 1].start:
+                continue
+            self.regions.append(region)
+
+    def diff(self, new_lines):
+        # Returns opcodes (see difflib.SequenceMatcher) that turn
+        # the old lines into the new ones. We only run the matcher
+        # on the part between the common prefix and suffix, since
+        # edits are usually local.
+        old_lines = self.lines
+
+        limit = min(len(old_lines), len(new_lines))
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and \
+              old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+            suffix += 1
+
+        old_end = len(old_lines) - suffix
+        new_end = len(new_lines) - suffix
+        matcher = difflib.SequenceMatcher(None,
+                                          old_lines[prefix:old_end],
+                                          new_lines[prefix:new_end],
+                                          autojunk=False)
+
+        opcodes = [("equal", 0, prefix, 0, prefix)]
+        opcodes += [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+                    for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+        opcodes.append(("equal", old_end, len(old_lines),
+                        new_end, len(new_lines)))
+
+        # Inserts do not cover any old lines, and empty blocks are not
+        # interesting
+        return [opcode
+                for opcode in opcodes
+                if opcode[1] < opcode[2] or opcode[0] == "insert"]
+
+    def only_functions_changed(self, opcodes):
+        # Checks that all changes are inside the regions we know
+        starts = [region.start for region in self.regions]
+
+        for tag, i1, i2, _, _ in opcodes:
+            if tag == "equal":
+                continue
+            idx = bisect.bisect_right(starts, i1) - 1
+            if idx < 0:
+                return False
+            region = self.regions[idx]
+            if tag == "insert":
+                inside = region.start < i1 < region.end
+            else:
+                inside = region.start <= i1 and i2 <= region.end
+            if not inside:
+                return False
+
+        return True
+
+    def parse_function(self, mh, new_lines, start, end):
+        # Parse a function occupying the given lines of the new
+        # text. We pad the function with empty lines so that the
+        # lexer produces the correct locations.
+        content = "\n" * start + region_text(new_lines, start, end)
+
+        tbuf = Token_Buffer(self.make_lexer(mh, content), self.cfg)
+        parser = MATLAB_Parser(mh, tbuf, self.cfg)
+        parser.functions_require_end = True
+
+        while parser.peek(NEWLINE):
+            parser.next()
+        n_fdef = parser.parse_function_def()
+        parser.match_eof()
+
+        if n_fdef.t_end is None:
+            return None, None
+        else:
+            return n_fdef, [token
+                            for token in tbuf.tokens
+                            if token.location.line > start]
+
+    def splice(self, n_old, n_new):
+        n_parent = n_old.n_parent
+        if isinstance(n_parent, Compilation_Unit):
+            the_list = n_parent.l_functions
+        elif isinstance(n_parent, Special_Block):
+            the_list = n_parent.l_items
+        else:
+            raise ICE("cannot replace function in %s" %
+                      n_parent.__class__.__name__)
+
+        the_list[the_list.index(n_old)] = n_new
+        n_new.set_parent(n_parent)
+        self.next_uid = n_new.finish_tree(self.next_uid)
+
+    def update(self, content):
+        """ Bring the parse tree up to date with the new content
+
+        Raises Error (and keeps the previous version) if the new
+        content cannot be parsed.
+        """
+        assert isinstance(content, str)
+
+        new_lines = content.splitlines(keepends=True)
+        opcodes   = self.diff(new_lines)
+        if not self.only_functions_changed(opcodes):
+            self.parse(content)
+            return
+
+        # Work out where each region has moved to. The opcodes we
+        # look at here partition the old lines.
+        covering = [opcode for opcode in opcodes if opcode[0] != "insert"]
+        ends     = [opcode[2] for opcode in covering]
+
+        def new_start(line):
+            tag, i1, _, j1, _ = covering[bisect.bisect_right(ends, line)]
+            return j1 + (line - i1) if tag == "equal" else j1
+
+        def new_end(line):
+            tag, i1, _, j1, j2 = covering[bisect.bisect_right(ends,
+                                                              line - 1)]
+            return j1 + (line - i1) if tag == "equal" else j2
+
+        moves = [(new_start(region.start), new_end(region.end))
+                 for region in self.regions]
+
+        # Re-parse all functions whose text has changed. Note that
+        # this can include functions that have not been edited
+        # themselves, if the indentation of the next function has
+        # changed. We use a separate message handler, so that we can
+        # fall back to a full parse if anything goes wrong.
+        trial_mh = self.mh.fork()
+        trial_mh.sort_messages = True
+        trial_mh.register_file(self.filename)
+        replacements = {}
+        ok = True
+        try:
+            for idx, (start, end) in enumerate(moves):
+                if hash(region_text(new_lines, start, end)) == \
+                   self.regions[idx].fingerprint:
+                    continue
+                n_fdef, tokens = self.parse_function(trial_mh,
+                                                     new_lines,
+                                                     start, end)
+                if n_fdef is None:
+                    ok = False
+                    break
+                replacements[idx] = (n_fdef, tokens)
+        except Error:
+            ok = False
+
+        if not ok:
+            self.parse(content)
+            return
+
+        # Rebuild the token list, adjusting the line numbers of
+        # everything we keep. Tokens in a kept function move with
+        # it; all other tokens are on unchanged lines.
+        old_tokens  = self.tokens
+        self.tokens = []
+        region_idx  = 0
+        for token in old_tokens:
+            line = token.location.line - 1
+            while region_idx < len(self.regions) and \
+                  self.regions[region_idx].end <= line:
+                region_idx += 1
+
+            if region_idx < len(self.regions) and \
+               self.regions[region_idx].start <= line:
+                region = self.regions[region_idx]
+                if region_idx in replacements:
+                    if replacements[region_idx][1]:
+                        self.tokens += replacements[region_idx][1]
+                        replacements[region_idx] = \
+                            (replacements[region_idx][0], [])
+                    continue
+                delta = moves[region_idx][0] - region.start
+            else:
+                delta = new_start(line) - line
+
+            token.location.line += delta
+            self.tokens.append(token)
+
+        # Finally splice in the new trees
+        self.reparsed = []
+        for idx, (n_fdef, _) in sorted(replacements.items()):
+            self.splice(self.regions[idx].n_fdef, n_fdef)
+            self.reparsed.append(str(n_fdef.n_sig.n_name))
+        self.n_cu.file_length = len(new_lines)
+
+        # Pass on any messages produced when parsing the new functions
+        for messages in trial_mh.messages.values():
+            for line in sorted(messages):
+                for message in messages[line]:
+                    self.mh.register_message(message)
+
+        self.lines = new_lines
+        self.find_regions()
+
+
+def incremental_test_main():
+    # pylint: disable=import-outside-toplevel
+    import io
+    import os
+    import argparse
+    import config
+    # pylint: enable=import-outside-toplevel
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file",
+                    help="MATLAB file to parse")
+    ap.add_argument("edit",
+                    help="New content for the file")
+    options = ap.parse_args()
+
+    mh = Message_Handler("debug")
+    mh.sort_messages = False
+    mh.colour = False
+    mh.register_file(options.file)
+
+    with open(options.file, "r", encoding="cp1252") as fd:
+        content = fd.read()
+    with open(options.edit, "r", encoding="cp1252") as fd:
+        new_content = fd.read()
+
+    try:
+        ip = Incremental_Parser(mh, config.BASE_CONFIG,
+                                options.file, content)
+        ip.update(new_content)
+    except Error:
+        mh.summary_and_exit()
+
+    if ip.reparsed is None:
+        print("Re-parsed %s" % os.path.basename(options.file))
+    else:
+        print("Re-parsed functions: %s" % (", ".join(ip.reparsed) or
+                                           "none"))
+
+    # Compare against parsing the new content from scratch
+    reference_mh = mh.fork()
+    reference_mh.sort_messages = True
+    reference_mh.register_file(options.file)
+    reference = Incremental_Parser(reference_mh, config.BASE_CONFIG,
+                                   options.file, new_content)
+
+    def tree_text(n_cu):
+        fd = io.StringIO()
+        n_cu.pp_node(fd)
+        return fd.getvalue().splitlines()
+
+    def token_text(tokens):
+        return ["%u:%u-%u %s %r" % (token.location.line,
+                                    token.location.col_start,
+                                    token.location.col_end,
+                                    TOKEN_KIND_NAME[token.kind],
+                                    token.value)
+                for token in tokens]
+
+    for what, ours, theirs in (("Tree",
+                                tree_text(ip.n_cu),
+                                tree_text(reference.n_cu)),
+                               ("Tokens",
+                                token_text(ip.tokens),
+                                token_text(reference.tokens))):
+        if ours == theirs:
+            print("%s matches full parse" % what)
+        else:
+            print("%s differs from full parse:" % what)
+            for line in difflib.unified_diff(theirs, ours, lineterm=""):
+                print(line)
+
+    mh.summary_and_exit()
+
+
+if __name__ == "__main__":
+    incremental_test_main()
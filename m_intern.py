@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+##############################################################################
+##                                                                          ##
+##          MATLAB Independent, Small & Safe, High Integrity Tools          ##
+##                                                                          ##
+##              Copyright (C) 2020, Florian Schanda                         ##
+##                                                                          ##
+##  This file is part of MISS_HIT.                                          ##
+##                                                                          ##
+##  MATLAB Independent, Small & Safe, High Integrity Tools (MISS_HIT) is    ##
+##  free software: you can redistribute it and/or modify it under the       ##
+##  terms of the GNU General Public License as published by the Free        ##
+##  Software Foundation, either version 3 of the License, or (at your       ##
+##  option) any later version.                                              ##
+##                                                                          ##
+##  MISS_HIT is distributed in the hope that it will be useful,             ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+##  GNU General Public License for more details.                            ##
+##                                                                          ##
+##  You should have received a copy of the GNU General Public License       ##
+##  along with MISS_HIT. If not, see <http://www.gnu.org/licenses/>.        ##
+##                                                                          ##
+##############################################################################
+
+# Structural sharing of expressions. Generated code often repeats the
+# same expression many times; this assigns each distinct expression a
+# number so that analyses can work on (and remember results for) each
+# distinct expression once.
+#
+# Note that we do not share the nodes themselves: each node knows its
+# parent and its tokens know their node, and both are needed for
+# messages and fixes.
+
+from m_ast import *
+
+
+INTERNED_CLASSES = {
+    Identifier               : ("t_ident",),
+    Number_Literal           : ("t_value",),
+    Char_Array_Literal       : ("t_string",),
+    String_Literal           : ("t_string",),
+    Reshape                  : (),
+    Unary_Operation          : ("t_op",),
+    Binary_Operation         : ("t_op",),
+    Binary_Logical_Operation : ("t_op",),
+    Range_Expression         : (),
+    Reference                : (),
+    Cell_Reference           : (),
+    Selection                : (),
+    Matrix_Expression        : (),
+    Cell_Expression          : (),
+    Row                      : (),
+}
+# The kinds of node we share, and the tokens whose text (together with
+# the children) identifies them. Only expressions built entirely from
+# these are shared. Note that brackets around an expression are not
+# taken into account.
+
+INTERNED_ATTRIBUTES = {
+    Binary_Logical_Operation : ("short_circuit",),
+}
+# Other attributes that are part of the key, since they change the
+# meaning of the expression. For example "a & b" short-circuits in
+# the condition of an if statement, but not in an assignment.
+
+
+def is_contextual(node):
+    # Returns true for the expressions whose meaning depends on what
+    # is being indexed: "end" in x(end - 1), and ":" in x(:)
+    return isinstance(node, Reshape) or \
+        (isinstance(node, Identifier) and
+         node.t_ident.kind == KEYWORD and
+         node.t_ident.value == "end")
+
+
+class Interning_Visitor(AST_Visitor):
+    # pylint: disable=unused-argument
+
+    def __init__(self, table):
+        self.table = table
+
+    def visit_end(self, node, n_parent, relation):
+        # Children are finished before their parents, so we can build
+        # keys bottom-up
+        self.table.intern(node)
+
+
+class Expression_Table:
+    """ Numbers the distinct expressions of one or more parse trees
+
+    Two expressions get the same number if they are structurally
+    identical, e.g. all occurrences of "x(i + 1)" in a file. Each
+    key only refers to the numbers of the children, so building the
+    table is linear in the size of the tree.
+    """
+    def __init__(self):
+        self.ids = {}
+        # Maps keys (class, token text, other attributes, children,
+        # context) to numbers. The context is only used for "end" and
+        # ":", and is the number of the expression they index.
+
+        self.representatives = []
+        # The first node seen for each number
+
+        self.counts = []
+        # How often each number has been seen
+
+        self.node_id = {}
+        # The number of each shared node
+
+    def add_tree(self, n_root):
+        assert isinstance(n_root, Node)
+
+        traverse(n_root, Interning_Visitor(self))
+
+    def intern(self, node):
+        # Assigns a number to the given node, if all of its children
+        # have one. Returns the number, or None.
+        assert isinstance(node, Node)
+
+        if node.__class__ not in INTERNED_CLASSES:
+            return None
+
+        children = []
+        for attr, _ in node.CHILDREN:
+            child = getattr(node, attr)
+            if child is None:
+                children.append(None)
+            elif isinstance(child, list):
+                ids = tuple(self.node_id.get(n_child, None)
+                            for n_child in child)
+                if None in ids:
+                    return None
+                children.append(ids)
+            elif child in self.node_id:
+                children.append(self.node_id[child])
+            else:
+                return None
+
+        # An "end" in x(end) is not the same as one in y(end), so we
+        # include the number of the indexed expression. Everything
+        # containing them then differs through its children.
+        if is_contextual(node):
+            context = self.indexed(node)
+            if context is None:
+                return None
+        else:
+            context = None
+
+        key = (node.__class__,
+               tuple(getattr(node, attr).value
+                     for attr in INTERNED_CLASSES[node.__class__]),
+               tuple(getattr(node, attr)
+                     for attr in INTERNED_ATTRIBUTES.get(node.__class__,
+                                                         ())),
+               tuple(children),
+               context)
+
+        if key in self.ids:
+            number = self.ids[key]
+            self.counts[number] += 1
+        else:
+            number = len(self.representatives)
+            self.ids[key] = number
+            self.representatives.append(node)
+            self.counts.append(1)
+
+        self.node_id[node] = number
+        return number
+
+    def indexed(self, node):
+        # Returns the number of the expression indexed by the
+        # reference whose arguments contain the given node, or None if
+        # there is no such reference or that expression has no number
+        n_child  = node
+        n_parent = node.n_parent
+        while n_parent is not None:
+            if isinstance(n_parent, (Reference, Cell_Reference)) and \
+               n_child is not n_parent.n_ident:
+                return self.node_id.get(n_parent.n_ident, None)
+            n_child  = n_parent
+            n_parent = n_parent.n_parent
+        return None
+
+    def expression_id(self, node):
+        """ Returns the number of the given node, or None """
+        assert isinstance(node, Node)
+
+        return self.node_id.get(node, None)
+
+    def canonical(self, node):
+        """ Returns the first node identical to the given node """
+        assert isinstance(node, Node)
+
+        if node in self.node_id:
+            return self.representatives[self.node_id[node]]
+        else:
+            return node
+
+    def memoize(self, function):
+        """ Wraps a function taking a node, to compute it only once
+            for each distinct expression.
+        """
+        results = {}
+
+        def wrapper(node):
+            number = self.node_id.get(node, None)
+            if number is None:
+                return function(node)
+            elif number not in results:
+                results[number] = function(node)
+            return results[number]
+
+        return wrapper
+
+
+def intern_test_main():
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    import config
+    from errors import Message_Handler, Error
+    from m_lexer import MATLAB_Lexer, Token_Buffer
+    from m_parser import MATLAB_Parser
+    # pylint: enable=import-outside-toplevel
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file",
+                    help="MATLAB file to parse")
+    options = ap.parse_args()
+
+    mh = Message_Handler("debug")
+    mh.sort_messages = False
+    mh.colour = False
+    mh.register_file(options.file)
+
+    with open(options.file, "r", encoding="cp1252") as fd:
+        content = fd.read()
+
+    try:
+        lexer = MATLAB_Lexer(mh, content, options.file)
+        tbuf = Token_Buffer(lexer, config.BASE_CONFIG)
+        n_cu = MATLAB_Parser(mh, tbuf, config.BASE_CONFIG).parse_file()
+    except Error:
+        mh.summary_and_exit()
+
+    table = Expression_Table()
+    table.add_tree(n_cu)
+
+    print("Shared expressions: %u (%u distinct)" %
+          (len(table.node_id), len(table.representatives)))
+    for number, node in enumerate(table.representatives):
+        if table.counts[number] == 1 or isinstance(node, Row):
+            continue
+        elif node.__class__.__str__ is object.__str__:
+            text = "%s on line %u" % (node.__class__.__name__,
+                                      node.loc().line)
+        else:
+            text = str(node)
+        print("   %ux %s" % (table.counts[number], text))
+
+    # Work out the size of all shared expressions with a memoised
+    # function, to show how much work is saved
+    calls = [0]
+
+    def size(node):
+        calls[0] += 1
+        return 1 + sum(size_of(n_child)
+                       for attr, _ in node.CHILDREN
+                       for n_child in children(getattr(node, attr)))
+
+    def children(value):
+        if value is None:
+            return []
+        elif isinstance(value, list):
+            return value
+        else:
+            return [value]
+
+    size_of = table.memoize(size)
+    for node in table.node_id:
+        size_of(node)
+    print("Memoised size: computed %u times for %u expressions" %
+          (calls[0], len(table.node_id)))
+
+    mh.summary_and_exit()
+
+
+if __name__ == "__main__":
+    intern_test_main()
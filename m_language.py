@@ -24,32 +24,71 @@
 ##                                                                          ##
 ##############################################################################
 
-# Tokens for the MATLAB language
-TOKEN_KINDS = frozenset([
+# Tokens for the MATLAB language. Token kinds are small integers so
+# that the lexer, parser, and style checker can compare them
+# cheaply; use TOKEN_KIND_NAME to get a readable name (e.g. for
+# debug output or error messages).
+NEWLINE      = 0
+CONTINUATION = 1
+COMMENT      = 2
+IDENTIFIER   = 3
+NUMBER       = 4
+CARRAY       = 5   # 'foo' character array
+STRING       = 6   # "foo" string class literal
+KEYWORD      = 7   # see below
+OPERATOR     = 8   # see docs/internal/matlab_operators.txt
+COMMA        = 9   # ,
+SEMICOLON    = 10  # ;
+COLON        = 11  # :
+BRA          = 12  # (
+KET          = 13  # )
+C_BRA        = 14  # {
+C_KET        = 15  # }
+M_BRA        = 16  # [ for matrices
+M_KET        = 17  # ] for matrices
+A_BRA        = 18  # [ for assignment targets
+A_KET        = 19  # ] for assignment targets
+ASSIGNMENT   = 20  # =
+SELECTION    = 21  # .
+AT           = 22  # @
+BANG         = 23  # !
+METACLASS    = 24  # ?
+NVP_DELEGATE = 25  # .? (name value pair delegation)
+ANNOTATION   = 26  # miss_hit annotation
+
+TOKEN_KIND_NAME = (
     "NEWLINE",
     "CONTINUATION",
     "COMMENT",
     "IDENTIFIER",
     "NUMBER",
-    "CARRAY",          # 'foo' character array
-    "STRING",          # "foo" string class literal
-    "KEYWORD",         # see below
-    "OPERATOR",        # see docs/internal/matlab_operators.txt
-    "COMMA",           # ,
-    "SEMICOLON",       # ;
-    "COLON",           # :
-    "BRA", "KET",      # ( )
-    "C_BRA", "C_KET",  # { }
-    "M_BRA", "M_KET",  # [ ] for matrices
-    "A_BRA", "A_KET",  # [ ] for assignment targets
-    "ASSIGNMENT",      # =
-    "SELECTION",       # .
-    "AT",              # @
-    "BANG",            # !
-    "METACLASS",       # ?
-    "NVP_DELEGATE",    # .? (name value pair delegation)
-    "ANNOTATION",      # miss_hit annotation
-])
+    "CARRAY",
+    "STRING",
+    "KEYWORD",
+    "OPERATOR",
+    "COMMA",
+    "SEMICOLON",
+    "COLON",
+    "BRA",
+    "KET",
+    "C_BRA",
+    "C_KET",
+    "M_BRA",
+    "M_KET",
+    "A_BRA",
+    "A_KET",
+    "ASSIGNMENT",
+    "SELECTION",
+    "AT",
+    "BANG",
+    "METACLASS",
+    "NVP_DELEGATE",
+    "ANNOTATION",
+)
+TOKEN_KINDS = frozenset(range(len(TOKEN_KIND_NAME)))
+assert all(globals()[name] == kind
+           for kind, name in enumerate(TOKEN_KIND_NAME))
+
 
 # As of MATLAB 2019b
 # See: https://www.mathworks.com/help/matlab/ref/iskeyword.html
@@ -32,7 +32,7 @@ import config
 import m_ast
 
 from errors import Location, Error, Message_Handler, ICE
-from m_language import KEYWORDS, ANNOTATION_KEYWORDS
+from m_language import *
 
 # The 1999 technical report "The Design and Implementation of a Parser
 # and Scanner for the MATLAB Language in the MATCH Compiler" is a key
@@ -68,6 +68,26 @@ from m_language import KEYWORDS, ANNOTATION_KEYWORDS
 # a more traditional parser.
 
 
+def significant_tokens(tokens):
+    """ Filters the given token stream, only yielding tokens that are
+        relevant for parsing.
+
+    We skip comments, continuations and annotation indications; and
+    consecutive newlines are joined.
+    """
+    previous = None
+    for token in tokens:
+        if token.kind in (COMMENT, CONTINUATION, ANNOTATION):
+            continue
+        elif token.kind == NEWLINE:
+            if token.annotation:
+                continue
+            elif previous is not None and previous.kind == NEWLINE:
+                continue
+        previous = token
+        yield token
+
+
 class Token_Generator(metaclass=ABCMeta):
     def __init__(self, filename, blockname=None):
         assert isinstance(filename, str)
@@ -90,6 +110,11 @@ class Token_Generator(metaclass=ABCMeta):
     def line_count(self):
         pass
 
+    def parser_tokens(self):
+        # Returns an iterable of all tokens relevant for parsing. By
+        # default these are produced on demand.
+        return significant_tokens(iter(self.token, None))
+
     def get_file_loc(self, line=None):
         assert line is None or isinstance(line, int)
         return Location(filename  = self.filename,
@@ -214,17 +239,11 @@ class MATLAB_Lexer(Token_Generator):
     def correct_tabs(self, tabwidth):
         assert isinstance(tabwidth, int) and tabwidth >= 2
 
-        new_lines = []
-        for line in self.context_line:
-            tmp = ""
-            for c in line:
-                if c == "\t":
-                    tmp += " " * (tabwidth - (len(tmp) % tabwidth))
-                else:
-                    tmp += c
-            new_lines.append(tmp)
-        self.context_line = new_lines
-        self.text = "\n".join(new_lines) + "\n"
+        # Lines never contain line breaks, so expandtabs counts
+        # columns from the start of each line
+        self.context_line = [line.expandtabs(tabwidth)
+                             for line in self.context_line]
+        self.text = "\n".join(self.context_line) + "\n"
 
         self.cc = None
         self.nc = self.text[0] if len(self.text) > 0 else "\0"
@@ -286,7 +305,7 @@ class MATLAB_Lexer(Token_Generator):
             fake_col = self.lexpos - self.col_offset + 1
             fake_line = fake_line[:fake_col] + "<anon,>" + fake_line[fake_col:]
             token = m_ast.MATLAB_Token(
-                "COMMA",
+                COMMA,
                 ",",
                 Location(filename  = self.filename,
                          blockname = self.blockname,
@@ -298,7 +317,7 @@ class MATLAB_Lexer(Token_Generator):
                 False,
                 anonymous = True,
                 annotation = self.in_annotation)
-            self.last_kind = "COMMA"
+            self.last_kind = COMMA
             self.last_value = ","
             return token
 
@@ -331,9 +350,9 @@ class MATLAB_Lexer(Token_Generator):
 
         elif self.block_comment:
             if self.cc == "\n":
-                kind = "NEWLINE"
+                kind = NEWLINE
             else:
-                kind = "COMMENT"
+                kind = COMMENT
                 while self.nc not in ("\n", "\0"):
                     self.next()
 
@@ -341,26 +360,26 @@ class MATLAB_Lexer(Token_Generator):
             # Lexing in command mode
             if self.cc in self.comment_char:
                 # Comments go until the end of the line
-                kind = "COMMENT"
+                kind = COMMENT
                 while self.nc not in ("\n", "\0"):
                     self.next()
 
             elif self.cc == "\n":
                 # Newlines are summarised into one token
-                kind = "NEWLINE"
+                kind = NEWLINE
                 while self.nc in ("\n", " ", "\t"):
                     self.next()
 
             elif self.cc == ";":
-                kind = "SEMICOLON"
+                kind = SEMICOLON
 
             elif self.cc == ",":
-                kind = "COMMA"
+                kind = COMMA
 
             elif self.cc == "." and \
                  self.nc == "." and \
                  self.nnc == ".":
-                kind = "CONTINUATION"
+                kind = CONTINUATION
                 # We now need to eat everything until and including
                 # the next line
                 while self.cc not in ("\n", "\0"):
@@ -375,7 +394,7 @@ class MATLAB_Lexer(Token_Generator):
                 # quotes. Continuations and comments outside strings
                 # terminate the token and mismatches are lex
                 # errors. Except for brackets which can be mismatched.
-                kind = "CARRAY"
+                kind = CARRAY
                 value = ""
                 local_brackets = 0
                 # The brackets are not really matched, but counted. If
@@ -481,19 +500,19 @@ class MATLAB_Lexer(Token_Generator):
                self.process_pragmas:
                 # '%|' on its own in a new line begins an annotation.
                 self.in_annotation = True
-                kind = "ANNOTATION"
+                kind = ANNOTATION
                 self.next()
 
             elif self.cc in self.comment_char:
                 # Comments go until the end of the line
-                kind = "COMMENT"
+                kind = COMMENT
                 while self.nc not in ("\n", "\0"):
                     self.next()
 
             elif self.cc == "\n":
                 # Newlines are summarised into one token, except if
                 # we're in annotation mode
-                kind = "NEWLINE"
+                kind = NEWLINE
                 if self.in_annotation:
                     pass
                 else:
@@ -501,13 +520,13 @@ class MATLAB_Lexer(Token_Generator):
                         self.next()
 
             elif self.cc == ";":
-                kind = "SEMICOLON"
+                kind = SEMICOLON
 
             elif not self.in_annotation and self.cc == "." and self.nc == ".":
                 # This is a continuation
                 self.next()
                 if self.nc == ".":
-                    kind = "CONTINUATION"
+                    kind = CONTINUATION
                     self.next()
 
                     # We now need to eat everything until and including
@@ -520,14 +539,14 @@ class MATLAB_Lexer(Token_Generator):
 
             elif self.cc.isalpha():
                 # Could be an identifier or keyword
-                kind = "IDENTIFIER"
+                kind = IDENTIFIER
                 while self.nc.isalnum() or self.nc == "_":
                     self.next()
 
             elif self.cc.isnumeric() or \
                  self.cc == "." and self.nc.isnumeric():
                 # Its some kind of number
-                kind = "NUMBER"
+                kind = NUMBER
                 tmp = self.match_re(
                     r"([0-9]+(\.[0-9]*)?([eE][+-]?[0-9]+)?[iIjJ]?)|"
                     r"(\.[0-9]+([eE][+-]?[0-9]+)?[iIjJ]?)")
@@ -545,26 +564,26 @@ class MATLAB_Lexer(Token_Generator):
                 # assignment
                 if self.nc == "=":
                     self.next()
-                    kind = "OPERATOR"
+                    kind = OPERATOR
                 elif self.cc == "=":
-                    kind = "ASSIGNMENT"
+                    kind = ASSIGNMENT
                 else:
-                    kind = "OPERATOR"
+                    kind = OPERATOR
 
             elif self.cc in ("+", "-", "*", "/", "^", "\\"):
-                kind = "OPERATOR"
+                kind = OPERATOR
 
             elif self.cc in ("&", "|"):
-                kind = "OPERATOR"
+                kind = OPERATOR
                 if self.nc == self.cc:
                     self.next()
 
             elif self.cc == "." and self.nc in ("*", "/", "\\", "^", "'"):
-                kind = "OPERATOR"
+                kind = OPERATOR
                 self.next()
 
             elif self.cc == "." and self.nc == "?":
-                kind = "NVP_DELEGATE"
+                kind = NVP_DELEGATE
                 self.next()
 
             elif self.cc == "'":
@@ -578,25 +597,25 @@ class MATLAB_Lexer(Token_Generator):
                 # unicode in variable names as well?
                 kind = None
                 if preceeding_ws or self.first_in_line:
-                    kind = "CARRAY"
+                    kind = CARRAY
                     contains_quotes = True
-                elif self.last_kind in ("IDENTIFIER", "NUMBER",
-                                        "KET", "M_KET", "C_KET"):
-                    kind = "OPERATOR"
-                elif self.last_kind == "OPERATOR" and \
+                elif self.last_kind in (IDENTIFIER, NUMBER,
+                                        KET, M_KET, C_KET):
+                    kind = OPERATOR
+                elif self.last_kind == OPERATOR and \
                      self.last_value in (".'", "'"):
-                    kind = "OPERATOR"
-                elif self.last_kind in ("BRA", "M_BRA", "C_BRA", "COMMA",
-                                        "CARRAY",
-                                        "ASSIGNMENT", "OPERATOR", "SEMICOLON",
-                                        "COLON"):
-                    kind = "CARRAY"
+                    kind = OPERATOR
+                elif self.last_kind in (BRA, M_BRA, C_BRA, COMMA,
+                                        CARRAY,
+                                        ASSIGNMENT, OPERATOR, SEMICOLON,
+                                        COLON):
+                    kind = CARRAY
                     contains_quotes = True
                 else:
                     self.lex_error("unable to distinguish between string "
                                    "and transpose operation")
 
-                if kind == "CARRAY":
+                if kind == CARRAY:
                     while True:
                         self.next()
                         if self.cc == "'" and self.nc == "'":
@@ -607,7 +626,7 @@ class MATLAB_Lexer(Token_Generator):
                             self.lex_error()
 
             elif self.cc == '"':
-                kind = "STRING"
+                kind = STRING
                 contains_quotes = True
                 while True:
                     self.next()
@@ -619,22 +638,22 @@ class MATLAB_Lexer(Token_Generator):
                         self.lex_error()
 
             elif self.cc == ",":
-                kind = "COMMA"
+                kind = COMMA
 
             elif self.cc == ":":
-                kind = "COLON"
+                kind = COLON
 
             elif self.cc == "(":
-                kind = "BRA"
+                kind = BRA
 
             elif self.cc == ")":
-                kind = "KET"
+                kind = KET
 
             elif self.cc == "{":
-                kind = "C_BRA"
+                kind = C_BRA
 
             elif self.cc == "}":
-                kind = "C_KET"
+                kind = C_KET
 
             elif self.cc == "[":
                 # I have decided to not do what is described in section 7
@@ -646,25 +665,25 @@ class MATLAB_Lexer(Token_Generator):
                 # Instead we're going to do this as a post-processing step
                 # that delays returning from the lexer until we encounter
                 # an = after the coressponding closing bracket, or not.
-                kind = "M_BRA"
+                kind = M_BRA
 
             elif self.cc == "]":
-                kind = "M_KET"
+                kind = M_KET
 
             elif self.cc == ".":
-                kind = "SELECTION"
+                kind = SELECTION
 
             elif self.cc == "@":
-                kind = "AT"
+                kind = AT
 
             elif self.cc == "!":
                 # Shell escapes go up to the end of the line
                 while self.nc not in ("\n", "\0"):
                     self.next()
-                kind = "BANG"
+                kind = BANG
 
             elif self.cc == "?":
-                kind = "METACLASS"
+                kind = METACLASS
 
             else:
                 self.lex_error()
@@ -682,24 +701,24 @@ class MATLAB_Lexer(Token_Generator):
 
         # Classify keywords, except after selections. That way we
         # permit structure fields with names like "function".
-        if kind == "IDENTIFIER" and self.last_kind != "SELECTION":
+        if kind == IDENTIFIER and self.last_kind != SELECTION:
             if self.in_annotation and raw_text in ANNOTATION_KEYWORDS:
-                kind = "KEYWORD"
+                kind = KEYWORD
             elif not self.in_annotation and raw_text in KEYWORDS:
-                kind = "KEYWORD"
+                kind = KEYWORD
 
         # Keep track of blocks, and special sections where
         # command-form is disabled.
         if not self.bracket_stack:
-            if kind == "KEYWORD" and \
+            if kind == KEYWORD and \
                raw_text in ("classdef", "function",
                             "for", "if", "parfor", "switch",
                             "try", "while", "spmd"):
                 self.block_stack.append(raw_text)
 
-            if self.block_stack and kind == "IDENTIFIER":
+            if self.block_stack and kind == IDENTIFIER:
                 extra_kw = set()
-                if self.last_kind == "SELECTION":
+                if self.last_kind == SELECTION:
                     # Like with other keywords above, if the
                     # preceeding token is a field selection we never
                     # produce keywords.
@@ -726,13 +745,13 @@ class MATLAB_Lexer(Token_Generator):
                     extra_kw = {"arguments"}
 
                 if raw_text in extra_kw:
-                    kind = "KEYWORD"
+                    kind = KEYWORD
                     self.block_stack.append(raw_text)
                     if raw_text in ("properties", "events",
                                     "enumeration", "arguments"):
                         self.in_special_section = True
 
-            elif kind == "KEYWORD" and raw_text == "end":
+            elif kind == KEYWORD and raw_text == "end":
                 if self.block_stack:
                     self.block_stack.pop()
                 self.in_special_section = False
@@ -768,14 +787,14 @@ class MATLAB_Lexer(Token_Generator):
         ######################################################################
         # Postprocessing
 
-        if kind == "BRA" and self.last_kind == "AT":
+        if kind == BRA and self.last_kind == AT:
             self.in_lambda = True
 
-        if kind == "NEWLINE":
+        if kind == NEWLINE:
             self.line += token.raw_text.count("\n")
             self.first_in_line = True
             self.in_annotation = False
-        elif kind == "CONTINUATION":
+        elif kind == CONTINUATION:
             self.line += 1
             self.first_in_line = True
 
@@ -785,7 +804,7 @@ class MATLAB_Lexer(Token_Generator):
            not self.in_special_section and \
            not self.in_annotation and \
            token.first_in_statement and \
-           token.kind == "IDENTIFIER" and \
+           token.kind == IDENTIFIER and \
            self.nc in (" ", "\t"):
             # We need to scan ahead to the next non-space character
             mode = "search_ws"
@@ -874,12 +893,12 @@ class MATLAB_Lexer(Token_Generator):
         # Detect new statements. Note that this flags comments as
         # well, but that is fine.
         if not self.bracket_stack:
-            if kind in ("NEWLINE", "COMMA", "SEMICOLON"):
+            if kind in (NEWLINE, COMMA, SEMICOLON):
                 self.first_in_statement = True
                 self.command_mode = False
 
         # Detect block comment starts (and questionable block comments)
-        if token.kind == "COMMENT" and \
+        if token.kind == COMMENT and \
            ((self.block_comment == 0 and
              token.raw_text[1:2] == "{") or
             (self.block_comment > 0 and
@@ -901,7 +920,7 @@ class MATLAB_Lexer(Token_Generator):
             else:
                 self.block_comment += 1
 
-        elif self.block_comment and token.kind == "COMMENT":
+        elif self.block_comment and token.kind == COMMENT:
             for c in self.comment_char:
                 marker = c + "}"
                 if marker in token.raw_text:
@@ -916,17 +935,17 @@ class MATLAB_Lexer(Token_Generator):
         self.last_kind = kind
         self.last_value = raw_text
 
-        if token.kind in ("BRA", "M_BRA", "C_BRA"):
+        if token.kind in (BRA, M_BRA, C_BRA):
             self.bracket_stack.append(token)
-        elif token.kind in ("KET", "M_KET", "C_KET"):
+        elif token.kind in (KET, M_KET, C_KET):
             if self.bracket_stack:
                 matching_bracket = self.bracket_stack.pop()
-                if (token.kind == "KET" and
-                    matching_bracket.kind != "BRA") or \
-                   (token.kind == "M_KET" and
-                    matching_bracket.kind != "M_BRA") or \
-                   (token.kind == "C_KET" and
-                    matching_bracket.kind != "C_BRA"):
+                if (token.kind == KET and
+                    matching_bracket.kind != BRA) or \
+                   (token.kind == M_KET and
+                    matching_bracket.kind != M_BRA) or \
+                   (token.kind == C_KET and
+                    matching_bracket.kind != C_BRA):
                     self.mh.lex_error(token.location,
                                       "mismatched brackets %s ... %s" %
                                       (matching_bracket.raw_text,
@@ -945,8 +964,8 @@ class MATLAB_Lexer(Token_Generator):
         # Determine if whitespace is currently significant (i.e. we're
         # in a matrix).
         ws_is_significant = (self.bracket_stack and
-                             self.bracket_stack[-1].kind in ("M_BRA",
-                                                             "C_BRA") and
+                             self.bracket_stack[-1].kind in (M_BRA,
+                                                             C_BRA) and
                              self.bracket_stack[-1] != token)
 
         # Determine if there is whitespace after the current token
@@ -980,16 +999,16 @@ class MATLAB_Lexer(Token_Generator):
         # tokens. token_relevant is set to true if have such a token.
         # TODO: This doesn't deal with continuations yet, and it
         # probably won't work correctly.
-        token_relevant = (token.kind in ("IDENTIFIER",
-                                         "NUMBER",
-                                         "CARRAY",
-                                         "STRING",
-                                         "KET",
-                                         "M_KET",
-                                         "C_KET") or
-                          (token.kind == "KEYWORD" and
+        token_relevant = (token.kind in (IDENTIFIER,
+                                         NUMBER,
+                                         CARRAY,
+                                         STRING,
+                                         KET,
+                                         M_KET,
+                                         C_KET) or
+                          (token.kind == KEYWORD and
                            token.value == "end") or
-                          (token.kind == "OPERATOR" and
+                          (token.kind == OPERATOR and
                            token.value in ("'", ".'")))
 
         # Look at the next 2 characters that are not whitespace. Lets
@@ -1059,7 +1078,7 @@ class MATLAB_Lexer(Token_Generator):
                     # +6... -.1
                     self.add_comma = True
 
-        if self.in_lambda and token.kind == "KET":
+        if self.in_lambda and token.kind == KET:
             self.add_comma = False
             self.in_lambda = False
 
@@ -1077,15 +1096,15 @@ class MATLAB_Lexer(Token_Generator):
         if tok is None:
             return None
 
-        if len(self.bracket_stack) > 1 or tok.kind != "M_BRA":
+        if len(self.bracket_stack) > 1 or tok.kind != M_BRA:
             # We're in a nested context, or this is not a [. Just
             # return the token.
             return tok
 
         open_bracket = tok
-        if open_bracket.kind != "M_BRA":
+        if open_bracket.kind != M_BRA:
             raise ICE("supposed open bracket is %s instead" %
-                      open_bracket.kind)
+                      TOKEN_KIND_NAME[open_bracket.kind])
 
         # We have a top-level [. So now we squirrel away tokens until
         # we get to the matching closing bracket.
@@ -1097,9 +1116,9 @@ class MATLAB_Lexer(Token_Generator):
                 break
 
         close_bracket = self.delay_list[-1]
-        if close_bracket is not None and close_bracket.kind != "M_KET":
+        if close_bracket is not None and close_bracket.kind != M_KET:
             raise ICE("supposed close bracket is %s instead" %
-                      close_bracket.kind)
+                      TOKEN_KIND_NAME[close_bracket.kind])
 
         # Now we add more until we hit an assignment or not a
         # continuation
@@ -1108,16 +1127,16 @@ class MATLAB_Lexer(Token_Generator):
             self.delay_list.append(tok)
             if tok is None:
                 break
-            elif tok.kind == "CONTINUATION":
+            elif tok.kind == CONTINUATION:
                 continue
             else:
                 break
 
         # Now we check if we have an =
         tok = self.delay_list[-1]
-        if tok and tok.kind == "ASSIGNMENT":
-            open_bracket.kind = "A_BRA"
-            close_bracket.kind = "A_KET"
+        if tok and tok.kind == ASSIGNMENT:
+            open_bracket.kind = A_BRA
+            close_bracket.kind = A_KET
 
         # Finally, start by returning the first token
         tok = self.delay_list.pop(0)
@@ -1144,6 +1163,14 @@ class Token_Buffer(Token_Generator):
             else:
                 self.tokens.append(tok)
 
+        self.significant = None
+        # Index of all tokens relevant for parsing, built on demand
+
+    def parser_tokens(self):
+        if self.significant is None:
+            self.significant = list(significant_tokens(self.tokens))
+        return self.significant
+
     def token(self):
         if self.pos < len(self.tokens):
             tok = self.tokens[self.pos]
@@ -1177,7 +1204,7 @@ class Token_Buffer(Token_Generator):
 
     #     def set_last_in_line():
     #         rv["last_in_line"] = (rv["next_token"] and
-    #                               rv["next_token"].kind == "NEWLINE")
+    #                               rv["next_token"].kind == NEWLINE)
 
     #     def advance():
     #         rv["id"] = self.pos
@@ -1194,7 +1221,7 @@ class Token_Buffer(Token_Generator):
     #             rv["ws_before"] = (tok.location.col_start -
     #                                rv["prev_in_line"].location.col_end) - 1
 
-    #         if not rv["next_token"] or rv["next_token"].kind == "NEWLINE":
+    #         if not rv["next_token"] or rv["next_token"].kind == NEWLINE:
     #             rv["next_in_line"] = None
     #             rv["ws_after"] = None
     #         else:
@@ -1206,19 +1233,19 @@ class Token_Buffer(Token_Generator):
 
     def autofix(self, token):
         if token.fix.change_to_semicolon:
-            token.kind = "SEMICOLON"
+            token.kind = SEMICOLON
             token.raw_text = ";"
             token.value = ";"
             token.fix.ensure_trim_before = True
         elif token.fix.replace_with_newline:
-            assert token.kind == "CONTINUATION"
+            assert token.kind == CONTINUATION
             token.fix.replace_with_newline = False
             if token.value == "":
-                token.kind = "NEWLINE"
+                token.kind = NEWLINE
                 token.raw_text = "\n"
                 token.value = "\n"
             else:
-                token.kind = "COMMENT"
+                token.kind = COMMENT
                 token.value = token.value.lstrip("%").strip()
                 token.raw_text = "% " + token.value
                 token.fix.add_newline = True
@@ -1233,23 +1260,25 @@ class Token_Buffer(Token_Generator):
 
         # Adjust whitespace of tokens surrounding deleted tokens
         if where == "before":
-            if token.kind in ("BRA", "C_BRA", "M_BRA"):
+            if token.kind in (BRA, C_BRA, M_BRA):
                 token.fix.ensure_trim_after = True
-            elif token.kind in ("SEMICOLON", "COMMA"):
+            elif token.kind in (SEMICOLON, COMMA):
                 token.fix.ensure_ws_after = True
                 token.fix.ensure_maxgap_after = True
             else:
                 token.fix.ensure_maxgap_after = True
         else:
-            if token.kind in ("KET", "C_KET", "M_KET"):
+            if token.kind in (KET, C_KET, M_KET):
                 token.fix.ensure_trim_before = True
-            elif token.kind in ("SEMICOLON", "COMMA"):
+            elif token.kind in (SEMICOLON, COMMA):
                 token.fix.ensure_trim_before = True
                 token.fix.ensure_maxgap_before = True
             else:
                 token.fix.ensure_maxgap_before = True
 
     def replay(self):
+        indent = config.active(self.cfg, "indentation")
+
         # Strip all tokens marked with delete
         new_tokens = []
         token_deleted = False
@@ -1282,22 +1311,35 @@ class Token_Buffer(Token_Generator):
                     token_deleted = False
 
                     # We might have to fix up indentation
-                    if new_tokens[-1].first_in_statement and \
-                       config.active(self.cfg, "indentation"):
+                    if new_tokens[-1].first_in_statement and indent:
                         if new_tokens[-1].ast_link:
                             new_tokens[-1].fix.correct_indent = (
                                 new_tokens[-1].ast_link.get_indentation() *
                                 self.cfg["tab_width"])
 
-        # Add newlines
+        # Add newlines, and strip (now) duplicate newlines. We do
+        # both in the same pass: each token is compared to the last
+        # one we have kept.
         tmp_tokens = new_tokens
         new_tokens = []
+
+        def keep(token):
+            if new_tokens and \
+               new_tokens[-1].kind == NEWLINE and \
+               token.kind == NEWLINE:
+                old_token = new_tokens[-1]
+                if len(token.raw_text) == 1 and len(old_token.raw_text) == 1:
+                    old_token.raw_text += "\n"
+                    old_token.value += "\n"
+            else:
+                new_tokens.append(token)
+
         newline_added = False
         shift_lines = 0
         previous_token = None
         for token in tmp_tokens:
             token.location.line += shift_lines
-            new_tokens.append(token)
+            keep(token)
 
             # We've previously added a new-line. This means we need to
             # tidy up this token (specifically we need to indent it
@@ -1306,7 +1348,7 @@ class Token_Buffer(Token_Generator):
                 newline_added = False
                 token.first_in_line = True
                 token.first_in_statement = True
-                if config.active(self.cfg, "indentation"):
+                if indent:
                     if token.ast_link:
                         token.fix.correct_indent = (
                             token.ast_link.get_indentation() *
@@ -1319,32 +1361,18 @@ class Token_Buffer(Token_Generator):
             # This token requires a newline to be inserted.
             if token.fix.add_newline:
                 newline_added = True
-                new_tokens.append(m_ast.MATLAB_Token("NEWLINE", "\n",
-                                                     token.location,
-                                                     False, False,
-                                                     anonymous = True))
+                keep(m_ast.MATLAB_Token(NEWLINE, "\n",
+                                        token.location,
+                                        False, False,
+                                        anonymous = True))
                 shift_lines += 1
 
             previous_token = token
 
-        # Strip (now) duplicate newlines
-        tmp_tokens = new_tokens
-        new_tokens = []
-        old_token = None
-        for token in tmp_tokens:
-            if old_token and \
-               old_token.kind == "NEWLINE" and \
-               token.kind == "NEWLINE":
-                if len(token.raw_text) == 1 and len(old_token.raw_text) == 1:
-                    old_token.raw_text += "\n"
-                    old_token.value += "\n"
-                continue
-            new_tokens.append(token)
-            old_token = token
-
         # Regurgitate the processed tokens to re-create the source
-        # file, including comments
-        rv = ""
+        # file, including comments. We collect the pieces and join
+        # them at the end, so this is linear in the size of the file.
+        rv = []
         for n, token in enumerate(new_tokens):
             if n + 1 < len(new_tokens):
                 next_token = new_tokens[n + 1]
@@ -1356,36 +1384,35 @@ class Token_Buffer(Token_Generator):
                 next_in_line = None
 
             if token.first_in_line:
-                if config.active(self.cfg, "indentation") and \
-                   token.fix.correct_indent is not None:
-                    rv += " " * token.fix.correct_indent
+                if indent and token.fix.correct_indent is not None:
+                    rv.append(" " * token.fix.correct_indent)
                 else:
-                    rv += " " * token.location.col_start
+                    rv.append(" " * token.location.col_start)
 
-            if token.kind == "NEWLINE":
+            if token.kind == NEWLINE:
                 amount = min(2, token.raw_text.count("\n"))
                 if n + 1 == len(new_tokens):
                     # At the end of a file, we have at most one
                     # newline. This newline is inserted manually at
                     # the end
                     amount = 0
-                rv += "\n" * amount
-            elif token.kind == "CONTINUATION":
-                rv += token.raw_text.rstrip() + "\n"
+                rv.append("\n" * amount)
+            elif token.kind == CONTINUATION:
+                rv.append(token.raw_text.rstrip() + "\n")
             else:
-                rv += token.raw_text.rstrip()
+                rv.append(token.raw_text.rstrip())
 
             if token.fix.add_semicolon_after:
-                rv += ";"
+                rv.append(";")
 
-            if next_in_line and next_in_line.kind != "NEWLINE":
+            if next_in_line and next_in_line.kind != NEWLINE:
                 gap = (next_in_line.location.col_start -
                        (token.location.col_end + 1))
                 # At most one space, unless we have a comment, then
                 # it's ok for purposes of indentation
                 #
                 # This can mess up some nice alignment, so disabled for now
-                # if next_in_line.kind not in ("COMMENT", "CONTINUATION"):
+                # if next_in_line.kind not in (COMMENT, CONTINUATION):
                 #    gap = min(gap, 1)
 
                 if (token.fix.ensure_ws_after or
@@ -1399,7 +1426,7 @@ class Token_Buffer(Token_Generator):
                 if token.fix.ensure_maxgap_after or \
                    next_in_line.fix.ensure_maxgap_before:
 
-                    if next_in_line.kind == "COMMENT":
+                    if next_in_line.kind == COMMENT:
                         # We leave comments alone in this scenario,
                         # since we don't want to break any vertical
                         # alignment
@@ -1407,17 +1434,17 @@ class Token_Buffer(Token_Generator):
                     else:
                         gap = min(gap, 1)
 
-                rv += " " * gap
-        rv += "\n"
+                rv.append(" " * gap)
+        rv.append("\n")
 
-        return rv
+        return "".join(rv)
 
     def debug_validate_links(self):
         for token in self.tokens:
-            if token.kind in ("NEWLINE",
-                              "COMMENT",
-                              "CONTINUATION",
-                              "ANNOTATION"):
+            if token.kind in (NEWLINE,
+                              COMMENT,
+                              CONTINUATION,
+                              ANNOTATION):
                 # These tokens are not linked
                 pass
 
@@ -1446,7 +1473,7 @@ def sanity_test(mh, filename):
                     txt = ""
                 if tok.annotation:
                     txt += "ANNOTATION "
-                txt += tok.kind
+                txt += TOKEN_KIND_NAME[tok.kind]
                 if tok.value is not None and tok.value != tok.raw_text:
                     txt += " " + repr(tok.value)
                 mh.info(tok.location, txt)
@@ -34,7 +34,7 @@ from m_ast import *
 from m_lexer import Token_Generator, MATLAB_Lexer, Token_Buffer
 
 
-IGNORED_TOKENS = frozenset(["COMMENT"])
+IGNORED_TOKENS = frozenset([COMMENT])
 
 
 # Operator precedence as of MATLAB 2019b
@@ -76,6 +76,34 @@ IGNORED_TOKENS = frozenset(["COMMENT"])
 #
 # 12. Short-circuit OR (||)
 
+PREFIX_OPERATORS = frozenset(["+", "-", "~"])
+# Operators of precedence 4.
+
+POWER_OPERATORS = frozenset(["^", ".^"])
+POSTFIX_OPERATORS = frozenset(["'", ".'"])
+# Operators of precedence 2 (and 3).
+
+BINARY_OPERATORS = {
+    "*"  : 5, ".*" : 5,
+    "/"  : 5, "./" : 5,
+    "\\" : 5, ".\\" : 5,
+    "+"  : 6, "-"  : 6,
+    "<"  : 8, "<=" : 8,
+    ">"  : 8, ">=" : 8,
+    "==" : 8, "~=" : 8,
+    "&"  : 9,
+    "|"  : 10,
+    "&&" : 11,
+    "||" : 12,
+}
+# Binary operators of precedence 5 to 12, mapped to their
+# precedence. The colon (7) is not included since ranges are not
+# really a binary operator.
+
+PRECEDENCE_RANGE    = 7
+PRECEDENCE_RELATION = 8
+PRECEDENCE_MAX      = 12
+
 
 class MATLAB_Parser:
     def __init__(self, mh, lexer, cfg):
@@ -105,16 +133,30 @@ class MATLAB_Parser:
         #
         # Curiously mlint seems to share this bug.
 
+        tokens = lexer.parser_tokens()
+        if isinstance(tokens, list):
+            self.tokens       = tokens
+            self.token_stream = None
+        else:
+            self.tokens       = []
+            self.token_stream = tokens
+        # All tokens relevant for parsing. If the lexer does not
+        # provide them in advance, we pull them from the token stream
+        # as we go.
+
+        self.pos = -1
+        # Index of the current token
+
         # pylint: disable=invalid-name
-        self.ct  = None
-        self.nt  = None
-        self.nnt = None
+        self.ct = None
+        self.nt = self.lookahead(1)
         # pylint: enable=invalid-name
 
         self.debug_tree = False
 
-        self.next()
-        self.next()
+        self.next_uid = 1
+        # The id for the next node of the tree we build. Node ids are
+        # unique per tree; they are given out by finish_tree.
 
     def sc_context(self, enabled):
         assert isinstance(enabled, bool)
@@ -157,86 +199,109 @@ class MATLAB_Parser:
         return False
 
     def next(self):
+        self.pos += 1
         self.ct = self.nt
-        self.nt = self.nnt
-        self.nnt = self.lexer.token()
 
-        def should_skip(token):
-            if not token:
-                return False
-            if token.kind in ("COMMENT",
-                              "CONTINUATION",
-                              "ANNOTATION"):
-                return True
-            if token.annotation and token.kind == "NEWLINE":
-                return True
-            return False
+        # When reading tokens on demand we always keep two tokens of
+        # lookahead, so that lex errors are raised at the same point
+        # as they would be when everything is lexed in advance.
+        if self.token_stream:
+            self.fill(self.pos + 2)
 
-        while self.nnt:
-            # Skip comments, continuations and annotation indications
-            while should_skip(self.nnt):
-                self.nnt = self.lexer.token()
-
-            # Join new-lines
-            if (self.nnt and
-                self.nt and
-                self.nnt.kind == "NEWLINE" and
-                self.nt.kind == "NEWLINE"):
-                self.nnt = self.lexer.token()
+        if self.pos + 1 < len(self.tokens):
+            self.nt = self.tokens[self.pos + 1]
+        else:
+            self.nt = None
+
+    def fill(self, idx):
+        # Make sure tokens up to and including idx are available (if
+        # they exist)
+        while self.token_stream and idx >= len(self.tokens):
+            tok = next(self.token_stream, None)
+            if tok is None:
+                self.token_stream = None
             else:
-                break
+                self.tokens.append(tok)
+
+    def lookahead(self, n):
+        # Returns the token n positions after the current token (so
+        # lookahead(1) is nt), or None if we would go past the end of
+        # file.
+        assert isinstance(n, int) and n >= 1
+
+        idx = self.pos + n
+        if self.token_stream:
+            self.fill(max(idx, self.pos + 2))
+        if idx < len(self.tokens):
+            return self.tokens[idx]
+        else:
+            return None
 
     def match(self, kind, value=None):
         assert kind in TOKEN_KINDS
         self.next()
         if self.ct is None:
             self.mh.error(self.lexer.get_file_loc(),
-                          "expected %s, reached EOF instead" % kind)
+                          "expected %s, reached EOF instead" %
+                          TOKEN_KIND_NAME[kind])
         elif self.ct.annotation:
             self.mh.error(self.ct.location,
                           "expected %s, "
                           "found miss_hit annotation instead" %
-                          kind)
+                          TOKEN_KIND_NAME[kind])
         elif self.ct.kind != kind:
             if value:
                 self.mh.error(self.ct.location,
                               "expected %s(%s), found %s instead" %
-                              (kind, value, self.ct.kind))
+                              (TOKEN_KIND_NAME[kind],
+                               value,
+                               TOKEN_KIND_NAME[self.ct.kind]))
             else:
                 self.mh.error(self.ct.location,
-                              "expected %s, found %s instead" % (kind,
-                                                                 self.ct.kind))
+                              "expected %s, found %s instead" %
+                              (TOKEN_KIND_NAME[kind],
+                               TOKEN_KIND_NAME[self.ct.kind]))
 
         elif value and self.ct.value != value:
             self.mh.error(self.ct.location,
                           "expected %s(%s), found %s(%s) instead" %
-                          (kind, value, self.ct.kind, self.ct.value))
+                          (TOKEN_KIND_NAME[kind],
+                           value,
+                           TOKEN_KIND_NAME[self.ct.kind],
+                           self.ct.value))
 
     def amatch(self, kind, value=None):
         assert kind in TOKEN_KINDS
         self.next()
         if self.ct is None:
             self.mh.error(self.lexer.get_file_loc(),
-                          "expected %s, reached EOF instead" % kind)
+                          "expected %s, reached EOF instead" %
+                          TOKEN_KIND_NAME[kind])
         elif not self.ct.annotation:
             self.mh.error(self.ct.location,
                           "expected %s annotation, "
                           "found normal program text instead" %
-                          kind)
+                          TOKEN_KIND_NAME[kind])
         elif self.ct.kind != kind:
             if value:
                 self.mh.error(self.ct.location,
                               "expected %s(%s), found %s instead" %
-                              (kind, value, self.ct.kind))
+                              (TOKEN_KIND_NAME[kind],
+                               value,
+                               TOKEN_KIND_NAME[self.ct.kind]))
             else:
                 self.mh.error(self.ct.location,
-                              "expected %s, found %s instead" % (kind,
-                                                                 self.ct.kind))
+                              "expected %s, found %s instead" %
+                              (TOKEN_KIND_NAME[kind],
+                               TOKEN_KIND_NAME[self.ct.kind]))
 
         elif value and self.ct.value != value:
             self.mh.error(self.ct.location,
                           "expected %s(%s), found %s(%s) instead" %
-                          (kind, value, self.ct.kind, self.ct.value))
+                          (TOKEN_KIND_NAME[kind],
+                           value,
+                           TOKEN_KIND_NAME[self.ct.kind],
+                           self.ct.value))
 
     def match_eof(self):
         self.next()
@@ -245,11 +310,11 @@ class MATLAB_Parser:
                 self.mh.error(self.ct.location,
                               "expected end of file, "
                               "found annotation %s instead" %
-                              self.ct.kind)
+                              TOKEN_KIND_NAME[self.ct.kind])
             else:
                 self.mh.error(self.ct.location,
                               "expected end of file, found %s instead" %
-                              self.ct.kind)
+                              TOKEN_KIND_NAME[self.ct.kind])
 
     def peek_annotation(self):
         return self.nt and self.nt.annotation
@@ -280,13 +345,14 @@ class MATLAB_Parser:
 
     def peek2(self, kind, value=None):
         assert kind in TOKEN_KINDS
-        if self.nnt and \
-           self.nnt.kind == kind and \
-           not self.nnt.annotation:
+        nnt = self.lookahead(2)
+        if nnt and \
+           nnt.kind == kind and \
+           not nnt.annotation:
             if value is None:
                 return True
             else:
-                return self.nnt.value == value
+                return nnt.value == value
         else:
             return False
 
@@ -320,9 +386,9 @@ class MATLAB_Parser:
     # Parsing
 
     def peek_eos(self):
-        return self.peek("SEMICOLON") or \
-            self.peek("COMMA") or \
-            self.peek("NEWLINE")
+        return self.peek(SEMICOLON) or \
+            self.peek(COMMA) or \
+            self.peek(NEWLINE)
 
     def match_eos(self, n_ast, semi = "", allow_nothing = False):
         """Match end-of-statement
@@ -354,10 +420,10 @@ class MATLAB_Parser:
             self.ct.set_ast(n_ast)
             self.ct.fix.statement_terminator = True
             terminator_tokens.append(self.ct)
-            if self.ct.kind == "NEWLINE" and first_newline is None:
+            if self.ct.kind == NEWLINE and first_newline is None:
                 first_newline = len(terminator_tokens) - 1
                 break
-        while self.peek_eos():  # and not self.peek("NEWLINE"):
+        while self.peek_eos():  # and not self.peek(NEWLINE):
             self.next()
             self.ct.set_ast(n_ast)
             self.ct.fix.statement_terminator = True
@@ -391,7 +457,8 @@ class MATLAB_Parser:
             else:
                 self.mh.error(self.nt.location,
                               "expected end of statement,"
-                              " found %s instead" % self.nt.kind)
+                              " found %s instead" %
+                              TOKEN_KIND_NAME[self.nt.kind])
             raise ICE("logic error")
         assert len(terminator_tokens) >= 1
 
@@ -401,10 +468,10 @@ class MATLAB_Parser:
         if semi:
             # Exactly two tokens are required and useful. The first
             # semicolon, and the first new_line.
-            if terminator_tokens[0].kind == "SEMICOLON":
+            if terminator_tokens[0].kind == SEMICOLON:
                 pass
 
-            elif terminator_tokens[0].kind == "COMMA":
+            elif terminator_tokens[0].kind == COMMA:
                 self.mh.style_issue(terminator_tokens[0].location,
                                     "end this with a semicolon"
                                     " instead of a comma",
@@ -412,7 +479,7 @@ class MATLAB_Parser:
                 terminator_tokens[0].fix.change_to_semicolon = True
 
             else:
-                assert terminator_tokens[0].kind == "NEWLINE"
+                assert terminator_tokens[0].kind == NEWLINE
                 self.mh.style_issue(ending_token.location,
                                     "end statement with a semicolon",
                                     True)
@@ -431,7 +498,7 @@ class MATLAB_Parser:
             # Exactly one token is required and useful. The first new
             # line.
             if not config.active(self.cfg, "indentation") and \
-               terminator_tokens[0].kind == "COMMA":
+               terminator_tokens[0].kind == COMMA:
                 # The statement was ended with a comma. Ideally we
                 # just have a newline, but since we're not fixing
                 # indetation we can't fix it. Complain instead about
@@ -442,7 +509,7 @@ class MATLAB_Parser:
                 if first_newline is None:
                     terminator_tokens[0].fix.change_to_semicolon = True
 
-            elif terminator_tokens[0].kind != "NEWLINE":
+            elif terminator_tokens[0].kind != NEWLINE:
                 fixed = False
                 if first_newline is None:
                     # We can only fix a missing newline if indentation
@@ -459,7 +526,7 @@ class MATLAB_Parser:
                                     fixed)
 
         for terminator in terminator_tokens[1:]:
-            if terminator.kind != "NEWLINE":
+            if terminator.kind != NEWLINE:
                 self.mh.style_issue(terminator.location,  # Molten steel?
                                     "unnecessary statement terminator",
                                     True)
@@ -478,20 +545,20 @@ class MATLAB_Parser:
         # The exception to this is 'end', since that is generally
         # allowed since it makes parsing expressions using ranges much
         # easier.
-        if self.peek("OPERATOR", "~") and allow_void:
-            self.match("OPERATOR")
+        if self.peek(OPERATOR, "~") and allow_void:
+            self.match(OPERATOR)
             return Identifier(self.ct)
-        elif self.peek("KEYWORD", "end"):
-            self.match("KEYWORD", "end")
+        elif self.peek(KEYWORD, "end"):
+            self.match(KEYWORD, "end")
             return Identifier(self.ct)
-        elif allow_some_keywords and self.peek("KEYWORD", "import"):
-            self.match("KEYWORD", "import")
+        elif allow_some_keywords and self.peek(KEYWORD, "import"):
+            self.match(KEYWORD, "import")
             return Identifier(self.ct)
-        elif allow_some_keywords and self.peek("KEYWORD", "arguments"):
-            self.match("KEYWORD", "arguments")
+        elif allow_some_keywords and self.peek(KEYWORD, "arguments"):
+            self.match(KEYWORD, "arguments")
             return Identifier(self.ct)
         else:
-            self.match("IDENTIFIER")
+            self.match(IDENTIFIER)
             return Identifier(self.ct)
 
     def parse_name(self, allow_void):
@@ -523,30 +590,30 @@ class MATLAB_Parser:
         # Then we can see if we have a superclass reference. What
         # follows are pretty different parse rules for the two cases.
 
-        if self.peek("AT"):
-            self.match("AT")
+        if self.peek(AT):
+            self.match(AT)
             t_at = self.ct
             at_prefix = rv
             at_suffix = self.parse_simple_name()
-            if self.peek("BRA"):
+            if self.peek(BRA):
                 at_suffix = Reference(at_suffix)
                 at_suffix.set_arguments(self.parse_argument_list(at_suffix))
 
             return Superclass_Reference(t_at, at_prefix, at_suffix)
 
         else:
-            while (self.peek("SELECTION") or
-                   self.peek("BRA") or
-                   self.peek("C_BRA")):
-                if self.peek("SELECTION"):
-                    self.match("SELECTION")
+            while (self.peek(SELECTION) or
+                   self.peek(BRA) or
+                   self.peek(C_BRA)):
+                if self.peek(SELECTION):
+                    self.match(SELECTION)
                     tok = self.ct
 
-                    if self.peek("BRA"):
-                        self.match("BRA")
+                    if self.peek(BRA):
+                        self.match(BRA)
                         t_open = self.ct
                         dyn_field = self.parse_expression()
-                        self.match("KET")
+                        self.match(KET)
                         t_close = self.ct
                         rv = Dynamic_Selection(tok, rv, dyn_field)
                         t_open.set_ast(rv)
@@ -554,13 +621,14 @@ class MATLAB_Parser:
                     else:
                         field = self.parse_identifier(allow_void=False)
                         rv = Selection(tok, rv, field)
-                elif self.peek("BRA"):
+                elif self.peek(BRA):
                     rv = Reference(rv)
                     rv.set_arguments(self.parse_argument_list(rv))
-                elif self.peek("C_BRA"):
+                elif self.peek(C_BRA):
                     rv = self.parse_cell_reference(rv)
                 else:
-                    raise ICE("impossible path (nt.kind = %s)" % self.nt.kind)
+                    raise ICE("impossible path (nt.kind = %s)" %
+                              TOKEN_KIND_NAME[self.nt.kind])
 
             return rv
 
@@ -573,16 +641,17 @@ class MATLAB_Parser:
 
         # We need to lookahead 2 here to avoid parsing dynamic fields
 
-        while self.peek("SELECTION") and not self.peek2("BRA"):
-            if self.peek("SELECTION"):
-                self.match("SELECTION")
+        while self.peek(SELECTION) and not self.peek2(BRA):
+            if self.peek(SELECTION):
+                self.match(SELECTION)
                 tok = self.ct
                 field = self.parse_identifier(
                     allow_void=allow_void,
                     allow_some_keywords=allow_some_keywords)
                 rv = Selection(tok, rv, field)
             else:
-                raise ICE("impossible path (nt.kind = %s)" % self.nt.kind)
+                raise ICE("impossible path (nt.kind = %s)" %
+                          TOKEN_KIND_NAME[self.nt.kind])
 
         return rv
 
@@ -595,13 +664,13 @@ class MATLAB_Parser:
         # them first until we arrive at the first interesting thing
         # that helps us decide.
         l_pragmas = []
-        while self.peek("NEWLINE") or self.apeek("KEYWORD", "pragma"):
-            if self.peek("NEWLINE"):
+        while self.peek(NEWLINE) or self.apeek(KEYWORD, "pragma"):
+            if self.peek(NEWLINE):
                 self.next()
             else:
                 l_pragmas.append(self.parse_annotation_pragma())
 
-        if self.peek("KEYWORD", "function"):
+        if self.peek(KEYWORD, "function"):
             l_functions, l_more_pragmas = self.parse_function_list()
             cunit = Function_File(os.path.basename(self.lexer.filename),
                                   self.lexer.get_file_loc(),
@@ -609,7 +678,7 @@ class MATLAB_Parser:
                                   l_functions,
                                   self.lexer.in_class_directory,
                                   l_pragmas + l_more_pragmas)
-        elif self.peek("KEYWORD", "classdef") or self.lexer.in_class_directory:
+        elif self.peek(KEYWORD, "classdef") or self.lexer.in_class_directory:
             cunit = self.parse_class_file(l_pragmas)
         else:
             cunit = self.parse_script_file(l_pragmas)
@@ -619,6 +688,8 @@ class MATLAB_Parser:
 
         self.match_eof()
 
+        self.next_uid = cunit.finish_tree(self.next_uid)
+
         return cunit
 
     def parse_script_file(self, l_pragmas):
@@ -628,7 +699,7 @@ class MATLAB_Parser:
         self.functions_require_end = True
         statements = []
         while not self.peek_eof():
-            if self.peek("KEYWORD", "function"):
+            if self.peek(KEYWORD, "function"):
                 break
             else:
                 statements.append(self.parse_statement())
@@ -661,9 +732,9 @@ class MATLAB_Parser:
     def parse_function_list(self):
         l_functions = []
         l_pragmas = []
-        while self.peek("KEYWORD", "function") or \
-              self.apeek("KEYWORD", "pragma"):
-            if self.peek("KEYWORD", "function"):
+        while self.peek(KEYWORD, "function") or \
+              self.apeek(KEYWORD, "pragma"):
+            if self.peek(KEYWORD, "function"):
                 l_functions.append(self.parse_function_def())
             else:
                 l_pragmas.append(self.parse_annotation_pragma())
@@ -698,35 +769,35 @@ class MATLAB_Parser:
 
         # Parse returns. Either 'x' or a list '[x, y]'
         l_outputs = []
-        if self.peek("A_BRA"):
+        if self.peek(A_BRA):
             out_brackets = True
-            self.match("A_BRA")
+            self.match(A_BRA)
             self.ct.set_ast(rv)
-            if self.peek("A_KET"):
-                self.match("A_KET")
+            if self.peek(A_KET):
+                self.match(A_KET)
                 self.ct.set_ast(rv)
             else:
                 while True:
                     l_outputs.append(self.parse_identifier(allow_void=True))
-                    if self.peek("COMMA"):
-                        self.match("COMMA")
+                    if self.peek(COMMA):
+                        self.match(COMMA)
                         self.ct.set_ast(rv)
                     else:
                         break
-                self.match("A_KET")
+                self.match(A_KET)
                 self.ct.set_ast(rv)
 
         else:
             out_brackets = False
             l_outputs.append(self.parse_simple_name())
 
-        if self.peek("BRA") and len(l_outputs) == 1 and not out_brackets:
+        if self.peek(BRA) and len(l_outputs) == 1 and not out_brackets:
             # This is a function that doesn't return anything, so
             # function foo(...
             n_name = l_outputs[0]
             l_outputs = []
 
-        elif self.peek("NEWLINE") and len(l_outputs) == 1 and not out_brackets:
+        elif self.peek(NEWLINE) and len(l_outputs) == 1 and not out_brackets:
             # As above, but without the brackets
             n_name = l_outputs[0]
             l_outputs = []
@@ -735,26 +806,26 @@ class MATLAB_Parser:
             # This is a normal function, so something like
             # function [a, b] = potato...
             # function a = potato...
-            self.match("ASSIGNMENT")
+            self.match(ASSIGNMENT)
             self.ct.set_ast(rv)
             n_name = self.parse_simple_name(allow_some_keywords=True)
 
         l_inputs = []
-        if self.peek("BRA"):
-            self.match("BRA")
+        if self.peek(BRA):
+            self.match(BRA)
             self.ct.set_ast(rv)
-            if self.peek("KET"):
-                self.match("KET")
+            if self.peek(KET):
+                self.match(KET)
                 self.ct.set_ast(rv)
             else:
                 while True:
                     l_inputs.append(self.parse_identifier(allow_void=True))
-                    if self.peek("COMMA"):
-                        self.match("COMMA")
+                    if self.peek(COMMA):
+                        self.match(COMMA)
                         self.ct.set_ast(rv)
                     else:
                         break
-                self.match("KET")
+                self.match(KET)
                 self.ct.set_ast(rv)
 
         rv.set_name(n_name)
@@ -764,7 +835,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_function_def(self):
-        self.match("KEYWORD", "function")
+        self.match(KEYWORD, "function")
         self.push_context("function")
         t_fun = self.ct
 
@@ -775,11 +846,11 @@ class MATLAB_Parser:
         l_argval = []
 
         # First, deal with any argument validation blocks
-        while self.peek("KEYWORD", "arguments"):
+        while self.peek(KEYWORD, "arguments"):
             l_argval.append(self.parse_validation_block())
 
         # Then, process the rest of the function
-        while not self.peek("KEYWORD", "end") and not self.peek_eof():
+        while not self.peek(KEYWORD, "end") and not self.peek_eof():
             item = self.parse_statement()
             if isinstance(item, Function_Definition):
                 l_nested.append(item)
@@ -799,7 +870,7 @@ class MATLAB_Parser:
             pass
         else:
             self.functions_require_end = True
-            self.match("KEYWORD", "end")
+            self.match(KEYWORD, "end")
             rv.set_end(self.ct)
             self.match_eos(rv)
 
@@ -812,27 +883,27 @@ class MATLAB_Parser:
 
         properties = []
 
-        if self.peek("BRA"):
-            self.match("BRA")
+        if self.peek(BRA):
+            self.match(BRA)
             self.ct.set_ast(n_ast)
             while True:
                 n_pair = Name_Value_Pair(
                     self.parse_identifier(allow_void=False))
 
-                if self.peek("ASSIGNMENT"):
-                    self.match("ASSIGNMENT")
+                if self.peek(ASSIGNMENT):
+                    self.match(ASSIGNMENT)
                     t_eq = self.ct
                     n_value = self.parse_expression()
                     n_pair.set_value(t_eq, n_value)
 
                 properties.append(n_pair)
 
-                if self.peek("COMMA"):
-                    self.match("COMMA")
+                if self.peek(COMMA):
+                    self.match(COMMA)
                     self.ct.set_ast(n_ast)
                 else:
                     break
-            self.match("KET")
+            self.match(KET)
             self.ct.set_ast(n_ast)
 
         return properties
@@ -843,17 +914,17 @@ class MATLAB_Parser:
         # https://uk.mathworks.com/help/matlab/matlab_oop/property-validator-functions.html
         # https://www.mathworks.com/help/matlab/matlab_prog/function-argument-validation-1.html
 
-        if self.peek("KEYWORD", "arguments"):
-            self.match("KEYWORD", "arguments")
+        if self.peek(KEYWORD, "arguments"):
+            self.match(KEYWORD, "arguments")
         else:
-            self.match("KEYWORD", "properties")
+            self.match(KEYWORD, "properties")
         t_kw = self.ct
 
         rv = Special_Block(t_kw)
         rv.set_attributes(self.parse_name_value_pair_list(rv))
         self.match_eos(rv)
 
-        while not self.peek("KEYWORD", "end"):
+        while not self.peek(KEYWORD, "end"):
             # First the name we refer to
             if t_kw.value == "arguments":
                 n_name = self.parse_simple_name(allow_void=True)
@@ -862,8 +933,8 @@ class MATLAB_Parser:
 
             # We can have a delegation, or (more likely) an ordinary
             # constraint.
-            if t_kw.value == "arguments" and self.peek("NVP_DELEGATE"):
-                self.match("NVP_DELEGATE")
+            if t_kw.value == "arguments" and self.peek(NVP_DELEGATE):
+                self.match(NVP_DELEGATE)
 
                 delegation = Argument_Validation_Delegation(self.ct)
                 delegation.set_name(n_name)
@@ -885,29 +956,29 @@ class MATLAB_Parser:
 
                 # Dimension validation
                 val_dim = []
-                if self.peek("BRA"):
-                    self.match("BRA")
+                if self.peek(BRA):
+                    self.match(BRA)
                     self.ct.set_ast(cons)
 
                     while True:
-                        if self.peek("NUMBER"):
-                            self.match("NUMBER")
+                        if self.peek(NUMBER):
+                            self.match(NUMBER)
                             val_dim.append(self.ct)
-                        elif self.peek("COLON"):
-                            self.match("COLON")
+                        elif self.peek(COLON):
+                            self.match(COLON)
                             val_dim.append(self.ct)
                         else:
                             self.mh.error(self.nt.location,
                                           "dimension validation may contain"
                                           " only integral numbers or :")
 
-                        if self.peek("COMMA"):
-                            self.match("COMMA")
+                        if self.peek(COMMA):
+                            self.match(COMMA)
                             self.ct.set_ast(cons)
                         else:
                             break
 
-                    self.match("KET")
+                    self.match(KET)
                     self.ct.set_ast(cons)
 
                 if len(val_dim) == 1:
@@ -923,29 +994,29 @@ class MATLAB_Parser:
                     cons.set_dimension_constraints(val_dim)
 
                 # Class validation
-                if self.peek("IDENTIFIER"):
+                if self.peek(IDENTIFIER):
                     cons.set_class_constraint(self.parse_simple_name())
 
                 # Function validation
-                if self.peek("C_BRA"):
-                    self.match("C_BRA")
+                if self.peek(C_BRA):
+                    self.match(C_BRA)
                     self.ct.set_ast(cons)
 
                     while True:
                         cons.add_functional_constraint(
                             self.parse_name(allow_void=False))
-                        if self.peek("COMMA"):
-                            self.match("COMMA")
+                        if self.peek(COMMA):
+                            self.match(COMMA)
                             self.ct.set_ast(cons)
                         else:
                             break
 
-                    self.match("C_KET")
+                    self.match(C_KET)
                     self.ct.set_ast(cons)
 
                 # Default value
-                if self.peek("ASSIGNMENT"):
-                    self.match("ASSIGNMENT")
+                if self.peek(ASSIGNMENT):
+                    self.match(ASSIGNMENT)
                     self.ct.set_ast(cons)
                     cons.set_default_value(self.parse_expression())
 
@@ -953,7 +1024,7 @@ class MATLAB_Parser:
 
                 rv.add_constraint(cons)
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
 
@@ -965,20 +1036,20 @@ class MATLAB_Parser:
         # https://www.mathworks.com/help/matlab/matlab_oop/method-attributes.html
         # https://www.mathworks.com/help/matlab/matlab_oop/methods-in-separate-files.html
 
-        self.match("KEYWORD", "methods")
+        self.match(KEYWORD, "methods")
         t_kw = self.ct
 
         rv = Special_Block(t_kw)
         rv.set_attributes(self.parse_name_value_pair_list(rv))
         self.match_eos(rv)
 
-        while not self.peek("KEYWORD", "end"):
-            if self.peek("KEYWORD", "function"):
+        while not self.peek(KEYWORD, "end"):
+            if self.peek(KEYWORD, "function"):
                 rv.add_method(self.parse_function_def())
             else:
                 rv.add_method(self.parse_function_signature())
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
 
@@ -988,35 +1059,35 @@ class MATLAB_Parser:
         # Using:
         # https://uk.mathworks.com/help/matlab/matlab_oop/enumerations.html
 
-        self.match("KEYWORD", "enumeration")
+        self.match(KEYWORD, "enumeration")
         t_kw = self.ct
 
         rv = Special_Block(t_kw)
         self.match_eos(rv, allow_nothing=True)
 
-        while not self.peek("KEYWORD", "end"):
+        while not self.peek(KEYWORD, "end"):
             enum = Class_Enumeration(self.parse_identifier(allow_void=False))
 
-            if self.peek("BRA"):
-                self.match("BRA")
+            if self.peek(BRA):
+                self.match(BRA)
                 self.ct.set_ast(enum)
 
                 while True:
                     enum.add_argument(self.parse_expression())
-                    if self.peek("COMMA"):
-                        self.match("COMMA")
+                    if self.peek(COMMA):
+                        self.match(COMMA)
                         self.ct.set_ast(enum)
                     else:
                         break
 
-                self.match("KET")
+                self.match(KET)
                 self.ct.set_ast(enum)
 
             rv.add_enumeration(enum)
 
             self.match_eos(rv)
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
 
@@ -1025,17 +1096,17 @@ class MATLAB_Parser:
     def parse_class_events(self):
         # Using the syntax described in
         # https://www.mathworks.com/help/matlab/matlab_oop/events-and-listeners.html
-        self.match("KEYWORD", "events")
+        self.match(KEYWORD, "events")
         t_kw = self.ct
 
         rv = Special_Block(t_kw)
         self.match_eos(rv)
 
-        while not self.peek("KEYWORD", "end"):
+        while not self.peek(KEYWORD, "end"):
             rv.add_event(self.parse_identifier(allow_void=False))
             self.match_eos(rv)
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
 
@@ -1046,7 +1117,7 @@ class MATLAB_Parser:
         # https://uk.mathworks.com/help/matlab/matlab_oop/user-defined-classes.html
         # https://uk.mathworks.com/help/matlab/matlab_oop/class-components.html
 
-        self.match("KEYWORD", "classdef")
+        self.match(KEYWORD, "classdef")
         self.push_context("classdef")
         rv = Class_Definition(self.ct)
 
@@ -1058,16 +1129,16 @@ class MATLAB_Parser:
 
         # Inheritance
         l_super = []
-        if self.peek("OPERATOR", "<"):
-            self.match("OPERATOR", "<")
+        if self.peek(OPERATOR, "<"):
+            self.match(OPERATOR, "<")
             self.ct.set_ast(rv)
 
             while True:
                 sc_name = self.parse_simple_name()
                 l_super.append(sc_name)
 
-                if self.peek("OPERATOR", "&"):
-                    self.match("OPERATOR", "&")
+                if self.peek(OPERATOR, "&"):
+                    self.match(OPERATOR, "&")
                     self.ct.set_ast(rv)
                 else:
                     break
@@ -1076,22 +1147,22 @@ class MATLAB_Parser:
         self.match_eos(rv)
 
         while True:
-            if self.peek("KEYWORD", "properties"):
+            if self.peek(KEYWORD, "properties"):
                 rv.add_block(self.parse_validation_block())
-            elif self.peek("KEYWORD", "methods"):
+            elif self.peek(KEYWORD, "methods"):
                 rv.add_block(self.parse_class_methods())
-            elif self.peek("KEYWORD", "events"):
+            elif self.peek(KEYWORD, "events"):
                 rv.add_block(self.parse_class_events())
-            elif self.peek("KEYWORD", "enumeration"):
+            elif self.peek(KEYWORD, "enumeration"):
                 rv.add_block(self.parse_enumeration())
-            elif self.peek("KEYWORD", "end"):
+            elif self.peek(KEYWORD, "end"):
                 break
             else:
                 self.mh.error(self.nt.location,
                               "expected properties|methods|events|enumeration"
                               " inside classdef")
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -1102,7 +1173,7 @@ class MATLAB_Parser:
         statements = []
 
         while True:
-            if self.peek("KEYWORD") and self.nt.value in ("end",
+            if self.peek(KEYWORD) and self.nt.value in ("end",
                                                           "catch",
                                                           "case",
                                                           "otherwise",
@@ -1114,14 +1185,14 @@ class MATLAB_Parser:
         return Sequence_Of_Statements(statements)
 
     def parse_annotation_static_string_expression(self):
-        self.amatch("STRING")
+        self.amatch(STRING)
         rv = String_Literal(self.ct)
 
-        while self.apeek("OPERATOR", "+"):
-            self.amatch("OPERATOR", "+")
+        while self.apeek(OPERATOR, "+"):
+            self.amatch(OPERATOR, "+")
             t_op = self.ct
 
-            self.amatch("STRING")
+            self.amatch(STRING)
             rv = Binary_Operation(1, t_op, rv, String_Literal(self.ct))
 
         return rv
@@ -1129,45 +1200,45 @@ class MATLAB_Parser:
     def parse_annotation_pragma(self):
         punctuation = []
 
-        self.amatch("KEYWORD", "pragma")
+        self.amatch(KEYWORD, "pragma")
         t_pragma = self.ct
 
-        self.amatch("IDENTIFIER")
+        self.amatch(IDENTIFIER)
         t_pragma_kind = self.ct
         if t_pragma_kind.value not in ("Justify", ):
             self.mh.warning(t_pragma_kind.location,
                             "unknown miss_hit pragma '%s'" %
                             t_pragma_kind.value)
 
-        self.amatch("BRA")
+        self.amatch(BRA)
         punctuation.append(self.ct)
 
-        self.amatch("IDENTIFIER")
+        self.amatch(IDENTIFIER)
         t_tool = self.ct
 
         if t_tool.value not in ("metric" ,):
             self.mh.warning(t_tool.location,
                             "unknown miss_hit tool '%s'" % t_tool.value)
 
-        self.amatch("COMMA")
+        self.amatch(COMMA)
         punctuation.append(self.ct)
 
-        self.amatch("STRING")
+        self.amatch(STRING)
         t_param = self.ct
 
         if t_param.value not in config.METRICS:
             self.mh.warning(t_param.location,
                             "unknown metric '%s'" % t_param.value)
 
-        self.amatch("COMMA")
+        self.amatch(COMMA)
         punctuation.append(self.ct)
 
         n_reason = self.parse_annotation_static_string_expression()
 
-        self.amatch("KET")
+        self.amatch(KET)
         punctuation.append(self.ct)
 
-        self.amatch("SEMICOLON")
+        self.amatch(SEMICOLON)
         punctuation.append(self.ct)
 
         rv = Metric_Justification_Pragma(t_pragma, t_pragma_kind,
@@ -1178,7 +1249,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_annotation_statement(self):
-        if self.apeek("KEYWORD", "pragma"):
+        if self.apeek(KEYWORD, "pragma"):
             return self.parse_annotation_pragma()
         else:
             self.mh.error(self.nt.location,
@@ -1188,10 +1259,10 @@ class MATLAB_Parser:
         if self.in_shortcircuit_context:
             raise ICE("failed to unset sc context")
 
-        while self.peek("NEWLINE"):
+        while self.peek(NEWLINE):
             self.next()
 
-        if self.peek("KEYWORD"):
+        if self.peek(KEYWORD):
             if self.nt.value == "for":
                 return self.parse_for_statement()
             elif self.nt.value == "if":
@@ -1230,15 +1301,15 @@ class MATLAB_Parser:
                               " found keyword '%s' instead" % self.nt.value)
         elif self.peek_annotation():
             return self.parse_annotation_statement()
-        elif self.peek("BANG"):
-            self.match("BANG")
+        elif self.peek(BANG):
+            self.match(BANG)
             t_bang = self.ct
-            self.match("NEWLINE")
+            self.match(NEWLINE)
             return Naked_Expression_Statement(
                 Function_Call(Identifier(t_bang),
                               [Char_Array_Literal(t_bang)],
                               "escape"))
-        elif self.peek("A_BRA"):
+        elif self.peek(A_BRA):
             return self.parse_list_assignment()
         else:
             # This can be one of three things
@@ -1248,8 +1319,8 @@ class MATLAB_Parser:
             #                                   # a call
             rv = self.parse_expression()
 
-            if self.peek("ASSIGNMENT"):
-                self.match("ASSIGNMENT")
+            if self.peek(ASSIGNMENT):
+                self.match(ASSIGNMENT)
                 t_eq = self.ct
                 if not isinstance(rv, Name):
                     self.mh.error(t_eq.location,
@@ -1261,7 +1332,7 @@ class MATLAB_Parser:
                     rv.sty_check_builtin_shadow(self.mh, self.cfg)
                 rv = Simple_Assignment_Statement(t_eq, rv, rhs)
 
-            elif self.peek("CARRAY"):
+            elif self.peek(CARRAY):
                 # Sanity check that the function is a simple name
                 if not isinstance(rv, (Identifier, Selection)):
                     self.mh.error(self.ct.location,
@@ -1270,8 +1341,8 @@ class MATLAB_Parser:
                                   rv.__class__.__name__)
 
                 arg_list = []
-                while self.peek("CARRAY"):
-                    self.match("CARRAY")
+                while self.peek(CARRAY):
+                    self.match(CARRAY)
                     arg_list.append(Char_Array_Literal(self.ct))
                 rv = Function_Call(rv, arg_list, "command")
                 rv = Naked_Expression_Statement(rv)
@@ -1297,34 +1368,34 @@ class MATLAB_Parser:
         lhs = []
         require_comma = False
 
-        self.match("A_BRA")
+        self.match(A_BRA)
         self.ct.set_ast(rv)
-        if self.peek("COMMA"):
-            self.match("COMMA")
+        if self.peek(COMMA):
+            self.match(COMMA)
             self.ct.set_ast(rv)
         while True:
             # There is a special case we need to take care of with
             # ~. There is a MATLAB bug/weirdness with [~ x], which is
             # parsed like [~x], but [x y] is OK for some reason. See
             # issue #70. Hence we enforce commas after any ~.
-            if self.peek("OPERATOR", "~"):
+            if self.peek(OPERATOR, "~"):
                 require_comma = True
             target = self.parse_name(allow_void=True)
             if config.active(self.cfg, "builtin_shadow"):
                 target.sty_check_builtin_shadow(self.mh, self.cfg)
             lhs.append(target)
-            if (self.peek("COMMA") or require_comma) and \
-               not self.peek("A_KET"):
-                self.match("COMMA")
+            if (self.peek(COMMA) or require_comma) and \
+               not self.peek(A_KET):
+                self.match(COMMA)
                 self.ct.set_ast(rv)
                 require_comma = False
-            if self.peek("A_KET"):
+            if self.peek(A_KET):
                 break
-        self.match("A_KET")
+        self.match(A_KET)
         self.ct.set_ast(rv)
         rv.set_targets(lhs)
 
-        self.match("ASSIGNMENT")
+        self.match(ASSIGNMENT)
         rv.set_token_eq(self.ct)
 
         if len(lhs) == 1:
@@ -1344,7 +1415,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_nested_expression(self):
-        return self.parse_precedence_12()
+        return self.parse_binary_expression(PRECEDENCE_MAX)
 
     def parse_expression(self):
         n_expr = self.parse_nested_expression()
@@ -1352,45 +1423,45 @@ class MATLAB_Parser:
         return n_expr
 
     # 1. Parentheses ()
-    def parse_precedence_1(self):
-        if self.peek("NUMBER"):
-            self.match("NUMBER")
+    def parse_primary_expression(self):
+        if self.peek(NUMBER):
+            self.match(NUMBER)
             return Number_Literal(self.ct)
 
-        elif self.peek("CARRAY"):
-            self.match("CARRAY")
+        elif self.peek(CARRAY):
+            self.match(CARRAY)
             return Char_Array_Literal(self.ct)
 
-        elif self.peek("STRING"):
-            self.match("STRING")
+        elif self.peek(STRING):
+            self.match(STRING)
             return String_Literal(self.ct)
 
-        elif self.peek("BRA"):
-            self.match("BRA")
+        elif self.peek(BRA):
+            self.match(BRA)
             t_open = self.ct
             expr = self.parse_nested_expression()
-            self.match("KET")
+            self.match(KET)
             t_close = self.ct
             self.set_expression_brackets(expr, t_open, t_close)
             return expr
 
-        elif self.peek("M_BRA"):
+        elif self.peek(M_BRA):
             with self.sc_context(False):
                 return self.parse_matrix()
 
-        elif self.peek("C_BRA"):
+        elif self.peek(C_BRA):
             with self.sc_context(False):
                 return self.parse_cell()
 
-        elif self.peek("COLON"):
-            self.match("COLON")
+        elif self.peek(COLON):
+            self.match(COLON)
             return Reshape(self.ct)
 
-        elif self.peek("AT"):
+        elif self.peek(AT):
             return self.parse_function_handle()
 
-        elif self.peek("METACLASS"):
-            self.match("METACLASS")
+        elif self.peek(METACLASS):
+            self.match(METACLASS)
             tok = self.ct
             return Metaclass(tok, self.parse_simple_name())
 
@@ -1410,24 +1481,25 @@ class MATLAB_Parser:
     #    second from the right to left. It is recommended that you use
     #    parentheses to explicitly specify the intended precedence of
     #    statements containing these operator combinations.
-    def parse_precedence_2(self):
+    def parse_power_expression(self):
         # In Octave chaining ^ is left associative, i.e. 2 ^ 3 ^ 2 ==
         # (2 ^ 3) ^ 2 == 64.
         #
         # TODO: Is this also true for MATLAB?
-        rv = self.parse_precedence_1()
+        rv = self.parse_primary_expression()
 
-        while self.peek("OPERATOR") and self.nt.value in ("^", ".^",
-                                                          "'", ".'"):
-            self.match("OPERATOR")
+        while self.peek(OPERATOR) and \
+              (self.nt.value in POWER_OPERATORS or
+               self.nt.value in POSTFIX_OPERATORS):
+            self.match(OPERATOR)
             t_op = self.ct
-            if t_op.value in ("^", ".^"):
+            if t_op.value in POWER_OPERATORS:
                 unary_chain = []
-                while self.peek("OPERATOR") and \
-                      self.nt.value in ("-", "+", "~"):
-                    self.match("OPERATOR")
+                while self.peek(OPERATOR) and \
+                      self.nt.value in PREFIX_OPERATORS:
+                    self.match(OPERATOR)
                     unary_chain.append(self.ct)
-                rhs = self.parse_precedence_1()
+                rhs = self.parse_primary_expression()
                 while unary_chain:
                     rhs = Unary_Operation(3, unary_chain.pop(), rhs)
                 rv = Binary_Operation(2, t_op, rv, rhs)
@@ -1436,143 +1508,93 @@ class MATLAB_Parser:
 
         return rv
 
-    def parse_precedence_3(self):
-        # This is dealt with as a special case in (2).
-        return self.parse_precedence_2()
-
     # 4. Unary plus (+), unary minus (-), logical negation (~)
-    def parse_precedence_4(self):
-        if self.peek("OPERATOR") and self.nt.value in ("+", "-", "~"):
-            self.match("OPERATOR")
-            t_op = self.ct
-            rhs = self.parse_precedence_4()
-            return Unary_Operation(4, t_op, rhs)
-        else:
-            return self.parse_precedence_3()
-
-    # 5. Multiplication (.*), right division (./), left division (.\),
-    #    matrix multiplication (*), matrix right division (/), matrix left
-    #    division (\)
-    def parse_precedence_5(self):
-        rv = self.parse_precedence_4()
-
-        while self.peek("OPERATOR") and self.nt.value in ("*", ".*",
-                                                          "/", "./",
-                                                          "\\", ".\\"):
-            self.match("OPERATOR")
-            t_op = self.ct
-            rhs = self.parse_precedence_4()
-            rv = Binary_Operation(5, t_op, rv, rhs)
+    def parse_unary_expression(self):
+        unary_chain = []
+        while self.peek(OPERATOR) and self.nt.value in PREFIX_OPERATORS:
+            self.match(OPERATOR)
+            unary_chain.append(self.ct)
 
-        return rv
-
-    # 6. Addition (+), subtraction (-)
-    def parse_precedence_6(self):
-        rv = self.parse_precedence_5()
-
-        while self.peek("OPERATOR") and self.nt.value in ("+", "-"):
-            self.match("OPERATOR")
-            t_op = self.ct
-            rhs = self.parse_precedence_5()
-            rv = Binary_Operation(6, t_op, rv, rhs)
+        rv = self.parse_power_expression()
+        while unary_chain:
+            rv = Unary_Operation(4, unary_chain.pop(), rv)
 
         return rv
 
-    # 7. Colon operator (:)
-    def parse_range_expression(self):
-        t_first_colon = None
-        t_second_colon = None
-        points = []
-        points.append(self.parse_precedence_6())
-        if self.peek("COLON"):
-            self.match("COLON")
-            t_first_colon = self.ct
-            points.append(self.parse_precedence_6())
-        if self.peek("COLON"):
-            self.match("COLON")
-            t_second_colon = self.ct
-            points.append(self.parse_precedence_6())
-        assert 1 <= len(points) <= 3
-
-        if len(points) == 1:
-            return points[0]
-        elif len(points) == 2:
-            return Range_Expression(points[0], t_first_colon, points[1])
-        else:
-            return Range_Expression(points[0], t_first_colon, points[2],
-                                    t_second_colon, points[1])
+    # 5. to 12. Binary operators and ranges
+    def parse_binary_expression(self, max_precedence):
+        # This is a precedence climbing parser for everything binding
+        # less tightly than unary operators. We parse all operators
+        # up to (and including) max_precedence. Since all operators
+        # are left-associative, we only recurse for right-hand sides
+        # (which only contain operators binding more tightly); so the
+        # recursion depth does not depend on the length of the
+        # expression.
+        assert 4 <= max_precedence <= PRECEDENCE_MAX
 
-    # 8. Less than (<), less than or equal to (<=), greater than (>),
-    #    greater than or equal to (>=), equal to (==), not equal to (~=)
-    def parse_precedence_8(self):
-        rv = self.parse_range_expression()
+        rv = self.parse_unary_expression()
 
-        chain_length = 1
-        while self.peek("OPERATOR") and self.nt.value in ("<", "<=",
-                                                          ">", ">=",
-                                                          "==", "~="):
-            chain_length += 1
-            self.match("OPERATOR")
-            t_op = self.ct
-            rhs = self.parse_range_expression()
-            rv = Binary_Operation(8, t_op, rv, rhs)
-
-            if chain_length > 2:
-                self.mh.warning(t_op.location,
-                                "chained relation does not work the"
-                                " way you think it does")
-
-        return rv
-
-    # 9. Element-wise AND (&)
-    def parse_precedence_9(self):
-        rv = self.parse_precedence_8()
+        precedence = 4
+        # The precedence of the last operator applied to rv
 
-        while self.peek("OPERATOR", "&"):
-            self.match("OPERATOR", "&")
-            t_op = self.ct
-            rhs = self.parse_precedence_8()
-            rv = Binary_Logical_Operation(9,
-                                          t_op, self.in_shortcircuit_context,
-                                          rv, rhs)
-
-        return rv
+        chain_length = 1
+        # The number of relations chained together in rv
 
-    # 10. Element-wise OR (|)
-    def parse_precedence_10(self):
-        rv = self.parse_precedence_9()
+        while True:
+            if self.peek(COLON):
+                # Ranges can only be built from (at most three)
+                # expressions of precedence 6, and are never chained.
+                if max_precedence < PRECEDENCE_RANGE or \
+                   precedence >= PRECEDENCE_RANGE:
+                    break
 
-        while self.peek("OPERATOR", "|"):
-            self.match("OPERATOR", "|")
-            t_op = self.ct
-            rhs = self.parse_precedence_9()
-            rv = Binary_Logical_Operation(10,
-                                          t_op, self.in_shortcircuit_context,
-                                          rv, rhs)
+                self.match(COLON)
+                t_first_colon = self.ct
+                n_second = self.parse_binary_expression(PRECEDENCE_RANGE - 1)
+                if self.peek(COLON):
+                    self.match(COLON)
+                    t_second_colon = self.ct
+                    n_third = self.parse_binary_expression(
+                        PRECEDENCE_RANGE - 1)
+                    rv = Range_Expression(rv, t_first_colon, n_third,
+                                          t_second_colon, n_second)
+                else:
+                    rv = Range_Expression(rv, t_first_colon, n_second)
+                precedence = PRECEDENCE_RANGE
+                continue
 
-        return rv
+            elif self.peek(OPERATOR) and self.nt.value in BINARY_OPERATORS:
+                op_precedence = BINARY_OPERATORS[self.nt.value]
+                if op_precedence > max_precedence:
+                    break
 
-    # 11. Short-circuit AND (&&)
-    def parse_precedence_11(self):
-        rv = self.parse_precedence_10()
+            else:
+                break
 
-        while self.peek("OPERATOR", "&&"):
-            self.match("OPERATOR", "&&")
+            self.match(OPERATOR)
             t_op = self.ct
-            rhs = self.parse_precedence_10()
-            rv = Binary_Logical_Operation(11, t_op, True, rv, rhs)
-
-        return rv
+            rhs = self.parse_binary_expression(op_precedence - 1)
+
+            if op_precedence <= PRECEDENCE_RELATION:
+                rv = Binary_Operation(op_precedence, t_op, rv, rhs)
+            elif t_op.value in ("&", "|"):
+                rv = Binary_Logical_Operation(op_precedence,
+                                              t_op,
+                                              self.in_shortcircuit_context,
+                                              rv, rhs)
+            else:
+                rv = Binary_Logical_Operation(op_precedence,
+                                              t_op, True,
+                                              rv, rhs)
 
-    # 12. Short-circuit OR (||)
-    def parse_precedence_12(self):
-        rv = self.parse_precedence_11()
+            if op_precedence == PRECEDENCE_RELATION:
+                chain_length += 1
+                if chain_length > 2:
+                    self.mh.warning(t_op.location,
+                                    "chained relation does not work the"
+                                    " way you think it does")
 
-        while self.peek("OPERATOR", "||"):
-            self.match("OPERATOR", "||")
-            t_op = self.ct
-            rhs = self.parse_precedence_11()
-            rv = Binary_Logical_Operation(12, t_op, True, rv, rhs)
+            precedence = op_precedence
 
         return rv
 
@@ -1581,123 +1603,123 @@ class MATLAB_Parser:
 
         first = True
 
-        while not (self.peek("SEMICOLON") or
-                   self.peek("NEWLINE") or
-                   self.peek("C_KET") or
-                   self.peek("M_KET")):
+        while not (self.peek(SEMICOLON) or
+                   self.peek(NEWLINE) or
+                   self.peek(C_KET) or
+                   self.peek(M_KET)):
             if first:
                 first = False
                 # Very bad style, but you can start a matrix with a
                 # comma, e.g. [,1,2] which is the same as [1, 2]
-                if self.peek("COMMA"):
-                    self.match("COMMA")
+                if self.peek(COMMA):
+                    self.match(COMMA)
                     self.ct.set_ast(rv)
 
-            if (self.peek("SEMICOLON") or
-                self.peek("NEWLINE") or
-                self.peek("C_KET") or
-                self.peek("M_KET")):
+            if (self.peek(SEMICOLON) or
+                self.peek(NEWLINE) or
+                self.peek(C_KET) or
+                self.peek(M_KET)):
                 # Bad style, but you can have a trailing comma in your
                 # matrix, e.g. [1,2,] which is the same as [1, 2]
                 break
 
             rv.add_item(self.parse_nested_expression())
 
-            if self.peek("SEMICOLON"):
+            if self.peek(SEMICOLON):
                 pass
-            elif self.peek("NEWLINE"):
+            elif self.peek(NEWLINE):
                 pass
-            elif self.peek("C_KET") or self.peek("M_KET"):
+            elif self.peek(C_KET) or self.peek(M_KET):
                 pass
             else:
-                self.match("COMMA")
+                self.match(COMMA)
                 self.ct.set_ast(rv)
 
         return rv
 
     def parse_matrix(self):
-        self.match("M_BRA")
+        self.match(M_BRA)
         rv = Matrix_Expression(self.ct)
 
         # Bad style, but there may be leading semicolons, e.g [;;3]
         # which is the same as [3].
-        while self.peek("SEMICOLON"):
-            self.match("SEMICOLON")
+        while self.peek(SEMICOLON):
+            self.match(SEMICOLON)
             self.ct.set_ast(rv)
 
-        if not self.peek("M_KET"):
+        if not self.peek(M_KET):
             rv.add_row(self.parse_matrix_row())
-            while self.peek("SEMICOLON"):
-                self.match("SEMICOLON")
+            while self.peek(SEMICOLON):
+                self.match(SEMICOLON)
                 self.ct.set_ast(rv)
-            if self.peek("NEWLINE"):
-                self.match("NEWLINE")
+            if self.peek(NEWLINE):
+                self.match(NEWLINE)
 
-            while not (self.peek("SEMICOLON") or
-                       self.peek("NEWLINE") or
-                       self.peek("M_KET")):
+            while not (self.peek(SEMICOLON) or
+                       self.peek(NEWLINE) or
+                       self.peek(M_KET)):
                 rv.add_row(self.parse_matrix_row())
-                while self.peek("SEMICOLON"):
-                    self.match("SEMICOLON")
+                while self.peek(SEMICOLON):
+                    self.match(SEMICOLON)
                     self.ct.set_ast(rv)
-                if self.peek("NEWLINE"):
-                    self.match("NEWLINE")
+                if self.peek(NEWLINE):
+                    self.match(NEWLINE)
 
-        self.match("M_KET")
+        self.match(M_KET)
         rv.set_closing_bracket(self.ct)
         return rv
 
     def parse_cell(self):
-        self.match("C_BRA")
+        self.match(C_BRA)
         rv = Cell_Expression(self.ct)
 
         # Bad style, but there may be leading semicolons, e.g {;;3}
         # which is the same as {3}.
-        while self.peek("SEMICOLON"):
-            self.match("SEMICOLON")
+        while self.peek(SEMICOLON):
+            self.match(SEMICOLON)
             self.ct.set_ast(rv)
 
-        if not self.peek("C_KET"):
+        if not self.peek(C_KET):
             rv.add_row(self.parse_matrix_row())
-            while self.peek("SEMICOLON"):
-                self.match("SEMICOLON")
+            while self.peek(SEMICOLON):
+                self.match(SEMICOLON)
                 self.ct.set_ast(rv)
-            if self.peek("NEWLINE"):
-                self.match("NEWLINE")
+            if self.peek(NEWLINE):
+                self.match(NEWLINE)
 
-            while not (self.peek("SEMICOLON") or
-                       self.peek("NEWLINE") or
-                       self.peek("C_KET")):
+            while not (self.peek(SEMICOLON) or
+                       self.peek(NEWLINE) or
+                       self.peek(C_KET)):
                 rv.add_row(self.parse_matrix_row())
-                while self.peek("SEMICOLON"):
-                    self.match("SEMICOLON")
+                while self.peek(SEMICOLON):
+                    self.match(SEMICOLON)
                     self.ct.set_ast(rv)
-                if self.peek("NEWLINE"):
-                    self.match("NEWLINE")
+                if self.peek(NEWLINE):
+                    self.match(NEWLINE)
 
-        self.match("C_KET")
+        self.match(C_KET)
         rv.set_closing_bracket(self.ct)
         return rv
 
     def parse_function_handle(self):
-        self.match("AT")
+        self.match(AT)
         t_at = self.ct
 
-        if self.peek("BRA"):
+        if self.peek(BRA):
             rv = Lambda_Function(t_at)
 
-            self.match("BRA")
+            self.match(BRA)
             self.ct.set_ast(rv)
 
-            while not self.peek("KET"):
+            while not self.peek(KET):
                 rv.add_parameter(self.parse_identifier(allow_void=True))
-                if self.peek("COMMA"):
-                    self.match("COMMA")
+                if self.peek(COMMA):
+                    self.match(COMMA)
                     self.ct.set_ast(rv)
                 else:
                     break
 
-            self.match("KET")
+            self.match(KET)
             self.ct.set_ast(rv)
 
             rv.set_body(self.parse_nested_expression())
@@ -1714,21 +1736,21 @@ class MATLAB_Parser:
         #
         # Note: This list can be empty
         args = []
-        self.match("BRA")
+        self.match(BRA)
         self.ct.set_ast(n_ast)
-        if self.peek("KET"):
-            self.match("KET")
+        if self.peek(KET):
+            self.match(KET)
             self.ct.set_ast(n_ast)
             return args
 
         while True:
             args.append(self.parse_expression())
-            if self.peek("COMMA"):
-                self.match("COMMA")
+            if self.peek(COMMA):
+                self.match(COMMA)
                 self.ct.set_ast(n_ast)
-            elif self.peek("KET"):
+            elif self.peek(KET):
                 break
-        self.match("KET")
+        self.match(KET)
         self.ct.set_ast(n_ast)
         return args
 
@@ -1738,18 +1760,18 @@ class MATLAB_Parser:
         # Note: cannot be empty
         rv = Cell_Reference(n_name)
 
-        self.match("C_BRA")
+        self.match(C_BRA)
         self.ct.set_ast(rv)
 
         while True:
             rv.add_argument(self.parse_expression())
-            if self.peek("COMMA"):
-                self.match("COMMA")
+            if self.peek(COMMA):
+                self.match(COMMA)
                 self.ct.set_ast(rv)
-            elif self.peek("C_KET"):
+            elif self.peek(C_KET):
                 break
 
-        self.match("C_KET")
+        self.match(C_KET)
         self.ct.set_ast(rv)
 
         return rv
@@ -1757,7 +1779,7 @@ class MATLAB_Parser:
     def parse_if_statement(self):
         actions = []
 
-        self.match("KEYWORD", "if")
+        self.match(KEYWORD, "if")
         self.push_context("if")
         n_action = Action(self.ct)
         with self.sc_context(True):
@@ -1766,8 +1788,8 @@ class MATLAB_Parser:
         n_action.set_body(self.parse_delimited_input())
         actions.append(n_action)
 
-        while self.peek("KEYWORD", "elseif"):
-            self.match("KEYWORD", "elseif")
+        while self.peek(KEYWORD, "elseif"):
+            self.match(KEYWORD, "elseif")
             n_action = Action(self.ct)
             with self.sc_context(True):
                 n_action.set_expression(self.parse_expression())
@@ -1775,14 +1797,14 @@ class MATLAB_Parser:
             n_action.set_body(self.parse_delimited_input())
             actions.append(n_action)
 
-        if self.peek("KEYWORD", "else"):
-            self.match("KEYWORD", "else")
+        if self.peek(KEYWORD, "else"):
+            self.match(KEYWORD, "else")
             n_action = Action(self.ct)
             self.match_eos(n_action, allow_nothing=True)
             n_action.set_body(self.parse_delimited_input())
             actions.append(n_action)
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         rv = If_Statement(actions)
         self.ct.set_ast(rv)
         self.match_eos(rv)
@@ -1791,14 +1813,14 @@ class MATLAB_Parser:
         return rv
 
     def parse_return_statement(self):
-        self.match("KEYWORD", "return")
+        self.match(KEYWORD, "return")
         rv = Return_Statement(self.ct)
         self.match_eos(rv)
 
         return rv
 
     def parse_break_statement(self):
-        self.match("KEYWORD", "break")
+        self.match(KEYWORD, "break")
         rv = Break_Statement(self.ct)
 
         if not self.in_context("loop"):
@@ -1811,7 +1833,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_continue_statement(self):
-        self.match("KEYWORD", "continue")
+        self.match(KEYWORD, "continue")
         rv = Continue_Statement(self.ct)
 
         if not self.in_context("loop"):
@@ -1835,24 +1857,24 @@ class MATLAB_Parser:
         #
         # TODO: In octave we can recurse for the normal for, in MATLAB
         # we cannot. For parfor we can never recurse.
-        if self.peek("BRA") and allow_brackets:
-            self.match("BRA")
+        if self.peek(BRA) and allow_brackets:
+            self.match(BRA)
             self.ct.set_ast(n_ast)
             n_ident, n_expr = self.parse_for_assignment(n_ast,
                                                         allow_recursion,
                                                         allow_recursion)
-            self.match("KET")
+            self.match(KET)
             self.ct.set_ast(n_ast)
         else:
             n_ident = self.parse_identifier(allow_void=False)
-            self.match("ASSIGNMENT")
+            self.match(ASSIGNMENT)
             self.ct.set_ast(n_ast)
             n_expr = self.parse_expression()
 
         return n_ident, n_expr
 
     def parse_for_statement(self):
-        self.match("KEYWORD", "for")
+        self.match(KEYWORD, "for")
         self.push_context("loop")
         rv = General_For_Statement(self.ct)
 
@@ -1863,7 +1885,7 @@ class MATLAB_Parser:
 
         rv.set_body(self.parse_delimited_input())
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -1871,22 +1893,22 @@ class MATLAB_Parser:
         return rv
 
     def parse_parfor_statement(self):
-        self.match("KEYWORD", "parfor")
+        self.match(KEYWORD, "parfor")
         self.push_context("loop")
         rv = Parallel_For_Statement(self.ct)
 
-        if self.peek("BRA"):
+        if self.peek(BRA):
             # parfor (var = first:last, max_workers)
-            self.match("BRA")
+            self.match(BRA)
             self.ct.set_ast(rv)
 
             n_ident, n_expr = self.parse_for_assignment(rv)
-            if self.peek("COMMA"):
-                self.match("COMMA")
+            if self.peek(COMMA):
+                self.match(COMMA)
                 self.ct.set_ast(rv)
                 rv.set_workers(self.parse_expression())
 
-            self.match("KET")
+            self.match(KET)
             self.ct.set_ast(rv)
 
         else:
@@ -1902,7 +1924,7 @@ class MATLAB_Parser:
 
         rv.set_body(self.parse_delimited_input())
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -1910,7 +1932,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_while_statement(self):
-        self.match("KEYWORD", "while")
+        self.match(KEYWORD, "while")
         self.push_context("loop")
         t_kw = self.ct
         with self.sc_context(True):
@@ -1919,7 +1941,7 @@ class MATLAB_Parser:
         self.match_eos(rv)
 
         rv.set_body(self.parse_delimited_input())
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -1927,24 +1949,24 @@ class MATLAB_Parser:
         return rv
 
     def parse_global_statement(self):
-        self.match("KEYWORD", "global")
+        self.match(KEYWORD, "global")
         rv = Global_Statement(self.ct)
 
         while True:
             rv.add_name(self.parse_identifier(allow_void=False))
-            if self.peek("NEWLINE"):
-                self.match("NEWLINE")
+            if self.peek(NEWLINE):
+                self.match(NEWLINE)
                 break
-            elif self.peek("SEMICOLON"):
-                self.match("SEMICOLON")
+            elif self.peek(SEMICOLON):
+                self.match(SEMICOLON)
                 self.ct.set_ast(rv)
-                self.match("NEWLINE")
+                self.match(NEWLINE)
                 break
 
         return rv
 
     def parse_persistent_statement(self):
-        self.match("KEYWORD", "persistent")
+        self.match(KEYWORD, "persistent")
         rv = Persistent_Statement(self.ct)
 
         while True:
@@ -1956,7 +1978,7 @@ class MATLAB_Parser:
         return rv
 
     def parse_switch_statement(self):
-        self.match("KEYWORD", "switch")
+        self.match(KEYWORD, "switch")
         self.push_context("switch")
         t_switch = self.ct
         n_switch_expr = self.parse_expression()
@@ -1964,25 +1986,25 @@ class MATLAB_Parser:
         self.match_eos(rv)
 
         while True:
-            if self.peek("KEYWORD", "otherwise"):
-                self.match("KEYWORD", "otherwise")
+            if self.peek(KEYWORD, "otherwise"):
+                self.match(KEYWORD, "otherwise")
                 n_action = Action(self.ct)
                 self.match_eos(n_action, allow_nothing=True)
                 n_action.set_body(self.parse_delimited_input())
                 rv.add_action(n_action)
                 break
             else:
-                self.match("KEYWORD", "case")
+                self.match(KEYWORD, "case")
                 n_action = Action(self.ct)
                 n_action.set_expression(self.parse_expression())
                 self.match_eos(n_action, allow_nothing=True)
                 n_action.set_body(self.parse_delimited_input())
                 rv.add_action(n_action)
 
-            if self.peek("KEYWORD", "end"):
+            if self.peek(KEYWORD, "end"):
                 break
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -2000,20 +2022,20 @@ class MATLAB_Parser:
         # In MISS_HIT for now you can only import a single name per
         # import statement (i.e. no space separated lists allowed
         # here).
-        self.match("KEYWORD", "import")
+        self.match(KEYWORD, "import")
         rv = Import_Statement(self.ct)
 
-        self.match("IDENTIFIER")
+        self.match(IDENTIFIER)
         chain = [self.ct]
-        while self.peek("SELECTION") or self.peek("OPERATOR", ".*"):
-            if self.peek("OPERATOR", ".*"):
-                self.match("OPERATOR", ".*")
+        while self.peek(SELECTION) or self.peek(OPERATOR, ".*"):
+            if self.peek(OPERATOR, ".*"):
+                self.match(OPERATOR, ".*")
                 chain.append(self.ct)
                 break
             else:
-                self.match("SELECTION")
+                self.match(SELECTION)
                 self.ct.set_ast(rv)
-                self.match("IDENTIFIER")
+                self.match(IDENTIFIER)
                 chain.append(self.ct)
 
         rv.set_chain(chain)
@@ -2022,21 +2044,21 @@ class MATLAB_Parser:
         return rv
 
     def parse_try_statement(self):
-        self.match("KEYWORD", "try")
+        self.match(KEYWORD, "try")
         self.push_context("block")
         rv = Try_Statement(self.ct)
         self.match_eos(rv, allow_nothing=True)
 
         rv.set_body(self.parse_delimited_input())
 
-        if self.peek("KEYWORD", "end"):
+        if self.peek(KEYWORD, "end"):
             # A missing catch block seems to be an undocumented
             # extension to MATLAB that Octave also supports. It should
             # be equivalent to a general catch with an empty body.
             pass
 
         else:
-            self.match("KEYWORD", "catch")
+            self.match(KEYWORD, "catch")
             t_catch = self.ct
             if not self.peek_eos():
                 rv.set_ident(self.parse_identifier(allow_void = False))
@@ -2044,7 +2066,7 @@ class MATLAB_Parser:
 
             rv.set_handler_body(t_catch, self.parse_delimited_input())
 
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -2052,13 +2074,13 @@ class MATLAB_Parser:
         return rv
 
     def parse_spmd_statement(self):
-        self.match("KEYWORD", "spmd")
+        self.match(KEYWORD, "spmd")
         self.push_context("block")
         rv = SPMD_Statement(self.ct)
         self.match_eos(rv)
 
         rv.set_body(self.parse_delimited_input())
-        self.match("KEYWORD", "end")
+        self.match(KEYWORD, "end")
         self.ct.set_ast(rv)
         self.match_eos(rv)
         self.pop_context()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+##############################################################################
+##                                                                          ##
+##          MATLAB Independent, Small & Safe, High Integrity Tools          ##
+##                                                                          ##
+##              Copyright (C) 2020, Florian Schanda                         ##
+##                                                                          ##
+##  This file is part of MISS_HIT.                                          ##
+##                                                                          ##
+##  MATLAB Independent, Small & Safe, High Integrity Tools (MISS_HIT) is    ##
+##  free software: you can redistribute it and/or modify it under the       ##
+##  terms of the GNU General Public License as published by the Free        ##
+##  Software Foundation, either version 3 of the License, or (at your       ##
+##  option) any later version.                                              ##
+##                                                                          ##
+##  MISS_HIT is distributed in the hope that it will be useful,             ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+##  GNU General Public License for more details.                            ##
+##                                                                          ##
+##  You should have received a copy of the GNU General Public License       ##
+##  along with MISS_HIT. If not, see <http://www.gnu.org/licenses/>.        ##
+##                                                                          ##
+##############################################################################
+
+# Indexed queries over a parse tree. Checks that need to find
+# particular nodes (e.g. all calls to some function inside loops) can
+# ask the index, instead of each walking the entire tree.
+#
+# Selectors have the following form:
+#
+#    selector ::= step { "under" step }
+#    step     ::= <node class> [ "with" "name" <name> ]
+#
+# Each "with name" belongs to the step just before it. For example
+# "Function_Call under While_Statement under Function_Definition with
+# name X" finds all function calls inside a while loop (directly or
+# not), which in turn is inside a function named X.
+#
+# Malformed selectors raise ValueError.
+
+import bisect
+import heapq
+
+from m_ast import *
+
+
+NODE_CLASSES = {}
+# All node classes by name. Filled in on first use.
+
+
+def find_node_class(name):
+    # Returns the AST node class with the given name, or None
+    assert isinstance(name, str)
+
+    if not NODE_CLASSES:
+        todo = [Node]
+        while todo:
+            node_class = todo.pop()
+            NODE_CLASSES[node_class.__name__] = node_class
+            todo += node_class.__subclasses__()
+
+    return NODE_CLASSES.get(name, None)
+
+
+def node_name(node):
+    # Returns the name of the given node as a string, or None if this
+    # kind of node does not have a name. For references and calls
+    # this is the name of the thing referenced or called.
+    assert isinstance(node, Node)
+
+    if isinstance(node, (Identifier, Selection)):
+        return str(node)
+    elif isinstance(node, (Reference, Cell_Reference)):
+        return node_name(node.n_ident)
+    elif isinstance(node, (Function_Call,
+                           Function_Signature,
+                           Class_Definition)):
+        return node_name(node.n_name)
+    elif isinstance(node, Function_Definition):
+        return node_name(node.n_sig)
+    else:
+        return None
+
+
+class Selector:
+    """ A compiled selector (see the top of this file)
+
+    The steps are pairs of node class and (optional) name. The
+    first step describes the nodes we are looking for, each
+    following step a node that must enclose the previous one.
+    """
+    def __init__(self, text):
+        assert isinstance(text, str)
+
+        self.text  = text
+        self.steps = []
+
+        words = text.split()
+        while True:
+            if not words:
+                raise ValueError("selector '%s' is incomplete" % text)
+            node_class = find_node_class(words[0])
+            if node_class is None:
+                raise ValueError("selector '%s' has unknown node class %s" %
+                                 (text, words[0]))
+            words.pop(0)
+
+            if words[:2] == ["with", "name"]:
+                if len(words) < 3:
+                    raise ValueError("selector '%s' is missing a name" % text)
+                name = words[2]
+                words = words[3:]
+            else:
+                name = None
+
+            self.steps.append((node_class, name))
+
+            if not words:
+                break
+            elif words[0] != "under":
+                raise ValueError("selector '%s' has unexpected %s" %
+                                 (text, words[0]))
+            words.pop(0)
+
+    def __str__(self):
+        return self.text
+
+
+class Index_Visitor(AST_Visitor):
+    # pylint: disable=unused-argument
+
+    def __init__(self, index):
+        self.index = index
+
+    def visit(self, node, n_parent, relation):
+        self.index.add(node)
+
+    def visit_end(self, node, n_parent, relation):
+        self.index.end[node] = len(self.index.nodes)
+
+
+class AST_Index:
+    """ Index over a (complete) parse tree
+
+    This is built in a single traversal, after which nodes can be
+    found by class, identifiers by name, and ancestor relations can
+    be checked in constant time. If the tree is changed the index
+    must be built again.
+    """
+    def __init__(self, n_root):
+        assert isinstance(n_root, Node)
+
+        self.n_root = n_root
+
+        self.nodes = []
+        # All nodes, in the order visited (i.e. parents before their
+        # children, and children in source order)
+
+        self.position = {}
+        # Position of each node in nodes
+
+        self.end = {}
+        # Position after the last node under each node. All nodes
+        # below a node are between its position and its end.
+
+        self.by_class = {}
+        # Nodes by their exact class, in order
+
+        self.by_name = {}
+        # Identifier nodes by name, in order
+
+        self.class_cache = {}
+        # Answers given by nodes_of, since a class is usually asked for
+        # more than once (e.g. by several checks)
+
+        traverse(n_root, Index_Visitor(self))
+
+    def add(self, node):
+        self.position[node] = len(self.nodes)
+        self.nodes.append(node)
+
+        node_class = node.__class__
+        if node_class in self.by_class:
+            self.by_class[node_class].append(node)
+        else:
+            self.by_class[node_class] = [node]
+
+        if node_class is Identifier:
+            name = str(node)
+            if name in self.by_name:
+                self.by_name[name].append(node)
+            else:
+                self.by_name[name] = [node]
+
+    def nodes_of(self, node_class):
+        """ Returns all nodes of the given class (or a subclass) """
+        assert isinstance(node_class, type) and issubclass(node_class, Node)
+
+        if node_class not in self.class_cache:
+            lists = [nodes
+                     for exact_class, nodes in self.by_class.items()
+                     if issubclass(exact_class, node_class)]
+            if len(lists) == 1:
+                rv = lists[0]
+            else:
+                rv = list(heapq.merge(*lists,
+                                      key = self.position.__getitem__))
+            self.class_cache[node_class] = rv
+
+        return self.class_cache[node_class]
+
+    def identifiers(self, name):
+        """ Returns all identifiers with the given name """
+        assert isinstance(name, str)
+
+        return self.by_name.get(name, [])
+
+    def is_ancestor(self, n_ancestor, node):
+        """ Tests if n_ancestor is above (and not equal to) node """
+        assert isinstance(n_ancestor, Node)
+        assert isinstance(node, Node)
+
+        return (self.position[n_ancestor] <
+                self.position[node] <
+                self.end[n_ancestor])
+
+    def ancestors(self, node):
+        """ Returns all nodes above node, innermost first """
+        assert isinstance(node, Node)
+
+        rv = []
+        while node.n_parent is not None:
+            node = node.n_parent
+            rv.append(node)
+        return rv
+
+    def enclosing(self, node, node_class):
+        """ Returns the innermost node of the given class above node """
+        assert isinstance(node, Node)
+        assert isinstance(node_class, type) and issubclass(node_class, Node)
+
+        for n_ancestor in self.ancestors(node):
+            if isinstance(n_ancestor, node_class):
+                return n_ancestor
+        return None
+
+    def step_nodes(self, node_class, name):
+        # Returns all nodes matching one step of a selector
+        if name is None:
+            return self.nodes_of(node_class)
+        elif node_class is Identifier:
+            return self.identifiers(name)
+        else:
+            return [node
+                    for node in self.nodes_of(node_class)
+                    if node_name(node) == name]
+
+    def query(self, selector):
+        """ Returns all nodes matching the selector, in order
+
+        The selector can be a string or a Selector. Raises ValueError
+        if the selector is malformed.
+        """
+        if isinstance(selector, str):
+            selector = Selector(selector)
+        assert isinstance(selector, Selector)
+
+        # We work from the outermost step inwards. At each step we
+        # keep the nodes that are under any node found by the
+        # previous step. These are ranges of positions, and since we
+        # only need the outermost ranges, they do not overlap.
+        rv = None
+        for node_class, name in reversed(selector.steps):
+            candidates = self.step_nodes(node_class, name)
+            if rv is None:
+                rv = candidates
+                continue
+
+            starts = []
+            ends   = []
+            for node in rv:
+                if ends and self.position[node] < ends[-1]:
+                    continue
+                starts.append(self.position[node])
+                ends.append(self.end[node])
+
+            rv = []
+            for node in candidates:
+                pos = self.position[node]
+                idx = bisect.bisect_right(starts, pos) - 1
+                if idx >= 0 and starts[idx] < pos < ends[idx]:
+                    rv.append(node)
+
+        return rv
+
+
+def query_test_main():
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    import config
+    from errors import Message_Handler, Error
+    from m_lexer import MATLAB_Lexer, Token_Buffer
+    from m_parser import MATLAB_Parser
+    # pylint: enable=import-outside-toplevel
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("file",
+                    help="MATLAB file to parse")
+    ap.add_argument("queries",
+                    help="File with one selector per line")
+    options = ap.parse_args()
+
+    mh = Message_Handler("debug")
+    mh.sort_messages = False
+    mh.colour = False
+    mh.register_file(options.file)
+
+    with open(options.file, "r", encoding="cp1252") as fd:
+        content = fd.read()
+    with open(options.queries, "r", encoding="utf-8") as fd:
+        selectors = [line.strip()
+                     for line in fd
+                     if line.strip()]
+
+    try:
+        lexer = MATLAB_Lexer(mh, content, options.file)
+        tbuf = Token_Buffer(lexer, config.BASE_CONFIG)
+        n_cu = MATLAB_Parser(mh, tbuf, config.BASE_CONFIG).parse_file()
+    except Error:
+        mh.summary_and_exit()
+
+    index = AST_Index(n_cu)
+
+    # To check the index we also answer each query the slow way, by
+    # looking at each node and all of its ancestors
+    def slow_match(node, step):
+        node_class, name = step
+        return isinstance(node, node_class) and \
+            (name is None or node_name(node) == name)
+
+    def slow_query(selector):
+        rv = []
+        for node in index.nodes:
+            if not slow_match(node, selector.steps[0]):
+                continue
+            chain = index.ancestors(node)
+            for step in selector.steps[1:]:
+                while chain and not slow_match(chain[0], step):
+                    chain.pop(0)
+                if not chain:
+                    break
+                chain.pop(0)
+            else:
+                rv.append(node)
+        return rv
+
+    mismatches = []
+    for text in selectors:
+        try:
+            selector = Selector(text)
+        except ValueError as err:
+            print("%s: error: %s" % (text, err))
+            continue
+
+        result = index.query(selector)
+        print("%s: %u match(es)" % (selector, len(result)))
+        for node in result:
+            name = node_name(node)
+            print("   %u:%u %s%s" % (node.loc().line,
+                                     node.loc().col_start,
+                                     node.__class__.__name__,
+                                     "" if name is None else " " + name))
+
+        if result != slow_query(selector):
+            mismatches.append(text)
+
+    if mismatches:
+        for text in mismatches:
+            print("Index differs from full traversal for %s" % text)
+    else:
+        print("Index matches full traversal")
+
+    mh.summary_and_exit()
+
+
+if __name__ == "__main__":
+    query_test_main()
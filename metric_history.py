@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+##############################################################################
+##                                                                          ##
+##          MATLAB Independent, Small & Safe, High Integrity Tools          ##
+##                                                                          ##
+##              Copyright (C) 2020, Florian Schanda                         ##
+##                                                                          ##
+##  This file is part of MISS_HIT.                                          ##
+##                                                                          ##
+##  MATLAB Independent, Small & Safe, High Integrity Tools (MISS_HIT) is    ##
+##  free software: you can redistribute it and/or modify it under the       ##
+##  terms of the GNU General Public License as published by the Free        ##
+##  Software Foundation, either version 3 of the License, or (at your       ##
+##  option) any later version.                                              ##
+##                                                                          ##
+##  MISS_HIT is distributed in the hope that it will be useful,             ##
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of          ##
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           ##
+##  GNU General Public License for more details.                            ##
+##                                                                          ##
+##  You should have received a copy of the GNU General Public License       ##
+##  along with MISS_HIT. If not, see <http://www.gnu.org/licenses/>.        ##
+##                                                                          ##
+##############################################################################
+
+# History of code metrics. Each run of mh_metric can be recorded in a
+# SQLite database, under a commit id, so that we can later ask how
+# metrics have changed between two commits.
+#
+# The measures of a file are stored once for each distinct set of
+# measures (a version of the file). A run just refers to the version
+# of each file it has seen, so recording a run where most files have
+# not changed only adds a few rows.
+
+import os
+import json
+import sqlite3
+import hashlib
+import subprocess
+
+import config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id        INTEGER PRIMARY KEY,
+    commit_id TEXT NOT NULL UNIQUE,
+    changed   INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS versions (
+    id     INTEGER PRIMARY KEY,
+    file   TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (file, digest)
+);
+CREATE TABLE IF NOT EXISTS run_files (
+    run     INTEGER NOT NULL REFERENCES runs (id),
+    version INTEGER NOT NULL REFERENCES versions (id),
+    PRIMARY KEY (run, version)
+);
+CREATE TABLE IF NOT EXISTS measures (
+    version  INTEGER NOT NULL REFERENCES versions (id),
+    file     TEXT NOT NULL,
+    function TEXT NOT NULL,
+    metric   TEXT NOT NULL,
+    measure  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measures_by_name
+    ON measures (file, function, metric);
+CREATE INDEX IF NOT EXISTS measures_by_version
+    ON measures (version, metric);
+"""
+# File metrics are stored with an empty function name. For each run
+# we also remember how many files had measures not seen before.
+
+
+def current_commit():
+    """ Returns the commit id of the git HEAD in the current directory """
+    return resolve_commit("HEAD")
+
+
+def resolve_commit(ref):
+    """ Returns the commit id a git ref (e.g. a branch, tag, or
+        abbreviated commit id) in the current directory refers to
+    """
+    assert isinstance(ref, str)
+
+    try:
+        result = subprocess.run(["git", "rev-parse", "--verify", "--quiet",
+                                 ref + "^{commit}"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                encoding="utf-8",
+                                check=False)
+    except OSError as err:
+        raise ValueError("cannot run git: %s" % err) from err
+    if result.returncode != 0:
+        raise ValueError(result.stderr.strip() or
+                         "%s is not a commit" % ref)
+    return result.stdout.strip()
+
+
+def relative_name(root, file_name):
+    """ Returns the file name relative to the given directory, with /
+        as the separator on all platforms
+    """
+    assert isinstance(root, str)
+    assert isinstance(file_name, str)
+
+    try:
+        file_name = os.path.relpath(os.path.abspath(file_name), root)
+    except ValueError:
+        # On Windows there is no relative path to another drive
+        file_name = os.path.abspath(file_name)
+    return file_name.replace(os.sep, "/")
+
+
+def measure_rows(file_name, metrics):
+    # Returns (function, metric, measure) for all measures of the
+    # given file, in the same form as the metrics kept by mh_metric
+    assert isinstance(file_name, str)
+    assert isinstance(metrics, dict)
+
+    rv = []
+    if metrics["errors"]:
+        return rv
+
+    for metric, results in metrics["metrics"].items():
+        if results["measure"] is not None:
+            rv.append(("", metric, results["measure"]))
+    for function, function_metrics in metrics["functions"].items():
+        for metric, results in function_metrics.items():
+            if results["measure"] is not None:
+                rv.append((function, metric, results["measure"]))
+
+    return sorted(rv)
+
+
+class Metric_History:
+    """ A SQLite database with the metrics of each recorded run
+
+    To record a run, call start_run, then add_file for each file,
+    and finally finish_run. Recording a commit id again replaces the
+    run for it. File names are recorded relative to the directory
+    containing the database, so it does not matter where we are run
+    from.
+    """
+    def __init__(self, db_name):
+        assert isinstance(db_name, str)
+
+        self.db = sqlite3.connect(db_name)
+        self.db.executescript(SCHEMA)
+
+        self.root = os.path.dirname(os.path.abspath(db_name))
+        # The directory file names are relative to
+
+        self.run = None
+        # The id of the run we are recording, if any
+
+        self.new_versions = 0
+        # Number of versions added for the current run
+
+    def close(self):
+        self.db.close()
+
+    def start_run(self, commit_id):
+        assert isinstance(commit_id, str)
+        assert self.run is None
+
+        row = self.db.execute("SELECT id FROM runs WHERE commit_id = ?",
+                              (commit_id,)).fetchone()
+        if row:
+            self.run = row[0]
+            self.db.execute("DELETE FROM run_files WHERE run = ?",
+                            (self.run,))
+        else:
+            self.run = self.db.execute("INSERT INTO runs (commit_id)"
+                                       " VALUES (?)",
+                                       (commit_id,)).lastrowid
+        self.new_versions = 0
+
+    def add_file(self, file_name, metrics):
+        assert isinstance(file_name, str)
+        assert isinstance(metrics, dict)
+        assert self.run is not None
+
+        file_name = relative_name(self.root, file_name)
+        rows = measure_rows(file_name, metrics)
+        digest = hashlib.sha1(json.dumps(rows).encode("utf-8")).hexdigest()
+
+        # If we have seen exactly these measures for this file before
+        # we just refer to them again
+        row = self.db.execute("SELECT id FROM versions"
+                              " WHERE file = ? AND digest = ?",
+                              (file_name, digest)).fetchone()
+        if row:
+            version = row[0]
+        else:
+            version = self.db.execute("INSERT INTO versions (file, digest)"
+                                      " VALUES (?, ?)",
+                                      (file_name, digest)).lastrowid
+            self.db.executemany("INSERT INTO measures"
+                                " (version, file, function, metric, measure)"
+                                " VALUES (?, ?, ?, ?, ?)",
+                                [(version, file_name) + row
+                                 for row in rows])
+            self.new_versions += 1
+
+        self.db.execute("INSERT OR IGNORE INTO run_files (run, version)"
+                        " VALUES (?, ?)",
+                        (self.run, version))
+
+    def finish_run(self):
+        assert self.run is not None
+
+        self.db.execute("UPDATE runs SET changed = ? WHERE id = ?",
+                        (self.new_versions, self.run))
+        self.db.commit()
+        self.run = None
+
+    def runs(self):
+        """ Returns (commit id, number of files, number of files with
+            new measures) for all runs, oldest first.
+        """
+        return self.db.execute("SELECT commit_id,"
+                               " COUNT(run_files.version), changed"
+                               " FROM runs"
+                               " LEFT JOIN run_files ON run_files.run = id"
+                               " GROUP BY id ORDER BY id").fetchall()
+
+    def run_id(self, commit_id):
+        """ Returns the run for the commit id, or the latest run if the
+            commit id is None. If no run is recorded under exactly
+            this commit id we try it as a git ref. Raises ValueError if
+            there is no such run.
+        """
+        if commit_id is None:
+            row = self.db.execute("SELECT id FROM runs"
+                                  " ORDER BY id DESC LIMIT 1").fetchone()
+            if row is None:
+                raise ValueError("no runs recorded")
+            return row[0]
+
+        assert isinstance(commit_id, str)
+        row = self.db.execute("SELECT id FROM runs WHERE commit_id = ?",
+                              (commit_id,)).fetchone()
+        if row is None:
+            try:
+                row = self.db.execute("SELECT id FROM runs"
+                                      " WHERE commit_id = ?",
+                                      (resolve_commit(commit_id),)).fetchone()
+            except ValueError:
+                pass
+        if row is None:
+            raise ValueError("no run recorded for %s" % commit_id)
+        return row[0]
+
+    def measures(self, run, metric):
+        # Returns {(file, function) -> measure} for one metric of a run
+        assert isinstance(run, int)
+        assert metric in config.METRICS
+
+        rows = self.db.execute("SELECT measures.file, function, measure"
+                               " FROM run_files"
+                               " JOIN measures"
+                               " ON measures.version = run_files.version"
+                               " WHERE run = ? AND metric = ?",
+                               (run, metric))
+        return {(file_name, function): measure
+                for file_name, function, measure in rows}
+
+    def changes(self, metric, since, until=None):
+        """ Returns (file, function, old, new) for everything measured
+            in either run where the measure differs. Old is None for
+            things that were not measured in the earlier run, and new
+            is None for things that are no longer measured.
+        """
+        assert metric in config.METRICS
+
+        old = self.measures(self.run_id(since), metric)
+        new = self.measures(self.run_id(until), metric)
+
+        return [key + (old.get(key, None), new.get(key, None))
+                for key in sorted(set(old) | set(new))
+                if old.get(key, None) != new.get(key, None)]
+
+    def grown(self, metric, since, until=None, by=0):
+        """ Returns all changes where the measure grew by more than by.
+            Things that are new count as growing from 0, and things
+            that are gone never grew.
+        """
+        assert isinstance(by, int)
+
+        return [change
+                for change in self.changes(metric, since, until)
+                if change[3] is not None and
+                change[3] - (change[2] or 0) > by]
+
+    def top_movers(self, metric, since, until=None, count=10):
+        """ Returns the changes with the largest difference (in either
+            direction), largest first. Things that are new or gone
+            count as changing from or to 0.
+        """
+        assert isinstance(count, int)
+
+        rv = sorted(self.changes(metric, since, until),
+                    key=lambda change: -abs((change[3] or 0) -
+                                            (change[2] or 0)))
+        return rv[:count]
+
+
+def format_change(change):
+    file_name, function, old, new = change
+    if function:
+        name = "%s, function %s" % (file_name, function)
+    else:
+        name = file_name
+    if old is None:
+        return "%s: new, %u" % (name, new)
+    elif new is None:
+        return "%s: removed, was %u" % (name, old)
+    else:
+        return "%s: %u -> %u (%+d)" % (name, old, new, new - old)
+
+
+def main():
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    # pylint: enable=import-outside-toplevel
+
+    ap = argparse.ArgumentParser(
+        description="Query the metrics history recorded by mh_metric")
+    ap.add_argument("database",
+                    help="Metrics history database")
+    ap.add_argument("query",
+                    choices=["runs", "grown", "movers"],
+                    help=("runs: list all recorded runs;"
+                          " grown: list everything whose metric grew;"
+                          " movers: list the largest changes"))
+    ap.add_argument("--metric",
+                    choices=sorted(config.METRICS),
+                    default="cyc",
+                    help="Metric to look at (default cyc)")
+    ap.add_argument("--since",
+                    default=None,
+                    metavar="COMMIT",
+                    help=("Commit id (or git ref) of the run to compare"
+                          " against"))
+    ap.add_argument("--until",
+                    default=None,
+                    metavar="COMMIT",
+                    help=("Commit id (or git ref) of the run to compare."
+                          " By default this is the latest run."))
+    ap.add_argument("--by",
+                    default=0,
+                    type=int,
+                    help=("For grown, only list things that grew by more"
+                          " than this"))
+    ap.add_argument("--count",
+                    default=10,
+                    type=int,
+                    help="For movers, the number of changes to list")
+    options = ap.parse_args()
+
+    if options.query != "runs" and options.since is None:
+        ap.error("the %s query requires --since" % options.query)
+
+    history = Metric_History(options.database)
+    try:
+        if options.query == "runs":
+            for commit_id, files, changed in history.runs():
+                print("%s: %u file(s), %u with new measures" %
+                      (commit_id, files, changed))
+        elif options.query == "grown":
+            for change in history.grown(options.metric,
+                                        options.since,
+                                        options.until,
+                                        options.by):
+                print(format_change(change))
+        else:
+            for change in history.top_movers(options.metric,
+                                             options.since,
+                                             options.until,
+                                             options.count):
+                print(format_change(change))
+    except ValueError as err:
+        ap.error(str(err))
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
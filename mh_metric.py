@@ -29,11 +29,18 @@
 import os
 import sys
 import html
-import functools
+import json
+import mmap
+import heapq
+import pickle
+import hashlib
+import tempfile
 
 import command_line
 import work_package
 import config
+import config_files
+import metric_history
 
 from errors import Error, ICE, Message_Handler
 from m_ast import *
@@ -170,50 +177,60 @@ def parameters(node):
         return 0
 
 
+class Global_Visitor(Dispatch_Visitor):
+    # pylint: disable=unused-argument
+
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def visit_global(self, node, n_parent, relation):
+        self.names |= set(n_ident.t_ident.value
+                          for n_ident in node.l_names)
+
+    DISPATCH = {Global_Statement : visit_global}
+
+
 @measures("globals")
 def direct_globals(node):
     assert isinstance(node, (Function_Definition,
                              Script_File))
 
-    class Global_Visitor(AST_Visitor):
-        def __init__(self):
-            self.names = set()
-
-        def visit(self, node, n_parent, relation):
-            if isinstance(node, Global_Statement):
-                self.names |= set(n_ident.t_ident.value
-                                  for n_ident in node.l_names)
-
     gvis = Global_Visitor()
 
     if isinstance(node, Function_Definition):
-        node.n_body.visit(None, gvis, "Root")
+        traverse(node.n_body, gvis)
     else:
-        node.n_statements.visit(None, gvis, "Root")
+        traverse(node.n_statements, gvis)
 
     return len(gvis.names)
 
 
+class Persistent_Visitor(Dispatch_Visitor):
+    # pylint: disable=unused-argument
+
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def visit_persistent(self, node, n_parent, relation):
+        self.names |= set(n_ident.t_ident.value
+                          for n_ident in node.l_names)
+
+    DISPATCH = {Persistent_Statement : visit_persistent}
+
+
 @measures("persistent")
 def persistent_variables(node):
     assert isinstance(node, (Function_Definition,
                              Script_File))
 
-    class Persistent_Visitor(AST_Visitor):
-        def __init__(self):
-            self.names = set()
-
-        def visit(self, node, n_parent, relation):
-            if isinstance(node, Persistent_Statement):
-                self.names |= set(n_ident.t_ident.value
-                                  for n_ident in node.l_names)
-
     pvis = Persistent_Visitor()
 
     if isinstance(node, Function_Definition):
-        node.n_body.visit(None, pvis, "Root")
+        traverse(node.n_body, pvis)
     else:
-        node.n_statements.visit(None, pvis, "Root")
+        traverse(node.n_statements, pvis)
 
     return len(pvis.names)
 
@@ -251,6 +268,40 @@ def function_length(node):
             return n_cu.file_length - node.t_fun.location.line + 1
 
 
+class Cyclomatic_Complexity_Visitor(Dispatch_Visitor):
+    # pylint: disable=unused-argument
+
+    def __init__(self):
+        super().__init__()
+        self.metric = 1
+
+    def visit_logical_operation(self, node, n_parent, relation):
+        if node.short_circuit:
+            self.metric += 1
+
+    def visit_decision(self, node, n_parent, relation):
+        self.metric += 1
+
+    def visit_if(self, node, n_parent, relation):
+        if node.has_else:
+            self.metric += len(node.l_actions) - 1
+        else:
+            self.metric += len(node.l_actions)
+
+    def visit_switch(self, node, n_parent, relation):
+        if node.has_otherwise:
+            self.metric += len(node.l_actions) - 1
+        else:
+            self.metric += len(node.l_actions)
+
+    DISPATCH = {Binary_Logical_Operation : visit_logical_operation,
+                For_Loop_Statement       : visit_decision,
+                While_Statement          : visit_decision,
+                Try_Statement            : visit_decision,
+                If_Statement             : visit_if,
+                Switch_Statement         : visit_switch}
+
+
 @measures("cyc")
 def cyclomatic_complexity(node):
     assert isinstance(node, (Function_Definition,
@@ -259,35 +310,12 @@ def cyclomatic_complexity(node):
     # https://uk.mathworks.com/help/matlab/ref/logicaloperatorsshortcircuit.html
     # for short-circuit semantics
 
-    class Cyclomatic_Complexity_Visitor(AST_Visitor):
-        def __init__(self):
-            self.metric = 1
-
-        def visit(self, node, n_parent, relation):
-            if isinstance(node, Binary_Logical_Operation):
-                if node.short_circuit:
-                    self.metric += 1
-            elif isinstance(node, (For_Loop_Statement,
-                                   While_Statement,
-                                   Try_Statement)):
-                self.metric += 1
-            elif isinstance(node, If_Statement):
-                if node.has_else:
-                    self.metric += len(node.l_actions) - 1
-                else:
-                    self.metric += len(node.l_actions)
-            elif isinstance(node, Switch_Statement):
-                if node.has_otherwise:
-                    self.metric += len(node.l_actions) - 1
-                else:
-                    self.metric += len(node.l_actions)
-
     cvis = Cyclomatic_Complexity_Visitor()
 
     if isinstance(node, Function_Definition):
-        node.n_body.visit(None, cvis, "Root")
+        traverse(node.n_body, cvis)
     else:
-        node.n_statements.visit(None, cvis, "Root")
+        traverse(node.n_statements, cvis)
 
     return cvis.metric
 
@@ -296,7 +324,22 @@ def cyclomatic_complexity(node):
 # Infrastructure
 ##############################################################################
 
-def check_metric(mh, cfg, loc, metric, metrics, justifications):
+def metric_needed(cfg, metric, ci):
+    """ Returns true if the given metric should be computed. In CI
+        mode we only report violations, so we only need the metrics
+        that have a limit.
+    """
+    assert isinstance(metric, str)
+    assert isinstance(ci, bool)
+
+    return (config.metric_enabled(cfg, metric) and
+            (not ci or config.metric_check(cfg, metric)))
+
+
+def check_metric(mh, cfg, loc, metric, metrics, justifications,
+                 baseline=None, name=None):
+    # If a baseline is given, deviations it already has (with at
+    # least the same measure) for the given name are not reported
     if not config.metric_enabled(cfg, metric):
         return
 
@@ -313,28 +356,142 @@ def check_metric(mh, cfg, loc, metric, metrics, justifications):
                 mh.metric_justifications += 1
                 justifications[metric].applies = True
                 metrics[metric]["reason"] = justifications[metric].reason()
-            else:
+                return
+
+            known = baseline.lookup(name, metric) if baseline else None
+            if known is None:
                 mh.metric_issue(loc,
                                 "exceeded %s: measured %u > limit %u" %
                                 (metric, measure, limit))
+            elif measure > known:
+                mh.metric_issue(loc,
+                                "exceeded %s: measured %u > limit %u"
+                                " (baseline %u)" %
+                                (metric, measure, limit, known))
+            else:
+                mh.baselined_metrics += 1
 
 
-def get_justifications(mh, n_root):
-    assert isinstance(mh, Message_Handler)
-    assert isinstance(n_root, Sequence_Of_Statements)
+class Baseline:
+    """ Metric deviations recorded by an earlier run
 
-    justifications = {}
+    The file has one line "<name>\t<metric>\t<measure>" for each
+    deviation, where the name is the file name, or the file name and
+    the (qualified) function name joined by "::". Since line numbers
+    are not part of it, code moving around does not matter. File
+    names are relative to the directory containing the baseline, so
+    it does not matter where we are run from either.
+
+    Lines are sorted by name and metric, so we can look up entries
+    with a binary search over the memory-mapped file, instead of
+    reading it all in each worker.
+    """
+    def __init__(self, file_name):
+        assert isinstance(file_name, str)
 
-    for n_statement in n_root.l_statements:
-        if isinstance(n_statement, Metric_Justification_Pragma):
-            if n_statement.metric() in justifications:
-                mh.warning(n_statement.loc(),
-                           "duplicate justification for %s" %
-                           n_statement.metric)
+        self.root = os.path.dirname(os.path.abspath(file_name))
+        # The directory file names in the baseline are relative to
+
+        with open(file_name, "rb") as fd:
+            if os.fstat(fd.fileno()).st_size:
+                self.data = mmap.mmap(fd.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            else:
+                self.data = b""
+
+    def lookup(self, name, metric):
+        """ Returns the measure recorded for the given name and metric,
+            or None.
+        """
+        assert isinstance(name, str)
+        assert isinstance(metric, str)
+
+        target = ("%s\t%s" % (Baseline.relative_name(self.root, name),
+                               metric)).encode("utf-8")
+
+        # Both lo and hi are always at the start of a line
+        lo = 0
+        hi = len(self.data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.data.rfind(b"\n", 0, mid) + 1
+            end = self.data.find(b"\n", mid)
+            if end < 0:
+                end = len(self.data)
+
+            key, _, measure = self.data[start:end].rpartition(b"\t")
+            if key < target:
+                lo = end + 1
+            elif key > target:
+                hi = start
             else:
-                justifications[n_statement.metric()] = n_statement
+                return int(measure)
 
-    return justifications
+        return None
+
+    @staticmethod
+    def relative_name(root, name):
+        # Returns the name as it appears in a baseline in the given
+        # directory: the file name part is made relative to it, with
+        # / as the separator on all platforms
+        assert isinstance(root, str)
+        assert isinstance(name, str)
+
+        file_name, sep, function_name = name.partition("::")
+        return (metric_history.relative_name(root, file_name) +
+                sep + function_name)
+
+    @staticmethod
+    def deviations(root, file_name, metrics):
+        # Returns the baseline lines for all deviations in the metrics
+        # of one file that are not justified, for a baseline in the
+        # given directory
+        assert isinstance(root, str)
+        assert isinstance(file_name, str)
+
+        file_name = Baseline.relative_name(root, file_name)
+        rv = []
+
+        def add(name, results):
+            for metric, result in results.items():
+                if result["limit"] is not None and \
+                   result["measure"] is not None and \
+                   result["measure"] > result["limit"] and \
+                   not result["reason"]:
+                    rv.append("%s\t%s\t%u\n" % (name,
+                                                 metric,
+                                                 result["measure"]))
+
+        if not metrics["errors"]:
+            add(file_name, metrics["metrics"])
+            for function_name, results in metrics["functions"].items():
+                add(file_name + "::" + function_name, results)
+
+        return rv
+
+    @staticmethod
+    def write(file_name, lines):
+        assert isinstance(file_name, str)
+        assert isinstance(lines, list)
+
+        # We sort by the name and metric as bytes, which is the order
+        # lookup relies on
+        lines.sort(key=lambda line: line.rsplit("\t", 1)[0].encode("utf-8"))
+        with open(file_name + ".tmp", "w", encoding="utf-8") as fd:
+            fd.writelines(lines)
+        os.replace(file_name + ".tmp", file_name)
+
+
+BASELINES = {}
+# Baselines opened by this process, by file name
+
+
+def get_baseline(file_name):
+    assert isinstance(file_name, str)
+
+    if file_name not in BASELINES:
+        BASELINES[file_name] = Baseline(file_name)
+    return BASELINES[file_name]
 
 
 def get_file_justifications(mh, n_cu):
@@ -368,93 +525,302 @@ def get_file_justifications(mh, n_cu):
     return justifications
 
 
-def get_function_metrics(mh, cfg, tree):
-    assert isinstance(tree, Compilation_Unit)
+class Function_Measures:
+    """ What we know so far about a function (or script) while
+        traversing its body
+    """
+    def __init__(self, node, name, n_body):
+        assert isinstance(node, (Function_Definition, Script_File))
+        assert isinstance(name, str)
+        assert isinstance(n_body, Sequence_Of_Statements)
 
-    metrics = {}
-    justifications = {}
+        self.node = node
+        self.name = name
 
-    def process_function(n_fdef, naming_stack):
-        assert isinstance(n_fdef, Function_Definition)
+        self.n_body = n_body
+        self.in_body = False
+        # We only measure things inside the body, and not for example
+        # in argument validation blocks
 
-        # We need a unique name for the function for this function.
-        name = "::".join(map(str, naming_stack + [n_fdef.n_sig.n_name]))
+        self.globals = set()
+        self.persistent = set()
+        self.cyc = 1
+        self.justifications = {}
+
+
+class Function_Metrics_Visitor(Dispatch_Visitor):
+    """ Computes all function metrics of a compilation unit in one pass
+
+    The metrics are the same as the ones computed by the functions in
+    MEASURE, but instead of walking over each function once for each
+    metric we walk the tree once. Path counts and nesting depth are
+    worked out bottom-up: when we're done with a statement (or
+    sequence of statements) we remember them, and the enclosing
+    statement then uses them.
+    """
+    # pylint: disable=unused-argument
+
+    def __init__(self, mh, cfg, ci=False, baseline=None, file_name=None):
+        assert isinstance(ci, bool)
+        super().__init__()
+        self.mh = mh
+        self.cfg = cfg
+
+        self.baseline = baseline
+        self.file_name = file_name
+        # Deviations in the baseline are not reported. Function names
+        # are looked up there with the file name in front.
 
-        metrics[name] = {m: {"measure" : MEASURE[m](n_fdef),
-                             "limit"   : None,
-                             "reason"  : None}
-                         for m in config.FUNCTION_METRICS
-                         if config.metric_enabled(cfg, m)}
+        self.enabled = [m for m in config.FUNCTION_METRICS
+                        if metric_needed(cfg, m, ci)]
 
-        justifications[name] = get_justifications(mh, n_fdef.n_body)
+        self.bottom_up = "npath" in self.enabled or "cnest" in self.enabled
+        # If we need to work out path counts and nesting depth
 
-        return name
+        self.metrics = {}
+        self.justifications = {}
+
+        self.name_stack = []
+        self.functions = []
+        # Function_Measures for the functions we're inside
+
+        self.npath = {}
+        self.cnest = {}
+        # Path count and nesting depth of the statements (and
+        # sequences of statements) we're done with, but the enclosing
+        # statement is not
+
+    def start_function(self, node, name, n_body):
+        # Reserve a place for the function, so that functions appear
+        # in the same order as they are in the file
+        self.metrics[name] = None
+        self.functions.append(Function_Measures(node, name, n_body))
+
+    def finish_function(self):
+        function = self.functions.pop()
+        n_body = function.n_body
+
+        measure = {
+            "globals"    : len(function.globals),
+            "persistent" : len(function.persistent),
+            "cyc"        : function.cyc,
+        }
+        if self.bottom_up:
+            measure["npath"] = self.npath.pop(n_body)
+            measure["cnest"] = self.cnest.pop(n_body)
+
+        self.metrics[function.name] = {
+            m: {"measure" : (measure[m] if m in measure
+                             else MEASURE[m](function.node)),
+                "limit"   : None,
+                "reason"  : None}
+            for m in self.enabled}
+        self.justifications[function.name] = function.justifications
 
-    def process_script(n_script):
-        assert isinstance(n_script, Script_File)
+        # Check+justify function metrics
+        for function_metric in config.FUNCTION_METRICS:
+            check_metric(self.mh, self.cfg,
+                         function.node.loc(),
+                         function_metric,
+                         self.metrics[function.name],
+                         self.justifications[function.name],
+                         self.baseline,
+                         "%s::%s" % (self.file_name, function.name))
+
+    def current_body(self):
+        # Returns the function whose body we're in, or None
+        if self.functions and self.functions[-1].in_body:
+            return self.functions[-1]
+        else:
+            return None
 
+    def visit_function(self, node, n_parent, relation):
+        # We need a unique name for the function for this function.
+        name = "::".join(map(str, self.name_stack + [node.n_sig.n_name]))
+        self.name_stack.append(node.n_sig.n_name)
+        self.start_function(node, name, node.n_body)
+
+    def visit_class(self, node, n_parent, relation):
+        self.name_stack.append(node.n_name)
+
+    def visit_script(self, node, n_parent, relation):
         # We need a unique name for the script
-        name = n_script.name.rsplit(".")[0]
+        name = node.name.rsplit(".")[0]
+        self.name_stack.append(node.name)
+        self.start_function(node, name, node.n_statements)
+
+    def visit_sequence(self, node, n_parent, relation):
+        if self.functions and node is self.functions[-1].n_body:
+            self.functions[-1].in_body = True
+
+    def visit_justification(self, node, n_parent, relation):
+        function = self.current_body()
+        if function is None or n_parent is not function.n_body:
+            return
+        elif node.metric() in function.justifications:
+            self.mh.warning(node.loc(),
+                            "duplicate justification for %s" %
+                            node.metric())
+        else:
+            function.justifications[node.metric()] = node
+
+    def visit_global(self, node, n_parent, relation):
+        function = self.current_body()
+        if function:
+            function.globals |= set(n_ident.t_ident.value
+                                    for n_ident in node.l_names)
+
+    def visit_persistent(self, node, n_parent, relation):
+        function = self.current_body()
+        if function:
+            function.persistent |= set(n_ident.t_ident.value
+                                       for n_ident in node.l_names)
+
+    # See
+    # https://uk.mathworks.com/help/matlab/ref/logicaloperatorsshortcircuit.html
+    # for short-circuit semantics
+    def visit_logical_operation(self, node, n_parent, relation):
+        function = self.current_body()
+        if function and node.short_circuit:
+            function.cyc += 1
+
+    def visit_decision(self, node, n_parent, relation):
+        function = self.current_body()
+        if function:
+            function.cyc += 1
+
+    def visit_if(self, node, n_parent, relation):
+        function = self.current_body()
+        if function:
+            function.cyc += len(node.l_actions) - int(node.has_else)
 
-        metrics[name] = {m: {"measure" : MEASURE[m](n_script),
-                             "limit"   : None,
-                             "reason"  : None}
-                         for m in config.FUNCTION_METRICS
-                         if config.metric_enabled(cfg, m)}
+    def visit_switch(self, node, n_parent, relation):
+        function = self.current_body()
+        if function:
+            function.cyc += len(node.l_actions) - int(node.has_otherwise)
 
-        justifications[name] = get_justifications(mh, n_script.n_statements)
+    def visit_end_function(self, node, n_parent, relation):
+        self.finish_function()
+        self.name_stack.pop()
 
-        return name
+    def visit_end_class(self, node, n_parent, relation):
+        self.name_stack.pop()
 
-    class Function_Visitor(AST_Visitor):
-        def __init__(self):
-            self.name_stack = []
+    def visit_end_script(self, node, n_parent, relation):
+        self.finish_function()
 
-        def visit(self, node, n_parent, relation):
-            name = None
-            if isinstance(node, Function_Definition):
-                name = process_function(node, self.name_stack)
-                self.name_stack.append(node.n_sig.n_name)
-            elif isinstance(node, Class_Definition):
-                self.name_stack.append(node.n_name)
-            elif isinstance(node, Script_File):
-                name = process_script(node)
-                self.name_stack.append(node.name)
+    def visit_end_sequence(self, node, n_parent, relation):
+        if self.functions and node is self.functions[-1].n_body:
+            self.functions[-1].in_body = False
 
-            # Check+justify function metrics
+        if not self.bottom_up:
+            return
 
-            if name is not None:
-                for function_metric in config.FUNCTION_METRICS:
-                    check_metric(mh, cfg, node.loc(), function_metric,
-                                 metrics[name],
-                                 justifications[name])
+        # Only control structures (but not spmd blocks) multiply the
+        # paths through a sequence
+        paths = 1
+        nesting = 0
+        for n_statement in node.l_statements:
+            if n_statement in self.npath:
+                paths *= self.npath.pop(n_statement)
+            nesting = max(nesting, self.cnest.pop(n_statement, 0))
+        self.npath[node] = paths
+        self.cnest[node] = nesting
+
+    def visit_end_if(self, node, n_parent, relation):
+        if not self.bottom_up:
+            return
+        self.npath[node] = (sum(self.npath.pop(n_action.n_body)
+                                for n_action in node.l_actions) +
+                            int(not node.has_else))
+        self.cnest[node] = 1 + max((self.cnest.pop(n_action.n_body)
+                                    for n_action in node.l_actions),
+                                   default=0)
+
+    def visit_end_switch(self, node, n_parent, relation):
+        if not self.bottom_up:
+            return
+        self.npath[node] = (sum(self.npath.pop(n_action.n_body)
+                                for n_action in node.l_actions) +
+                            int(not node.has_otherwise))
+        self.cnest[node] = 1 + max((self.cnest.pop(n_action.n_body)
+                                    for n_action in node.l_actions),
+                                   default=0)
+
+    def visit_end_loop(self, node, n_parent, relation):
+        if not self.bottom_up:
+            return
+        self.npath[node] = 1 + self.npath.pop(node.n_body)
+        self.cnest[node] = 1 + self.cnest.pop(node.n_body)
 
-        def visit_end(self, node, n_parent, relation):
-            if isinstance(node, Definition):
-                self.name_stack.pop()
+    def visit_end_try(self, node, n_parent, relation):
+        if not self.bottom_up:
+            return
+        self.npath[node] = self.npath.pop(node.n_body) * 2
+        nesting = self.cnest.pop(node.n_body)
+        if node.n_handler:
+            del self.npath[node.n_handler]
+            nesting = max(nesting, self.cnest.pop(node.n_handler))
+        self.cnest[node] = 1 + nesting
+
+    def visit_end_spmd(self, node, n_parent, relation):
+        if not self.bottom_up:
+            return
+        del self.npath[node.n_body]
+        self.cnest[node] = self.cnest.pop(node.n_body)
+
+    DISPATCH     = {Function_Definition         : visit_function,
+                    Class_Definition            : visit_class,
+                    Script_File                 : visit_script,
+                    Sequence_Of_Statements      : visit_sequence,
+                    Metric_Justification_Pragma : visit_justification,
+                    Global_Statement            : visit_global,
+                    Persistent_Statement        : visit_persistent,
+                    Binary_Logical_Operation    : visit_logical_operation,
+                    For_Loop_Statement          : visit_decision,
+                    While_Statement             : visit_decision,
+                    Try_Statement               : visit_decision,
+                    If_Statement                : visit_if,
+                    Switch_Statement            : visit_switch}
+    DISPATCH_END = {Function_Definition         : visit_end_function,
+                    Class_Definition            : visit_end_class,
+                    Script_File                 : visit_end_script,
+                    Sequence_Of_Statements      : visit_end_sequence,
+                    If_Statement                : visit_end_if,
+                    Switch_Statement            : visit_end_switch,
+                    For_Loop_Statement          : visit_end_loop,
+                    While_Statement             : visit_end_loop,
+                    Try_Statement               : visit_end_try,
+                    SPMD_Statement              : visit_end_spmd}
+
+
+def get_function_metrics(mh, cfg, tree, ci=False,
+                         baseline=None, file_name=None):
+    assert isinstance(tree, Compilation_Unit)
 
-    tree.visit(None, Function_Visitor(), "Root")
-    return metrics
+    fvis = Function_Metrics_Visitor(mh, cfg, ci, baseline, file_name)
+    traverse(tree, fvis)
+    return fvis.metrics
 
 
 def warn_unused_justifications(mh, n_cu):
     assert isinstance(mh, Message_Handler)
     assert isinstance(n_cu, Compilation_Unit)
 
-    class Justification_Visitor(AST_Visitor):
-        def __init__(self):
-            self.name_stack = []
+    class Justification_Visitor(Dispatch_Visitor):
+        # pylint: disable=unused-argument
 
-        def visit(self, node, n_parent, relation):
-            if isinstance(node, Metric_Justification_Pragma):
-                if not node.applies:
-                    mh.warning(node.loc(),
-                               "this justification does not apply to anything")
+        def visit_justification(self, node, n_parent, relation):
+            if not node.applies:
+                mh.warning(node.loc(),
+                           "this justification does not apply to anything")
 
-    n_cu.visit(None, Justification_Visitor(), "Root")
+        DISPATCH = {Metric_Justification_Pragma : visit_justification}
 
+    traverse(n_cu, Justification_Visitor())
 
-def write_text_report(fd, all_metrics, worst_offenders):
+
+def write_text_report(fd, all_metrics, worst_offenders, rollup=None):
     first = True
 
     fd.write("=== Code metric by file:\n\n")
@@ -510,6 +876,31 @@ def write_text_report(fd, all_metrics, worst_offenders):
                 else:
                     fd.write("\n")
 
+    if rollup:
+        fd.write("\n=== Code metric by directory:\n")
+
+        for directory, summary in rollup:
+            fd.write("\n")
+            fd.write("* Code metrics for directory %s:\n" % directory)
+            names = ["Files", "Functions"] + \
+                [config.METRICS[m]["name"] for m in summary["metrics"]]
+            max_len = max(len(name) for name in names)
+            for name, count in (("Files", summary["files"]),
+                                ("Functions", summary["functions"])):
+                fd.write("  %s: %u\n" % (name.ljust(max_len), count))
+            for metric in config.FILE_METRICS + config.FUNCTION_METRICS:
+                if metric not in summary["metrics"]:
+                    continue
+                results = summary["metrics"][metric]
+                fd.write("  %-*s: total %u, max %u, median %u,"
+                         " 90th percentile %u\n" %
+                         (max_len,
+                          config.METRICS[metric]["name"],
+                          results["total"],
+                          results["max"],
+                          results["median"],
+                          results["p90"]))
+
     if worst_offenders:
         fd.write("\n=== Global summary of worst offenders by metric:\n\n")
 
@@ -518,11 +909,11 @@ def write_text_report(fd, all_metrics, worst_offenders):
                 continue
             fd.write("* File metric '%s':\n" %
                      config.METRICS[file_metric]["name"])
-            for rank, file_name in enumerate(worst_offenders[file_metric], 1):
-                if file_name:
-                    mdata = all_metrics[file_name]["metrics"][file_metric]
+            for rank, entry in enumerate(worst_offenders[file_metric], 1):
+                if entry:
+                    measure, file_name = entry
                     fd.write("  %u. %u (%s)\n" % (rank,
-                                                  mdata["measure"],
+                                                  measure,
                                                   file_name))
             fd.write("\n")
 
@@ -531,30 +922,31 @@ def write_text_report(fd, all_metrics, worst_offenders):
                 continue
             fd.write("* Function metric '%s':\n" %
                      config.METRICS[function_metric]["name"])
-            for rank, tup in enumerate(worst_offenders[function_metric], 1):
-                if tup:
-                    file_name, function_name = tup
-                    mdata = (all_metrics[file_name]["functions"]
-                             [function_name][function_metric])
+            for rank, entry in enumerate(worst_offenders[function_metric],
+                                         1):
+                if entry:
+                    measure, file_name, function_name = entry
                     fd.write("  %u. %u (%s, function %s)\n" %
                              (rank,
-                              mdata["measure"],
+                              measure,
                               file_name,
                               function_name))
             fd.write("\n")
 
 
-def write_html_report(fd, fd_name, all_metrics, worst_offenders):
-    docs_dir = os.path.dirname(os.path.relpath(
+def html_docs_dir(fd_name):
+    # Link style-sheet with a relative path based on where the
+    # output report file will be
+    return os.path.dirname(os.path.relpath(
         os.path.join(sys.path[0], "docs", "style.css"),
         os.path.dirname(os.path.abspath(fd_name)))).replace("\\", "/")
 
+
+def write_html_header(fd, docs_dir):
     fd.write("<!DOCTYPE html>\n")
     fd.write("<html>\n")
     fd.write("<head>\n")
     fd.write("<meta charset=\"UTF-8\">\n")
-    # Link style-sheet with a relative path based on where the
-    # output report file will be
     fd.write("<link rel=\"stylesheet\" href=\"file:%s/style.css\">\n" %
              docs_dir)
     fd.write("<title>MISS_HIT Report</title>\n")
@@ -564,176 +956,386 @@ def write_html_report(fd, fd_name, all_metrics, worst_offenders):
     fd.write("<main>\n")
     fd.write("<div></div>\n")
 
-    # Produce worst-offender table
-    if worst_offenders:
-        fd.write("<div class='title'>\n")
-        fd.write("<img src='%s/assets/alert-triangle.svg' alt='Warning'>\n" %
-                 docs_dir)
-        fd.write("<h1>Worst offenders</h1>\n")
-        fd.write("</div>\n")
-        fd.write("<section>\n")
 
-        fd.write("<div class='metrics'>\n")
-        fd.write("<table>\n")
+def write_html_footer(fd):
+    fd.write("</main>\n")
+    fd.write("<footer>\n")
+    fd.write("MISS_HIT is licensed under the GPLv3\n")
+    fd.write("</footer>\n")
+    fd.write("</body>\n")
+    fd.write("</html>\n")
 
-        fd.write("<thead>\n")
+
+def write_html_worst_offenders(fd, docs_dir, worst_offenders, link):
+    # link is a function that returns the link target for a file
+    fd.write("<div class='title'>\n")
+    fd.write("<img src='%s/assets/alert-triangle.svg' alt='Warning'>\n" %
+             docs_dir)
+    fd.write("<h1>Worst offenders</h1>\n")
+    fd.write("</div>\n")
+    fd.write("<section>\n")
+
+    fd.write("<div class='metrics'>\n")
+    fd.write("<table>\n")
+
+    fd.write("<thead>\n")
+    fd.write("<tr>\n")
+    fd.write("  <td>Rank</td>\n")
+    for file_metric in config.FILE_METRICS:
+        if file_metric in worst_offenders:
+            fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
+                     (config.METRICS[file_metric]["help"],
+                      config.METRICS[file_metric]["name"]))
+    for function_metric in config.FUNCTION_METRICS:
+        if function_metric in worst_offenders:
+            fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
+                     (config.METRICS[function_metric]["help"],
+                      config.METRICS[function_metric]["name"]))
+    fd.write("</tr>\n")
+    fd.write("</thead>\n")
+    fd.write("<tbody>\n")
+
+    count = worst_offender_count(worst_offenders)
+    for rank in range(count):
         fd.write("<tr>\n")
-        fd.write("  <td>Rank</td>\n")
+        fd.write("  <td>%s</td>\n" % (rank + 1))
         for file_metric in config.FILE_METRICS:
-            if file_metric in worst_offenders:
-                fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
-                         (config.METRICS[file_metric]["help"],
-                          config.METRICS[file_metric]["name"]))
-        for function_metric in config.FUNCTION_METRICS:
-            if function_metric in worst_offenders:
-                fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
-                         (config.METRICS[function_metric]["help"],
-                          config.METRICS[function_metric]["name"]))
-        fd.write("</tr>\n")
-        fd.write("</thead>\n")
-        fd.write("<tbody>\n")
-
-        count = worst_offender_count(worst_offenders)
-        for rank in range(count):
-            fd.write("<tr>\n")
-            fd.write("  <td>%s</td>\n" % (rank + 1))
-            for file_metric in config.FILE_METRICS:
-                if file_metric not in worst_offenders:
-                    continue
-                file_name = worst_offenders[file_metric][rank]
-                if file_name:
-                    mdata = all_metrics[file_name]["metrics"][file_metric]
-                    fd.write("  <td class='tip' tip='%s'>"
-                             "<a href='#%s'>%u</a></td>\n" %
-                             (os.path.basename(file_name),
-                              file_name,
-                              mdata["measure"]))
+            if file_metric not in worst_offenders:
+                continue
+            entry = worst_offenders[file_metric][rank]
+            if entry:
+                measure, file_name = entry
+                fd.write("  <td class='tip' tip='%s'>"
+                         "<a href='%s'>%u</a></td>\n" %
+                         (os.path.basename(file_name),
+                          link(file_name),
+                          measure))
 
-                else:
-                    fd.write("  <td class='na'></td>\n")
-            for function_metric in config.FUNCTION_METRICS:
-                if function_metric not in worst_offenders:
-                    continue
-                metric = worst_offenders[function_metric][rank]
-                if metric:
-                    file_name, function_name = metric
-                    mdata = (all_metrics[file_name]["functions"]
-                             [function_name][function_metric])
-                    fd.write("  <td class='tip' tip='%s'>"
-                             "<a href='#%s'>%u</a></td>\n" %
-                             ("%s in file %s" % (function_name,
-                                                 os.path.basename(file_name)),
-                              file_name,
+            else:
+                fd.write("  <td class='na'></td>\n")
+        for function_metric in config.FUNCTION_METRICS:
+            if function_metric not in worst_offenders:
+                continue
+            entry = worst_offenders[function_metric][rank]
+            if entry:
+                measure, file_name, function_name = entry
+                fd.write("  <td class='tip' tip='%s'>"
+                         "<a href='%s'>%u</a></td>\n" %
+                         ("%s in file %s" % (function_name,
+                                             os.path.basename(file_name)),
+                          link(file_name),
+                          measure))
 
-                              mdata["measure"]))
+            else:
+                fd.write("  <td class='na'></td>\n")
 
-                else:
-                    fd.write("  <td class='na'></td>\n")
+        fd.write("</tr>\n")
 
-            fd.write("</tr>\n")
+    fd.write("</tbody>\n")
+    fd.write("</table>\n")
+    fd.write("</div>\n")
 
-        fd.write("</tbody>\n")
-        fd.write("</table>\n")
-        fd.write("</div>\n")
+    fd.write("</section>\n")
 
-        fd.write("</section>\n")
 
-    # Produce full list of metrics
+def write_html_metrics_title(fd, docs_dir):
     fd.write("<div class='title'>\n")
     fd.write("<img src='%s/assets/bar-chart-2.svg' alt='Warning'>\n" %
              docs_dir)
     fd.write("<h1>Code metrics by file</h1>\n")
     fd.write("</div>\n")
-    fd.write("<section>\n")
 
-    for filename in sorted(all_metrics):
-        metrics = all_metrics[filename]
 
-        n_active_file_metrics = len(set(config.FILE_METRICS) -
+def write_html_file_metrics(fd, filename, metrics):
+    n_active_file_metrics = len(set(config.FILE_METRICS) -
+                                metrics["disabled"])
+    n_active_function_metrics = len(set(config.FUNCTION_METRICS) -
                                     metrics["disabled"])
-        n_active_function_metrics = len(set(config.FUNCTION_METRICS) -
-                                        metrics["disabled"])
 
-        fd.write("<div class='metrics'>\n")
-        fd.write("<h2><a name='%s'>%s</a></h2>\n" % (filename,
-                                                     filename))
-        fd.write("<table>\n")
+    fd.write("<div class='metrics'>\n")
+    fd.write("<h2><a name='%s'>%s</a></h2>\n" % (filename,
+                                                 filename))
+    fd.write("<table>\n")
 
-        fd.write("<thead>\n")
+    fd.write("<thead>\n")
+    fd.write("<tr>\n")
+    fd.write("  <td>Item</td>\n")
+    for file_metric in config.FILE_METRICS:
+        if file_metric in metrics["disabled"]:
+            continue
+        fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
+                 (config.METRICS[file_metric]["help"],
+                  config.METRICS[file_metric]["name"]))
+    for function_metric in config.FUNCTION_METRICS:
+        if function_metric in metrics["disabled"]:
+            continue
+        fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
+                 (config.METRICS[function_metric]["help"],
+                  config.METRICS[function_metric]["name"]))
+    fd.write("</tr>\n")
+    fd.write("</thead>\n")
+    fd.write("<tbody>\n")
+
+    fd.write("<tr>\n")
+    fd.write("  <td>%s</td>\n" % os.path.basename(filename))
+    for file_metric in config.FILE_METRICS:
+        if file_metric in metrics["disabled"]:
+            continue
+        results = metrics["metrics"][file_metric]
+        if results["measure"] is None:
+            fd.write("  <td class='na'></td>\n")
+        elif results["reason"]:
+            fd.write("  <td class='ok_justified tip' tip='%s'>%u</td>\n" %
+                     ("Justification: " + html.escape(results["reason"]),
+                      results["measure"]))
+        elif results["limit"] and results["measure"] > results["limit"]:
+            fd.write("  <td class='nok'>%u</td>\n" %
+                     results["measure"])
+        else:
+            fd.write("<td class='ok'>%u</td>" % results["measure"])
+    fd.write("  <td class='na'></td>\n" * n_active_function_metrics)
+    fd.write("</tr>\n")
+
+    for function in sorted(metrics["functions"]):
         fd.write("<tr>\n")
-        fd.write("  <td>Item</td>\n")
-        for file_metric in config.FILE_METRICS:
-            if file_metric in metrics["disabled"]:
-                continue
-            fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
-                     (config.METRICS[file_metric]["help"],
-                      config.METRICS[file_metric]["name"]))
+        fd.write("  <td><a name='%s'></a>%s</td>\n" % (function,
+                                                       function))
+        fd.write("  <td class='na'></td>\n" * n_active_file_metrics)
         for function_metric in config.FUNCTION_METRICS:
             if function_metric in metrics["disabled"]:
                 continue
-            fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
-                     (config.METRICS[function_metric]["help"],
-                      config.METRICS[function_metric]["name"]))
-        fd.write("</tr>\n")
-        fd.write("</thead>\n")
-        fd.write("<tbody>\n")
-
-        fd.write("<tr>\n")
-        fd.write("  <td>%s</td>\n" % os.path.basename(filename))
-        for file_metric in config.FILE_METRICS:
-            if file_metric in metrics["disabled"]:
-                continue
-            results = metrics["metrics"][file_metric]
+            results = metrics["functions"][function][function_metric]
             if results["measure"] is None:
                 fd.write("  <td class='na'></td>\n")
             elif results["reason"]:
-                fd.write("  <td class='ok_justified tip' tip='%s'>%u</td>\n" %
-                         ("Justification: " + html.escape(results["reason"]),
+                fd.write("  <td class='ok_justified tip' tip='%s'>"
+                         "%u</td>\n" %
+                         ("Justification: " +
+                          html.escape(results["reason"]),
                           results["measure"]))
-            elif results["limit"] and results["measure"] > results["limit"]:
+            elif results["limit"] and \
+                 results["measure"] > results["limit"]:
                 fd.write("  <td class='nok'>%u</td>\n" %
                          results["measure"])
             else:
-                fd.write("<td class='ok'>%u</td>" % results["measure"])
-        fd.write("  <td class='na'></td>\n" * n_active_function_metrics)
+                fd.write("  <td class='ok'>%u</td>\n" % results["measure"])
         fd.write("</tr>\n")
 
-        for function in sorted(metrics["functions"]):
+    fd.write("</tbody>\n")
+    fd.write("</table>\n")
+    fd.write("</div>\n")
+
+
+def write_html_rollup(fd, docs_dir, rollup):
+    fd.write("<div class='title'>\n")
+    fd.write("<img src='%s/assets/bar-chart-2.svg' alt='Warning'>\n" %
+             docs_dir)
+    fd.write("<h1>Code metrics by directory</h1>\n")
+    fd.write("</div>\n")
+    fd.write("<section>\n")
+
+    for directory, summary in rollup:
+        fd.write("<div class='metrics'>\n")
+        fd.write("<h2>%s (%u files, %u functions)</h2>\n" %
+                 (html.escape(directory),
+                  summary["files"],
+                  summary["functions"]))
+        fd.write("<table>\n")
+        fd.write("<thead>\n")
+        fd.write("<tr>\n")
+        fd.write("  <td>Metric</td>\n")
+        fd.write("  <td>Total</td>\n")
+        fd.write("  <td>Maximum</td>\n")
+        fd.write("  <td>Median</td>\n")
+        fd.write("  <td>90th percentile</td>\n")
+        fd.write("</tr>\n")
+        fd.write("</thead>\n")
+        fd.write("<tbody>\n")
+        for metric in config.FILE_METRICS + config.FUNCTION_METRICS:
+            if metric not in summary["metrics"]:
+                continue
+            results = summary["metrics"][metric]
             fd.write("<tr>\n")
-            fd.write("  <td><a name='%s'></a>%s</td>\n" % (function,
-                                                           function))
-            fd.write("  <td class='na'></td>\n" * n_active_file_metrics)
-            for function_metric in config.FUNCTION_METRICS:
-                if function_metric in metrics["disabled"]:
-                    continue
-                results = metrics["functions"][function][function_metric]
-                if results["measure"] is None:
-                    fd.write("  <td class='na'></td>\n")
-                elif results["reason"]:
-                    fd.write("  <td class='ok_justified tip' tip='%s'>"
-                             "%u</td>\n" %
-                             ("Justification: " +
-                              html.escape(results["reason"]),
-                              results["measure"]))
-                elif results["limit"] and \
-                     results["measure"] > results["limit"]:
-                    fd.write("  <td class='nok'>%u</td>\n" %
-                             results["measure"])
-                else:
-                    fd.write("  <td class='ok'>%u</td>\n" % results["measure"])
+            fd.write("  <td class='tip' tip='%s'>%s</td>\n" %
+                     (config.METRICS[metric]["help"],
+                      config.METRICS[metric]["name"]))
+            for item in ("total", "max", "median", "p90"):
+                fd.write("  <td>%u</td>\n" % results[item])
             fd.write("</tr>\n")
-
         fd.write("</tbody>\n")
         fd.write("</table>\n")
         fd.write("</div>\n")
 
     fd.write("</section>\n")
-    fd.write("</main>\n")
-    fd.write("<footer>\n")
-    fd.write("MISS_HIT is licensed under the GPLv3\n")
-    fd.write("</footer>\n")
-    fd.write("</body>\n")
-    fd.write("</html>\n")
+
+
+def write_html_report(fd, fd_name, all_metrics, worst_offenders,
+                      rollup=None):
+    docs_dir = html_docs_dir(fd_name)
+
+    write_html_header(fd, docs_dir)
+
+    # Produce worst-offender table
+    if worst_offenders:
+        write_html_worst_offenders(fd, docs_dir, worst_offenders,
+                                   lambda file_name: "#" + file_name)
+
+    # Produce metrics rolled up by directory
+    if rollup:
+        write_html_rollup(fd, docs_dir, rollup)
+
+    # Produce full list of metrics
+    write_html_metrics_title(fd, docs_dir)
+    fd.write("<section>\n")
+    for filename in sorted(all_metrics):
+        write_html_file_metrics(fd, filename, all_metrics[filename])
+    fd.write("</section>\n")
+
+    write_html_footer(fd)
+
+
+def write_json_report(fd, all_metrics, rollup=None):
+    # We write the metrics one file at a time, so that we do not need
+    # to build the entire document in memory
+    fd.write("{\n")
+    fd.write("\"files\": {")
+    for idx, filename in enumerate(sorted(all_metrics)):
+        fd.write("%s\n  %s: %s" % ("," if idx else "",
+                                   json.dumps(filename),
+                                   json.dumps(all_metrics[filename],
+                                              sort_keys=True,
+                                              default=sorted)))
+    fd.write("\n}")
+    if rollup is not None:
+        fd.write(",\n\"directories\": {")
+        for idx, (directory, summary) in enumerate(rollup):
+            fd.write("%s\n  %s: %s" % ("," if idx else "",
+                                       json.dumps(directory),
+                                       json.dumps(summary, sort_keys=True)))
+        fd.write("\n}")
+    fd.write("\n}\n")
+
+
+def html_page_name(directory):
+    # Each directory gets its own page. It is named after a hash of
+    # the directory, so that it has the same name in each run.
+    assert isinstance(directory, str)
+
+    return "metrics_%s.html" % \
+        hashlib.sha1(directory.encode("utf-8")).hexdigest()[:16]
+
+
+def write_html_pages(report_dir, all_metrics, worst_offenders, rollup=None):
+    """ Writes the HTML report as a small index page, and a page
+        for each directory
+
+    The index has the worst offenders and links to the page for
+    each directory. Each directory page remembers (in its first
+    line) a digest of its data, so that in the next run we only
+    write the pages that have changed. Only one page is built in
+    memory at a time.
+    """
+    assert isinstance(report_dir, str)
+
+    os.makedirs(report_dir, exist_ok=True)
+    index_name = os.path.join(report_dir, "index.html")
+    docs_dir = html_docs_dir(index_name)
+
+    directories = {}
+    for filename in all_metrics:
+        directory = os.path.dirname(filename)
+        if directory in directories:
+            directories[directory].append(filename)
+        else:
+            directories[directory] = [filename]
+
+    pages = []
+    # (directory, page, number of files, number of functions)
+
+    for directory in sorted(directories):
+        page = html_page_name(directory)
+        filenames = sorted(directories[directory])
+
+        digest = hashlib.sha1(docs_dir.encode("utf-8"))
+        n_functions = 0
+        for filename in filenames:
+            metrics = all_metrics[filename]
+            n_functions += len(metrics["functions"])
+            digest.update(json.dumps([filename, metrics],
+                                     sort_keys=True,
+                                     default=sorted).encode("utf-8"))
+        marker = "<!-- %s -->\n" % digest.hexdigest()
+        pages.append((directory, page, len(filenames), n_functions))
+
+        page_name = os.path.join(report_dir, page)
+        if os.path.isfile(page_name):
+            with open(page_name, "r", encoding="utf-8") as fd:
+                if fd.readline() == marker:
+                    continue
+
+        # We write to a temporary file first, so that we never leave
+        # a page behind that is incomplete but has a valid digest
+        tmp_name = page_name + ".tmp"
+        with open(tmp_name, "w", encoding="utf-8") as fd:
+            fd.write(marker)
+            write_html_header(fd, docs_dir)
+            fd.write("<div><a href='index.html'>Back to index</a></div>\n")
+            write_html_metrics_title(fd, docs_dir)
+            fd.write("<section>\n")
+            for filename in filenames:
+                write_html_file_metrics(fd, filename, all_metrics[filename])
+            fd.write("</section>\n")
+            write_html_footer(fd)
+        os.replace(tmp_name, page_name)
+
+    # Delete pages for directories that no longer have any metrics
+
+    current = set(page for _, page, _, _ in pages)
+    for name in os.listdir(report_dir):
+        if name.startswith("metrics_") and name.endswith(".html") and \
+           name not in current:
+            os.unlink(os.path.join(report_dir, name))
+
+    # Finally the index page
+
+    with open(index_name, "w", encoding="utf-8") as fd:
+        write_html_header(fd, docs_dir)
+
+        if worst_offenders:
+            write_html_worst_offenders(
+                fd, docs_dir, worst_offenders,
+                lambda file_name: "%s#%s" % (
+                    html_page_name(os.path.dirname(file_name)),
+                    file_name))
+
+        if rollup:
+            write_html_rollup(fd, docs_dir, rollup)
+
+        write_html_metrics_title(fd, docs_dir)
+        fd.write("<section>\n")
+        fd.write("<div class='metrics'>\n")
+        fd.write("<table>\n")
+        fd.write("<thead>\n")
+        fd.write("<tr>\n")
+        fd.write("  <td>Directory</td>\n")
+        fd.write("  <td>Files</td>\n")
+        fd.write("  <td>Functions</td>\n")
+        fd.write("</tr>\n")
+        fd.write("</thead>\n")
+        fd.write("<tbody>\n")
+        for directory, page, n_files, n_functions in pages:
+            fd.write("<tr>\n")
+            fd.write("  <td><a href='%s'>%s</a></td>\n" %
+                     (page, html.escape(directory or ".")))
+            fd.write("  <td>%u</td>\n" % n_files)
+            fd.write("  <td>%u</td>\n" % n_functions)
+            fd.write("</tr>\n")
+        fd.write("</tbody>\n")
+        fd.write("</table>\n")
+        fd.write("</div>\n")
+        fd.write("</section>\n")
+
+        write_html_footer(fd)
 
 
 def worst_offender_count(worst_offenders):
@@ -742,73 +1344,284 @@ def worst_offender_count(worst_offenders):
     raise ICE("cannot determine length of wo table")
 
 
-def build_worst_offenders_table(all_metrics, count):
-    assert isinstance(count, int) and count >= 1
-    # all_metrics = {filename -> {errors : bool
-    #                             functions : {fn_name -> MD}
-    #                             metrics : MD}}
-    # MD = {m_name -> {measure : INT
-    #                  limit   : INT
-    #                  reason  : STR}}
-
-    wot = {}
-    # file_metric -> [ filename, ... ]
-    # fn_metric -> [ (filename, fn_name), ... ]
-
-    def key_file_metric(file_name, metric):
-        return (all_metrics[file_name]["metrics"][metric]["measure"],
-                file_name)
+class Worst_Offenders:
+    """ Worst offenders for each metric, built as results come in
+
+    For each metric we only keep a heap of the (at most) count worst
+    entries seen so far, so the memory needed does not depend on the
+    number of files. Entries are (measure, file_name) for file
+    metrics and (measure, file_name, function_name) for function
+    metrics; ties are broken by name.
+    """
+    def __init__(self, count):
+        assert isinstance(count, int) and count >= 1
+
+        self.count = count
+        self.heaps = {m: [] for m in config.METRICS}
+
+    def push(self, metric, entry):
+        heap = self.heaps[metric]
+        if len(heap) < self.count:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def add_file(self, file_name, metrics):
+        # metrics = {errors    : bool
+        #            functions : {fn_name -> MD}
+        #            metrics   : MD}
+        # MD = {m_name -> {measure : INT
+        #                  limit   : INT
+        #                  reason  : STR}}
+        assert isinstance(file_name, str)
 
-    def key_function_metric(name_tuple, metric):
-        file_name, function_name = name_tuple
-        metrics = all_metrics[file_name]["functions"][function_name]
-        return (metrics[metric]["measure"],
-                file_name,
-                function_name)
+        if metrics["errors"]:
+            return
 
-    for file_metric in config.FILE_METRICS:
-        wot[file_metric] = []
-        for file_name in all_metrics:
-            metrics = all_metrics[file_name]
-            if metrics["errors"]:
-                continue
-            elif file_metric not in metrics["metrics"]:
-                continue
-            elif not metrics["metrics"][file_metric]["measure"]:
+        for file_metric in config.FILE_METRICS:
+            if file_metric not in metrics["metrics"]:
                 continue
-            wot[file_metric].append(file_name)
-        key_fn = functools.partial(key_file_metric,
-                                   metric=file_metric)
-        wot[file_metric].sort(key=key_fn, reverse=True)
+            measure = metrics["metrics"][file_metric]["measure"]
+            if measure:
+                self.push(file_metric, (measure, file_name))
 
-    for function_metric in config.FUNCTION_METRICS:
-        wot[function_metric] = []
-        for file_name in all_metrics:
-            metrics = all_metrics[file_name]
-            if metrics["errors"]:
-                continue
-            for function_name in metrics["functions"]:
-                function_metrics = metrics["functions"][function_name]
+        for function_name, function_metrics in metrics["functions"].items():
+            for function_metric in config.FUNCTION_METRICS:
                 if function_metric not in function_metrics:
                     continue
-                elif not function_metrics[function_metric]["measure"]:
+                measure = function_metrics[function_metric]["measure"]
+                if measure:
+                    self.push(function_metric,
+                              (measure, file_name, function_name))
+
+    def table(self):
+        # Returns the worst offenders, worst first, for each metric
+        # that has any. Each list is padded with None to count
+        # entries.
+        wot = {}
+        for metric in config.METRICS:
+            if self.heaps[metric]:
+                wot[metric] = sorted(self.heaps[metric], reverse=True)
+                wot[metric] += [None] * (self.count - len(wot[metric]))
+        return wot
+
+
+class Spilled_Metrics:
+    """ Metrics for each file, kept in a temporary file
+
+    This behaves like the dictionary of metrics we otherwise keep in
+    memory (file name -> metrics), but only the file names and the
+    position of their metrics in the file are kept in memory.
+    """
+    def __init__(self):
+        self.fd = tempfile.TemporaryFile()
+        self.offsets = {}
+
+    def update(self, metrics):
+        assert isinstance(metrics, dict)
+
+        self.fd.seek(0, os.SEEK_END)
+        for file_name, file_metrics in metrics.items():
+            self.offsets[file_name] = self.fd.tell()
+            pickle.dump(file_metrics, self.fd)
+
+    def __getitem__(self, file_name):
+        self.fd.seek(self.offsets[file_name])
+        return pickle.load(self.fd)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def add_histogram(histogram, other, sign=1):
+    # Adds (or with sign -1 removes) the counts of other to histogram.
+    # Both map measures to how often they occur.
+    for measure, count in other.items():
+        histogram[measure] = histogram.get(measure, 0) + sign * count
+        if histogram[measure] == 0:
+            del histogram[measure]
+
+
+def percentile(histogram, percent):
+    # Returns the given percentile (nearest rank) of a non-empty
+    # histogram
+    assert histogram
+    assert 0 < percent <= 100
+
+    rank = -(-sum(histogram.values()) * percent // 100)
+    for measure in sorted(histogram):
+        rank -= histogram[measure]
+        if rank <= 0:
+            return measure
+    raise ICE("percentile out of range")
+
+
+class Directory_Rollup:
+    """ Metrics rolled up for each directory and everything below it
+
+    For each directory (in the CONFIG_TREE) we keep a histogram of
+    each metric over the files directly in it. When asked for the
+    roll-up we combine these bottom-up, in one post-order pass over
+    the tree. We remember the combined histograms, so if something is
+    added (or added again after it is analysed again) we only
+    recompute the directories above it.
+
+    We are given metrics for units: a MATLAB file, or one block of a
+    Simulink model. A file is counted once, no matter how many units
+    it has.
+    """
+    def __init__(self):
+        self.own = {}
+        # directory -> histograms for the files directly in it
+
+        self.names = {}
+        # directory -> its name in the same form as the file names
+        # we have been given (e.g. relative or absolute)
+
+        self.files = set()
+        # The files we have seen
+
+        self.units = {}
+        # unit -> (directory, histograms) of the units we have seen
+
+        self.rolled = {}
+        # directory -> histograms for everything below it
+
+        self.dirty = set()
+        # Directories whose rolled up histograms are out of date
+
+    @staticmethod
+    def histograms(metrics):
+        # Returns the histograms for the metrics of one unit. We also
+        # keep the number of functions there; files are counted by
+        # add_unit.
+        rv = {"files"     : 0,
+              "functions" : 0,
+              "metrics"   : {}}
+
+        def add(results):
+            for metric, result in results.items():
+                if result["measure"] is None:
                     continue
-                wot[function_metric].append((file_name, function_name))
-        key_fn = functools.partial(key_function_metric,
-                                   metric=function_metric)
-        wot[function_metric].sort(key=key_fn, reverse=True)
-
-    # Make sure the length is as expected for each metric
-    for metric in config.METRICS:
-        if len(wot[metric]) == 0:
-            del wot[metric]
-        elif len(wot[metric]) < count:
-            wot[metric] += [None] * (count - len(wot[metric]))
-        elif len(wot[metric]) > count:
-            wot[metric] = wot[metric][:count]
-        assert metric not in wot or len(wot[metric]) == count
-
-    return wot
+                histogram = rv["metrics"].setdefault(metric, {})
+                add_histogram(histogram, {result["measure"]: 1})
+
+        if not metrics["errors"]:
+            add(metrics["metrics"])
+            for function_metrics in metrics["functions"].values():
+                rv["functions"] += 1
+                add(function_metrics)
+
+        return rv
+
+    @staticmethod
+    def combine(target, histograms, sign=1):
+        target["files"]     += sign * histograms["files"]
+        target["functions"] += sign * histograms["functions"]
+        for metric, histogram in histograms["metrics"].items():
+            add_histogram(target["metrics"].setdefault(metric, {}),
+                          histogram,
+                          sign)
+            if not target["metrics"][metric]:
+                del target["metrics"][metric]
+
+    def add_unit(self, file_name, unit_name, metrics):
+        # Adds the metrics for unit_name, which is (in) file_name as
+        # given to us, to its directory. If we have seen the unit
+        # before its old metrics are replaced.
+        assert isinstance(file_name, str)
+        assert isinstance(unit_name, str)
+        assert isinstance(metrics, dict)
+
+        if unit_name in self.units:
+            old_directory, old_histograms = self.units[unit_name]
+            self.combine(self.own[old_directory], old_histograms, -1)
+            self.invalidate(old_directory)
+
+        directory = os.path.dirname(os.path.abspath(file_name))
+        if directory not in self.own:
+            self.own[directory] = {"files"     : 0,
+                                   "functions" : 0,
+                                   "metrics"   : {}}
+            self.names[directory] = os.path.dirname(file_name) or os.curdir
+        if file_name not in self.files:
+            self.files.add(file_name)
+            self.own[directory]["files"] += 1
+
+        histograms = self.histograms(metrics)
+        self.units[unit_name] = (directory, histograms)
+        self.combine(self.own[directory], histograms)
+        self.invalidate(directory)
+
+    def invalidate(self, directory):
+        while directory is not None and directory not in self.dirty:
+            self.dirty.add(directory)
+            directory = config_files.CONFIG_TREE[directory]["parent"]
+
+    def rollup(self, root):
+        """ Returns [(directory, summary)] for root and all directories
+            below it that contain any files, parents before their
+            children. Directories are named like the file names we have
+            been given. The summary has the number of files and
+            functions, and for each metric its total, maximum, median
+            and 90th percentile.
+        """
+        assert isinstance(root, str)
+
+        rv = []
+
+        def visit(directory):
+            # Returns the rolled up histograms and the name of
+            # directory, or None if there are no files below it
+            position = len(rv)
+            rv.append(None)
+            children = [visit(child)
+                        for child in sorted(
+                            config_files.CONFIG_TREE[directory]["children"])]
+            children = [child for child in children if child]
+
+            if directory in self.own:
+                name = self.names[directory]
+            elif children:
+                name = os.path.normpath(os.path.join(children[0][1],
+                                                     os.pardir))
+            else:
+                return None
+
+            if directory in self.dirty or directory not in self.rolled:
+                rolled = {"files"     : 0,
+                          "functions" : 0,
+                          "metrics"   : {}}
+                if directory in self.own:
+                    self.combine(rolled, self.own[directory])
+                for child, _ in children:
+                    self.combine(rolled, child)
+                self.rolled[directory] = rolled
+                self.dirty.discard(directory)
+            rolled = self.rolled[directory]
+
+            rv[position] = (name, {
+                "files"     : rolled["files"],
+                "functions" : rolled["functions"],
+                "metrics"   : {
+                    metric: {
+                        "total"  : sum(measure * count
+                                       for measure, count
+                                       in histogram.items()),
+                        "max"    : max(histogram),
+                        "median" : percentile(histogram, 50),
+                        "p90"    : percentile(histogram, 90),
+                    }
+                    for metric, histogram in rolled["metrics"].items()
+                }
+            })
+            return rolled, name
+
+        visit(root)
+        return [entry for entry in rv if entry is not None]
 
 
 class MH_Metric_Result(work_package.Result):
@@ -823,9 +1636,44 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
 
         self.options = options
 
-        self.metrics = {}
+        if options.ci:
+            self.metrics = None
+        elif options.spill_to_disk:
+            self.metrics = Spilled_Metrics()
+        else:
+            self.metrics = {}
         # file -> { metrics -> {}
         #           functions -> {name -> {}} }
+        #
+        # In CI mode there is no report, so we do not keep the metrics
+        # at all.
+
+        if options.worst_offenders and not options.ci:
+            self.worst_offenders = Worst_Offenders(options.worst_offenders)
+        else:
+            self.worst_offenders = None
+
+        if options.history:
+            self.history = metric_history.Metric_History(options.history)
+            self.history.start_run(options.commit)
+        else:
+            self.history = None
+
+        self.baseline_lines = []
+        # Deviations for the baseline we write, if requested
+
+        if options.write_baseline:
+            self.baseline_root = os.path.dirname(
+                os.path.abspath(options.write_baseline))
+        else:
+            self.baseline_root = None
+        # The directory of the baseline we write, which its file
+        # names are relative to
+
+        if options.rollup:
+            self.rollup = Directory_Rollup()
+        else:
+            self.rollup = None
 
     @classmethod
     def process_wp(cls, wp):
@@ -845,6 +1693,11 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
         }
         justifications = {}
 
+        if wp.options.baseline:
+            baseline = get_baseline(wp.options.baseline)
+        else:
+            baseline = None
+
         # Create lexer
 
         lexer = MATLAB_Lexer(wp.mh, wp.get_content(),
@@ -859,6 +1712,51 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
         if len(lexer.text.strip()) == 0:
             return MH_Metric_Result(wp, metrics)
 
+        # Generated code only gets the light profile: we measure the
+        # file length, but do not parse the file. This means
+        # justifications and function metrics are not available.
+
+        if config.generated(wp.cfg, wp.filename, lexer.context_line):
+            wp.mh.light_files += 1
+            if config.metric_enabled(wp.cfg, "file_length"):
+                metrics[full_name]["metrics"]["file_length"] = {
+                    "measure" : lexer.line_count(),
+                    "limit"   : None,
+                    "reason"  : None
+                }
+                check_metric(wp.mh, wp.cfg, lexer.get_file_loc(),
+                             "file_length",
+                             metrics[full_name]["metrics"],
+                             {},
+                             baseline,
+                             full_name)
+            return MH_Metric_Result(wp, metrics)
+
+        # In CI mode we only compute metrics that have a limit. If
+        # only file metrics have one, and there are no justifications
+        # to look at, we do not need to parse the file at all. This
+        # also means we do not report syntax errors for it.
+
+        ci = wp.options.ci
+        if ci and \
+           not any(metric_needed(wp.cfg, m, ci)
+                   for m in config.FUNCTION_METRICS) and \
+           (not lexer.process_pragmas or "Justify" not in lexer.text):
+            wp.mh.unparsed_files += 1
+            if metric_needed(wp.cfg, "file_length", ci):
+                metrics[full_name]["metrics"]["file_length"] = {
+                    "measure" : lexer.line_count(),
+                    "limit"   : None,
+                    "reason"  : None
+                }
+                check_metric(wp.mh, wp.cfg, lexer.get_file_loc(),
+                             "file_length",
+                             metrics[full_name]["metrics"],
+                             {},
+                             baseline,
+                             full_name)
+            return MH_Metric_Result(wp, metrics)
+
         # Create parse tree
 
         try:
@@ -870,7 +1768,7 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
 
         # Collect file metrics
 
-        if config.metric_enabled(wp.cfg, "file_length"):
+        if metric_needed(wp.cfg, "file_length", ci):
             metrics[full_name]["metrics"]["file_length"] = {
                 "measure" : lexer.line_count(),
                 "limit"   : None,
@@ -884,13 +1782,18 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
         for file_metric in config.FILE_METRICS:
             check_metric(wp.mh, wp.cfg, lexer.get_file_loc(), file_metric,
                          metrics[full_name]["metrics"],
-                         justifications[full_name])
+                         justifications[full_name],
+                         baseline,
+                         full_name)
 
         # Collect, check, and justify function metrics
 
         metrics[full_name]["functions"] = get_function_metrics(wp.mh,
                                                                wp.cfg,
-                                                               parse_tree)
+                                                               parse_tree,
+                                                               ci,
+                                                               baseline,
+                                                               full_name)
 
         # Complain about unused justifications
 
@@ -903,34 +1806,90 @@ class MH_Metric(command_line.MISS_HIT_Back_End):
 
         if isinstance(result, MH_Metric_Result):
             assert result.processed
-            self.metrics.update(result.metrics)
+            if self.worst_offenders:
+                for file_name, file_metrics in result.metrics.items():
+                    self.worst_offenders.add_file(file_name, file_metrics)
+            if self.history:
+                for file_name, file_metrics in result.metrics.items():
+                    self.history.add_file(file_name, file_metrics)
+            if self.options.write_baseline:
+                for file_name, file_metrics in result.metrics.items():
+                    self.baseline_lines += Baseline.deviations(
+                        self.baseline_root,
+                        file_name,
+                        file_metrics)
+            if self.rollup:
+                for unit_name, unit_metrics in result.metrics.items():
+                    self.rollup.add_unit(result.wp.filename,
+                                         unit_name,
+                                         unit_metrics)
+
+            if self.metrics is not None:
+                self.metrics.update(result.metrics)
 
         else:
             assert not result.processed
 
     def post_process(self):
+        # Write the baseline, if requested
+
+        if self.options.write_baseline:
+            Baseline.write(self.options.write_baseline, self.baseline_lines)
+
+        # In CI mode we only notify about violations, and that has
+        # already happened
+
+        if self.options.ci:
+            return
+
+        # Record the metrics of this run
+
+        if self.history:
+            self.history.finish_run()
+            self.history.close()
+
         # Build worst offenders table, if requested
 
-        if self.options.worst_offenders:
-            worst_offenders = build_worst_offenders_table(
-                self.metrics,
-                self.options.worst_offenders)
+        if self.worst_offenders:
+            worst_offenders = self.worst_offenders.table()
         else:
             worst_offenders = None
 
+        # Roll up metrics by directory, if requested. We start at the
+        # directory containing everything we have analysed.
+
+        if self.rollup:
+            root = os.path.commonpath(
+                [os.path.abspath(item) if os.path.isdir(item)
+                 else os.path.dirname(os.path.abspath(item))
+                 for item in self.options.files])
+            rollup = self.rollup.rollup(root)
+        else:
+            rollup = None
+
         # Generate report
 
-        if self.options.html:
+        if self.options.html_pages:
+            write_html_pages(self.options.html_pages,
+                             self.metrics,
+                             worst_offenders,
+                             rollup)
+        elif self.options.html:
             with open(self.options.html, "w") as fd:
                 write_html_report(fd,
                                   self.options.html,
                                   self.metrics,
-                                  worst_offenders)
+                                  worst_offenders,
+                                  rollup)
+        elif self.options.json:
+            with open(self.options.json, "w", encoding="utf-8") as fd:
+                write_json_report(fd, self.metrics, rollup)
         elif self.options.text:
             with open(self.options.text, "w") as fd:
-                write_text_report(fd, self.metrics, worst_offenders)
-        elif not self.options.ci:
-            write_text_report(sys.stdout, self.metrics, worst_offenders)
+                write_text_report(fd, self.metrics, worst_offenders, rollup)
+        else:
+            write_text_report(sys.stdout, self.metrics, worst_offenders,
+                              rollup)
 
 
 def main():
@@ -949,7 +1908,55 @@ def main():
         default=False,
         action="store_true",
         help=("Do not print any metrics report, only notify about violations."
-              "This is the intended way to run in a CI environment."))
+              " This is the intended way to run in a CI environment. Note"
+              " that if only file metrics have a limit, files without"
+              " justifications are not parsed, and so syntax errors in"
+              " them are not reported."))
+
+    clp["output_options"].add_argument(
+        "--spill-to-disk",
+        default=False,
+        action="store_true",
+        help=("Keep the metrics for the report in a temporary file"
+              " instead of in memory. This is useful for very large"
+              " projects."))
+
+    clp["output_options"].add_argument(
+        "--rollup",
+        default=False,
+        action="store_true",
+        help=("Also report metrics rolled up for each directory (and"
+              " everything below it): the total, maximum, median and"
+              " 90th percentile of each metric."))
+
+    clp["output_options"].add_argument(
+        "--history",
+        default=None,
+        metavar="DB",
+        help=("Also record all metrics in the given SQLite database,"
+              " so that they can be compared with other commits later"
+              " (see metric_history.py)."))
+
+    clp["output_options"].add_argument(
+        "--commit",
+        default=None,
+        metavar="ID",
+        help=("The commit id to record the metrics under. By default"
+              " this is the git HEAD."))
+
+    clp["output_options"].add_argument(
+        "--baseline",
+        default=None,
+        metavar="FILE",
+        help=("Do not notify about metric deviations that are in the"
+              " given baseline, unless they got worse."))
+
+    clp["output_options"].add_argument(
+        "--write-baseline",
+        default=None,
+        metavar="FILE",
+        help=("Write all metric deviations that are not justified to"
+              " the given baseline file."))
 
     clp["output_options"].add_argument(
         "--text",
@@ -964,6 +1971,21 @@ def main():
         metavar="FILE",
         help=("Write HTML metrics report to the file."))
 
+    clp["output_options"].add_argument(
+        "--json",
+        default=None,
+        metavar="FILE",
+        help="Write metrics report in JSON format to the file.")
+
+    clp["output_options"].add_argument(
+        "--html-pages",
+        default=None,
+        metavar="DIR",
+        help=("Write HTML metrics report as an index page and one page"
+              " per directory into the given directory. Pages that"
+              " have not changed since the last run are not written"
+              " again."))
+
     options = command_line.parse_args(clp)
 
     if options.text:
@@ -976,12 +1998,55 @@ def main():
             clp["ap"].error("cannot write metrics to %s, it exists and is"
                             " not a file" % options.text)
 
-    if options.text and options.html:
-        clp["ap"].error("the text and html options are mutually exclusive")
+    if options.json:
+        if os.path.exists(options.json) and not os.path.isfile(options.json):
+            clp["ap"].error("cannot write metrics to %s, it exists and is"
+                            " not a file" % options.json)
 
-    if options.ci and (options.text or options.html):
-        clp["ap"].error("the CI mode and and text/html options are mutually "
-                        "exclusive")
+    if options.html_pages:
+        if os.path.exists(options.html_pages) and \
+           not os.path.isdir(options.html_pages):
+            clp["ap"].error("cannot write metrics to %s, it exists and is"
+                            " not a directory" % options.html_pages)
+
+    if sum(map(bool, (options.text,
+                      options.html,
+                      options.json,
+                      options.html_pages))) > 1:
+        clp["ap"].error("the text, html, json, and html-pages options are"
+                        " mutually exclusive")
+
+    if options.ci and (options.text or
+                       options.html or
+                       options.json or
+                       options.html_pages or
+                       options.rollup):
+        clp["ap"].error("the CI mode and and text/html/json/html-pages/rollup"
+                        " options are mutually exclusive")
+
+    if options.baseline:
+        if not os.path.isfile(options.baseline):
+            clp["ap"].error("cannot read baseline %s, it is not a file" %
+                            options.baseline)
+
+    if options.write_baseline:
+        if os.path.exists(options.write_baseline) and \
+           not os.path.isfile(options.write_baseline):
+            clp["ap"].error("cannot write baseline to %s, it exists and is"
+                            " not a file" % options.write_baseline)
+
+    if options.ci and options.history:
+        clp["ap"].error("the CI mode and history options are mutually"
+                        " exclusive")
+
+    if options.commit and not options.history:
+        clp["ap"].error("the commit option requires the history option")
+
+    if options.history and not options.commit:
+        try:
+            options.commit = metric_history.current_commit()
+        except ValueError as err:
+            clp["ap"].error("cannot determine commit id: %s" % err)
 
     if options.worst_offenders < 0:
         clp["ap"].error("the worst-offender option cannot be negative")
@@ -29,6 +29,9 @@
 
 import os
 import re
+import sys
+import time
+import difflib
 
 from abc import ABCMeta, abstractmethod
 
@@ -36,6 +39,7 @@ import work_package
 import command_line
 import config
 import g_cfg
+import changed_lines
 
 from errors import Location, Error, ICE, Message_Handler, HTML_Message_Handler
 from m_ast import *
@@ -43,10 +47,27 @@ from m_lexer import MATLAB_Lexer, Token_Buffer
 from m_parser import MATLAB_Parser
 
 
+STAGES = ("text", "lines", "tokens", "tree")
+# The stages of processing a file, in order. Each rule says which
+# stage it needs, and for each file we only go as far as its rules
+# need.
+
+PARSER_RULES = ("end_of_statements",
+                "builtin_shadow",
+                "naming_functions",
+                "naming_classes",
+                "indentation",
+                "redundant_brackets")
+# Rules (partly) checked by the parser, so we need to parse if any of
+# them is active
+
 COPYRIGHT_REGEX = r"(\(c\) )?Copyright (\d\d\d\d-)?\d\d\d\d *(?P<org>.*)"
 
 
 class Style_Rule(metaclass=ABCMeta):
+    stage = None
+    # The stage of processing (see STAGES) this rule needs
+
     def __init__(self, name, autofix):
         assert isinstance(name, str)
         assert isinstance(autofix, bool)
@@ -54,8 +75,18 @@ class Style_Rule(metaclass=ABCMeta):
         self.autofix = autofix
         self.mandatory = False
 
+    def required_stage(self, text):
+        # pylint: disable=unused-argument
+
+        # Returns the stage this rule needs for a file with the given
+        # text. Rules that can tell from the text that they will not
+        # find anything can ask for less.
+        return self.stage
+
 
 class Style_Rule_File(Style_Rule):
+    stage = "text"
+
     def __init__(self, name):
         super().__init__(name, False)
 
@@ -65,6 +96,23 @@ class Style_Rule_File(Style_Rule):
 
 
 class Style_Rule_Line(Style_Rule):
+    """ Rules that look at individual lines (stage 2)
+
+    A rule can give a regular expression that finds the lines it
+    could complain about, so that we can search the entire file at
+    once instead of calling every rule for every line.
+    """
+    stage = "lines"
+
+    def pattern(self, cfg):
+        # pylint: disable=unused-argument
+
+        # Returns a compiled regular expression, or None if the rule
+        # wants to see every line. The expression is matched against
+        # all lines joined with newlines, and apply is then only
+        # called (once) for each line in which a match ends.
+        return None
+
     @abstractmethod
     def apply(self, mh, cfg, filename, line_no, line):
         pass
@@ -155,6 +203,10 @@ class Rule_Line_Length(Style_Rule_Line):
     def __init__(self):
         super().__init__("line_length", False)
 
+    def pattern(self, cfg):
+        return re.compile("^[^\n]{%u}" % (cfg["line_length"] + 1),
+                          re.MULTILINE)
+
     def apply(self, mh, cfg, filename, line_no, line):
         if len(line) > cfg["line_length"]:
             mh.style_issue(Location(filename,
@@ -177,18 +229,18 @@ class Rule_Line_Blank_Lines(Style_Rule_Line):
     def __init__(self):
         super().__init__("consecutive_blanks", True)
         self.mandatory = True
-        self.is_blank = False
+
+    def pattern(self, cfg):
+        # A blank line, and the newline that ends it, followed by
+        # another blank line. The match ends on the second line.
+        return re.compile("^[^\\S\n]*\n(?=[^\\S\n]*$)", re.MULTILINE)
 
     def apply(self, mh, cfg, filename, line_no, line):
-        if len(line.strip()):
-            self.is_blank = False
-        elif self.is_blank:
-            mh.style_issue(Location(filename,
-                                    line_no),
-                           "more than one consecutive blank line",
-                           self.autofix)
-        else:
-            self.is_blank = True
+        # We're only called for blank lines after another blank line
+        mh.style_issue(Location(filename,
+                                line_no),
+                       "more than one consecutive blank line",
+                       self.autofix)
 
 
 class Rule_Line_Tabs(Style_Rule_Line):
@@ -233,6 +285,9 @@ class Rule_Line_Tabs(Style_Rule_Line):
         super().__init__("tabs", True)
         self.mandatory = True
 
+    def pattern(self, cfg):
+        return re.compile("\t")
+
     def apply(self, mh, cfg, filename, line_no, line):
         if "\t" in line:
             mh.style_issue(Location(filename,
@@ -258,6 +313,9 @@ class Rule_Line_Trailing_Whitesapce(Style_Rule_Line):
         super().__init__("trailing_whitespace", True)
         self.mandatory = True
 
+    def pattern(self, cfg):
+        return re.compile(" $", re.MULTILINE)
+
     def apply(self, mh, cfg, filename, line_no, line):
         if line.endswith(" "):
             if len(line.strip()) == 0:
@@ -275,51 +333,326 @@ class Rule_Line_Trailing_Whitesapce(Style_Rule_Line):
                                self.autofix)
 
 
-def get_rules():
-    rules = {
-        "on_file" : [],
-        "on_line" : [],
-        "on_token" : [],
-    }
+class Token_Context:
+    """ A token looked at in stage 3, and the tokens around it """
+    def __init__(self, tbuf, is_embedded):
+        assert isinstance(tbuf, Token_Buffer)
+        assert isinstance(is_embedded, bool)
 
-    def rec(root):
-        is_leaf = True
-        for subclass in root.__subclasses__():
-            rec(subclass)
-            is_leaf = False
+        self.tbuf        = tbuf
+        self.is_embedded = is_embedded
 
-        if is_leaf:
-            if issubclass(root, Style_Rule_File):
-                rules["on_file"].append(root)
-            elif issubclass(root, Style_Rule_Line):
-                rules["on_line"].append(root)
+        self.n     = None
+        self.token = None
+        # The current token, and its index in tbuf.tokens
+
+        self.prev_token = None
+        self.next_token = None
+        # The tokens just before and after
+
+        self.prev_in_line = None
+        self.next_in_line = None
+        # The same, but only if they are on the same line. A newline
+        # is never the next token in line.
+
+        self.ws_before = None
+        self.ws_after  = None
+        # Whitespace between this token and prev_in_line/next_in_line
+
+        self.finished = []
+        # Rules that do not need to see any more tokens
+
+    def finish(self, rule):
+        # Called by a rule that does not need to see any more tokens
+        assert isinstance(rule, Style_Rule_Token)
+        self.finished.append(rule)
+
+    def set_token(self, n, with_neighbours):
+        # Move on to the n-th token. If no rule needs them, we don't
+        # bother to work out the neighbours.
+        tokens = self.tbuf.tokens
+
+        self.n     = n
+        self.token = tokens[n]
+
+        if not with_neighbours:
+            self.prev_token   = None
+            self.next_token   = None
+            self.prev_in_line = None
+            self.next_in_line = None
+            self.ws_before    = None
+            self.ws_after     = None
+            return
+
+        token = self.token
+
+        if n - 1 >= 0:
+            self.prev_token = tokens[n - 1]
+        else:
+            self.prev_token = None
+
+        if n + 1 < len(tokens):
+            self.next_token = tokens[n + 1]
+        else:
+            self.next_token = None
+
+        if (self.prev_token and
+            self.prev_token.location.line == token.location.line):
+            self.prev_in_line = self.prev_token
+            self.ws_before = (token.location.col_start -
+                              self.prev_in_line.location.col_end) - 1
+
+        else:
+            self.prev_in_line = None
+            self.ws_before = None
+
+        if (self.next_token and
+            self.next_token.location.line == token.location.line):
+            if self.next_token.kind == NEWLINE:
+                self.next_in_line = None
+                self.ws_after = None
             else:
-                raise ICE("Unable to categorize %s with base %s" %
-                          (root.__name__,
-                           " and ".join(b.__name__
-                                        for b in root.__bases__)))
+                self.next_in_line = self.next_token
+                self.ws_after = (self.next_in_line.location.col_start -
+                                 token.location.col_end) - 1
+        else:
+            self.next_in_line = None
+            self.ws_after = None
 
-    rec(Style_Rule)
-    return rules
 
+class Style_Rule_Token(Style_Rule):
+    """ Rules that look at individual tokens (stage 3)
 
-def build_library(cfg, rules):
-    lib = {
-        "on_file" : [],
-        "on_line" : [],
-        "on_token" : []
-    }
+    Each rule says which kinds of token it wants to see, so that we
+    only run the rules that could possibly apply to a token.
+    """
+    stage = "tree"
+    # Most rules look at what the parser found out about a token
+    # (e.g. if an operator is binary). Rules that only look at the
+    # tokens themselves ask for less.
 
-    for kind in rules:
-        for rule in rules[kind]:
-            inst = rule()
-            if inst.mandatory or config.active(cfg, inst.name):
-                lib[kind].append(inst)
+    kinds = None
+    # The token kinds this rule looks at, or None for all of them
 
-    return lib
+    neighbours = True
+    # If the rule uses the prev/next fields of the Token_Context
 
+    stateful = False
+    # If the rule remembers things from one token to the next. These
+    # rules see all tokens, even if we only check some lines.
+
+    @abstractmethod
+    def apply(self, mh, cfg, ctx):
+        pass
 
-##############################################################################
+
+class Rule_Token_Copyright_Notice(Style_Rule_Token):
+    """Copyright notice
+
+    Corresponds to the old CodeChecker CopyrightCheck rule. The
+    first comments in each file must contain a copyright notice.
+
+    """
+
+    stage = "tokens"
+    neighbours = False
+    stateful = True
+
+    def __init__(self):
+        super().__init__("copyright_notice", False)
+        self.company_copyright_found = False
+        self.generic_copyright_found = False
+        self.copyright_token         = None
+        self.copyright_notice        = []
+
+    def apply(self, mh, cfg, ctx):
+        if ctx.is_embedded and not cfg["copyright_in_embedded_code"]:
+            ctx.finish(self)
+            return
+
+        token = ctx.token
+
+        if token.kind == COMMENT:
+            match = re.search(COPYRIGHT_REGEX, token.value)
+            if match:
+                # We have a sane copyright string
+                self.copyright_token = token
+                self.generic_copyright_found = True
+                if match.group("org").strip() in cfg["copyright_entity"]:
+                    self.company_copyright_found = True
+
+            elif self.copyright_token is None:
+                # We might find something that could look like a
+                # copyright, but is not quite right
+                for org in cfg["copyright_entity"]:
+                    if org.lower() in token.value.lower():
+                        self.copyright_token = token
+                        break
+                for substr in ("(c)", "copyright"):
+                    if substr in token.value.lower():
+                        self.copyright_token = token
+                        break
+
+            self.copyright_notice.append(token.value)
+
+        else:
+            # Once we get a non-comment token, the header has
+            # ended. We then emit messages if we could not find
+            # anything.
+            ctx.finish(self)
+
+            if len(self.copyright_notice) == 0:
+                mh.style_issue(token.location,
+                               "file does not appear to contain any"
+                               " copyright header")
+            elif self.company_copyright_found:
+                # Everything is fine
+                pass
+            elif self.generic_copyright_found:
+                # If we have something basic, we only raise an
+                # issue if we're supposed to have something
+                # specific.
+                if cfg["copyright_entity"]:
+                    mh.style_issue(self.copyright_token.location,
+                                   "Copyright does not mention one of %s" %
+                                   (" or ".join(cfg["copyright_entity"])))
+            elif self.copyright_token:
+                # We found something that might be a copyright,
+                # but is not in a sane format
+                mh.style_issue(self.copyright_token.location,
+                               "Copyright notice not in right format")
+            else:
+                # We found nothing
+                mh.style_issue(token.location,
+                               "No copyright notice found in header")
+
+
+class Rule_Token_Whitespace_Comma(Style_Rule_Token):
+    """Whitespace surrounding commas
+
+    Corresponds to the old CodeChecker CommaWhitespace
+    rule. CommaLineEndings is now folded into the new
+    end_of_statements rule, which is much more strict and complete.
+
+    """
+
+    stage = "tokens"
+    kinds = (COMMA,)
+
+    def __init__(self):
+        super().__init__("whitespace_comma", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        token.fix.ensure_trim_before = True
+        token.fix.ensure_ws_after = True
+
+        if (ctx.next_in_line and ctx.ws_after == 0) or \
+           (ctx.prev_in_line and ctx.ws_before > 0):
+            mh.style_issue(token.location,
+                           "comma cannot be preceeded by whitespace "
+                           "and must be followed by whitespace",
+                           True)
+
+
+class Rule_Token_Whitespace_Colon(Style_Rule_Token):
+    """Whitespace surrounding colon
+
+    There must be no whitespace around a colon, unless it follows a
+    comma.
+
+    """
+
+    stage = "tokens"
+    kinds = (COLON,)
+
+    def __init__(self):
+        super().__init__("whitespace_colon", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if ctx.prev_in_line and ctx.prev_in_line.kind == COMMA:
+            pass
+            # We don't deal with this here. If anything it's the
+            # problem of the comma whitespace rules.
+        elif ctx.next_in_line and \
+             ctx.next_in_line.kind == CONTINUATION:
+            # Special exception in the rare cases we
+            # continue a range expression
+            if ctx.prev_in_line and ctx.ws_before > 0:
+                token.fix.ensure_trim_before = True
+                mh.style_issue(token.location,
+                               "no whitespace before colon",
+                               True)
+        elif (ctx.prev_in_line and ctx.ws_before > 0) or \
+             (ctx.next_in_line and ctx.ws_after > 0):
+            token.fix.ensure_trim_before = True
+            token.fix.ensure_trim_after = True
+            mh.style_issue(token.location,
+                           "no whitespace around colon"
+                           " allowed",
+                           True)
+
+
+class Rule_Token_Whitespace_Assignment(Style_Rule_Token):
+    """Whitespace around assignment
+
+    Corresponds to the old CodeChecker EqualSignWhitespace rule.
+
+    """
+
+    stage = "tokens"
+    kinds = (ASSIGNMENT,)
+
+    def __init__(self):
+        super().__init__("whitespace_assignment", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        token.fix.ensure_ws_before = True
+        token.fix.ensure_ws_after = True
+
+        if ctx.prev_in_line and ctx.ws_before == 0:
+            mh.style_issue(token.location,
+                           "= must be preceeded by whitespace",
+                           True)
+        elif ctx.next_in_line and ctx.ws_after == 0:
+            mh.style_issue(token.location,
+                           "= must be succeeded by whitespace",
+                           True)
+
+
+class Rule_Token_Whitespace_Brackets(Style_Rule_Token):
+    """Whitespace surrounding brackets
+
+    Corresponds to the old CodeChecker ParenthesisWhitespace and
+    BracketsWhitespace rules.
+
+    """
+
+    stage = "tokens"
+    kinds = (BRA, A_BRA, M_BRA, KET, A_KET, M_KET)
+
+    def __init__(self):
+        super().__init__("whitespace_brackets", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if token.kind in (BRA, A_BRA, M_BRA):
+            if ctx.next_in_line and ctx.ws_after > 0 and \
+               ctx.next_in_line.kind != CONTINUATION:
+                mh.style_issue(token.location,
+                               "%s must not be followed by whitespace" %
+                               token.raw_text,
+                               True)
+                token.fix.ensure_trim_after = True
+
+        elif ctx.prev_in_line and ctx.ws_before > 0:
+            mh.style_issue(token.location,
+                           "%s must not be preceeded by whitespace" %
+                           token.raw_text,
+                           True)
+            token.fix.ensure_trim_before = True
 
 
 KEYWORDS_WITH_WS = frozenset([
@@ -343,57 +676,352 @@ KEYWORDS_WITH_WS = frozenset([
 ])
 
 
-def stage_3_analysis(mh, cfg, tbuf, is_embedded):
-    assert isinstance(mh, Message_Handler)
-    assert isinstance(tbuf, Token_Buffer)
-    assert isinstance(is_embedded, bool)
+class Rule_Token_Whitespace_Keywords(Style_Rule_Token):
+    """Whitespace after some words
 
-    in_copyright_notice = (config.active(cfg, "copyright_notice") and
-                           (not is_embedded or
-                            cfg["copyright_in_embedded_code"]))
-    company_copyright_found = False
-    generic_copyright_found = False
-    copyright_token = None
-    copyright_notice = []
+    Corresponds to the old CodeChecker KeywordWhitespace rule.
 
-    # Some state needed to fix indentation
-    statement_start_token = None
-    current_indent = 0
-    enclosing_ast = None
+    """
 
-    for n, token in enumerate(tbuf.tokens):
-        if n - 1 >= 0:
-            prev_token = tbuf.tokens[n - 1]
-        else:
-            prev_token = None
+    stage = "tokens"
+    kinds = (KEYWORD,)
 
-        if n + 1 < len(tbuf.tokens):
-            next_token = tbuf.tokens[n + 1]
-        else:
-            next_token = None
+    def __init__(self):
+        super().__init__("whitespace_keywords", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if token.value in KEYWORDS_WITH_WS and \
+           ctx.next_in_line and ctx.ws_after == 0:
+            mh.style_issue(token.location,
+                           "keyword must be succeeded by whitespace",
+                           True)
+            token.fix.ensure_ws_after = True
+
+
+class Rule_Token_Whitespace_Comments(Style_Rule_Token):
+    """Whitespace in comments
 
-        if (prev_token and
-            prev_token.location.line == token.location.line):
-            prev_in_line = prev_token
-            ws_before = (token.location.col_start -
-                         prev_in_line.location.col_end) - 1
+    Corresponds to the old CodeChecker CommentWhitespace rule.
 
+    """
+
+    stage = "tokens"
+    kinds = (COMMENT,)
+
+    def __init__(self):
+        super().__init__("whitespace_comments", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        comment_char = token.raw_text[0]
+        comment_body = token.raw_text.lstrip(comment_char)
+        if re.match("^%#[a-zA-Z]", token.raw_text):
+            # Stuff like %#codegen or %#ok are pragmas and should
+            # not be subject to style checks
+            pass
+
+        elif token.raw_text.startswith("%|"):
+            # This is a miss-hit pragma, but we've not
+            # processed it. This is fine.
+            pass
+
+        elif token.block_comment:
+            # Ignore block comments
+            pass
+
+        elif token.raw_text.strip() in ("%s%s" % (cc, cb)
+                                        for cc in ctx.tbuf.comment_char
+                                        for cb in "{}"):
+            # Leave block comment indicators alone
+            pass
+
+        elif re.match("^%# +[a-zA-Z]", token.raw_text):
+            # This looks like a pragma, but there is a spurious
+            # space
+            mh.style_issue(token.location,
+                           "MATLAB pragma must not contain whitespace "
+                           "between %# and the pragma",
+                           True)
+            token.raw_text = "%#" + token.raw_text[2:].strip()
+
+        elif re.match("^% +#[a-zA-Z]", token.raw_text):
+            # This looks like a pragma that got "fixed" before we
+            # fixed our pragma handling
+            mh.style_issue(token.location,
+                           "MATLAB pragma must not contain whitespace "
+                           "between % and the pragma",
+                           True)
+            token.raw_text = "%#" + token.raw_text.split("#", 1)[1]
+
+        elif comment_body and not comment_body.startswith(" "):
+            # Normal comments should contain whitespace
+            mh.style_issue(token.location,
+                           "comment body must be separated with "
+                           "whitespace from the starting %s" %
+                           comment_char,
+                           True)
+            token.raw_text = (comment_char * (len(token.raw_text) -
+                                              len(comment_body)) +
+                              " " +
+                              comment_body)
+
+        # Make sure we have whitespace before each comment
+        if ctx.prev_in_line and ctx.ws_before == 0:
+            mh.style_issue(token.location,
+                           "comment must be preceeded by whitespace",
+                           True)
+            token.fix.ensure_ws_before = True
+
+
+class Rule_Token_Dangerous_Continuation(Style_Rule_Token):
+    """Dangerously misleading continuations
+
+    Some statements (e.g. command form calls) cannot be continued
+    with a line continuation, even though it looks like they
+    are. This is always reported, but only fixed if the rule is
+    active.
+
+    """
+
+    kinds = (CONTINUATION,)
+
+    def __init__(self):
+        super().__init__("dangerous_continuation", True)
+        self.mandatory = True
+
+    def required_stage(self, text):
+        # Without any continuations there is nothing to check, and we
+        # do not need to parse just for this (mandatory) rule
+        if "..." in text:
+            return "tree"
         else:
-            prev_in_line = None
-            ws_before = None
-
-        if (next_token and
-            next_token.location.line == token.location.line):
-            if next_token.kind == "NEWLINE":
-                next_in_line = None
-                ws_after = None
+            return "text"
+
+    def apply(self, mh, cfg, ctx):
+        # We look at the continuation, instead of the token that
+        # must not be followed by one
+        token = ctx.token
+        if ctx.prev_in_line and \
+           not ctx.prev_in_line.anonymous and \
+           ctx.prev_in_line.fix.flag_continuations:
+            fixed = False
+            ctx.prev_in_line.fix.add_newline = False
+            if config.active(cfg, "dangerous_continuation"):
+                token.fix.replace_with_newline = True
+                fixed = True
+            mh.style_issue(token.location,
+                           "this continuation is dangerously misleading",
+                           fixed)
+
+
+class Rule_Token_Whitespace_Continuation(Style_Rule_Token):
+    """Whitespace in continuation
+
+    Make sure we have whitespace before each line continuation.
+
+    """
+
+    stage = "tokens"
+    kinds = (CONTINUATION,)
+
+    def __init__(self):
+        super().__init__("whitespace_continuation", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if ctx.prev_in_line and ctx.ws_before == 0:
+            mh.style_issue(token.location,
+                           "continuation must be preceeded by whitespace",
+                           True)
+            token.fix.ensure_ws_before = True
+
+
+class Rule_Token_Operator_After_Continuation(Style_Rule_Token):
+    """Operators after continuations
+
+    Continuations should not start with operators unless its a
+    unary.
+
+    """
+
+    kinds = (CONTINUATION,)
+
+    def __init__(self):
+        super().__init__("operator_after_continuation", False)
+
+    def apply(self, mh, cfg, ctx):
+        next_token = ctx.next_token
+        if next_token and next_token.first_in_line and \
+           next_token.kind == OPERATOR and \
+           next_token.fix.binary_operator:
+            mh.style_issue(next_token.location,
+                           "continuations should not start with binary "
+                           "operators")
+
+
+class Rule_Token_Useless_Continuation(Style_Rule_Token):
+    """Continuations followed by terminators
+
+    Continuations followed immediately by a new-line or comment, or
+    following the end of a statement, are not actually helpful at
+    all.
+
+    """
+
+    kinds = (CONTINUATION,)
+
+    def __init__(self):
+        super().__init__("useless_continuation", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if ctx.next_token and ctx.next_token.kind in (NEWLINE, COMMENT):
+            mh.style_issue(token.location,
+                           "useless line continuation",
+                           True)
+            token.fix.replace_with_newline = True
+        elif ctx.prev_token and ctx.prev_token.fix.statement_terminator:
+            mh.style_issue(token.location,
+                           "useless line continuation",
+                           True)
+            token.fix.delete = True
+
+
+class Rule_Token_Operator_Whitespace(Style_Rule_Token):
+    """Whitespace around operators
+
+    Binary operators (except power) must be surrounded by
+    whitespace, and unary operators must be next to their operand.
+
+    """
+
+    kinds = (OPERATOR,)
+
+    def __init__(self):
+        super().__init__("operator_whitespace", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        if token.fix.unary_operator:
+            if (ctx.prev_in_line and ctx.ws_before > 0) and \
+               token.value in (".'", "'"):
+                mh.style_issue(token.location,
+                               "suffix operator must not be preceeded by"
+                               " whitespace",
+                               True)
+                token.fix.ensure_trim_before = True
+            elif (ctx.next_in_line and ctx.ws_after > 0) and \
+                 token.value not in (".'", "'"):
+                mh.style_issue(token.location,
+                               "unary operator must not be followed by"
+                               " whitespace",
+                               True)
+                token.fix.ensure_trim_after = True
+        elif token.fix.binary_operator:
+            if token.value in (".^", "^"):
+                if (ctx.prev_in_line and ctx.ws_before > 0) or \
+                   (ctx.next_in_line and ctx.ws_after > 0):
+                    mh.style_issue(token.location,
+                                   "power binary operator"
+                                   " must not be surrounded by whitespace",
+                                   True)
+                    token.fix.ensure_trim_before = True
+                    token.fix.ensure_trim_after = True
             else:
-                next_in_line = next_token
-                ws_after = (next_in_line.location.col_start -
-                            token.location.col_end) - 1
-        else:
-            next_in_line = None
-            ws_after = None
+                if (ctx.prev_in_line and ctx.ws_before == 0) or \
+                   (ctx.next_in_line and ctx.ws_after == 0):
+                    mh.style_issue(token.location,
+                                   "non power binary operator"
+                                   " must be surrounded by whitespace",
+                                   True)
+                    token.fix.ensure_ws_before = True
+                    token.fix.ensure_ws_after = True
+
+
+# The implicit_shortcircuit rule (for & and | in if/while guards) is
+# *disabled* for now since it does not work in all
+# circumstances. Curiously, this bug is shared by mlint which also
+# mis-classifies & when applied to arrays.
+#
+# To fix this we need to perform semantic analysis and type
+# inference. We're leaving the rule name in for compatibility with
+# miss_hit.cfg files that contain reference to this rules. The check
+# was:
+#
+#     token.value in ("&", "|") and
+#     isinstance(token.ast_link, Binary_Logical_Operation) and
+#     token.ast_link.short_circuit
+#
+# with the fix token.fix.make_shortcircuit_explicit = True.
+
+
+class Rule_Token_Annotation_Whitespace(Style_Rule_Token):
+    """Annotation whitespace
+
+    The annotation indication (%|) must be followed by whitespace.
+
+    """
+
+    stage = "tokens"
+    kinds = (ANNOTATION,)
+
+    def __init__(self):
+        super().__init__("annotation_whitespace", True)
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
+        token.fix.ensure_ws_after = True
+
+        if ctx.next_in_line and ctx.ws_after == 0:
+            mh.style_issue(token.location,
+                           "annotation indication must be succeeded"
+                           " by whitespace",
+                           True)
+
+
+class Rule_Token_No_Starting_Newline(Style_Rule_Token):
+    """File should not start with whitespace
+
+    Files should not *start* with newline(s).
+
+    """
+
+    stage = "tokens"
+    kinds = (NEWLINE,)
+    neighbours = False
+
+    def __init__(self):
+        super().__init__("no_starting_newline", True)
+
+    def apply(self, mh, cfg, ctx):
+        if ctx.n == 0:
+            mh.style_issue(ctx.token.location,
+                           "files should not start with a newline",
+                           True)
+            ctx.token.fix.delete = True
+
+
+class Rule_Token_Indentation(Style_Rule_Token):
+    """Indentation
+
+    Make indentation consistent.
+
+    """
+
+    neighbours = False
+    stateful = True
+
+    def __init__(self):
+        super().__init__("indentation", True)
+
+        # Some state needed to fix indentation
+        self.statement_start_token = None
+        self.current_indent = 0
+        self.enclosing_ast = None
+
+    def apply(self, mh, cfg, ctx):
+        token = ctx.token
 
         # Keep track of statement starters. This is required for
         # indentation.
@@ -405,405 +1033,394 @@ def stage_3_analysis(mh, cfg, tbuf, is_embedded):
             # above". But if they are the first item inside e.g. an if
             # statement, then this won't work (the previous
             # indentation level is one too low).
-            if statement_start_token and \
-               statement_start_token.kind == "KEYWORD" and \
-               statement_start_token.value == "end":
+            if self.statement_start_token and \
+               self.statement_start_token.kind == KEYWORD and \
+               self.statement_start_token.value == "end":
                 # The previous token was 'end'. We don't need to
                 # do anything in this case, since we'll re-use the
                 # indentation level of the compound statement
-                enclosing_ast = None
-            elif statement_start_token and \
-                 statement_start_token.ast_link and \
-                 statement_start_token.ast_link.causes_indentation():
+                self.enclosing_ast = None
+            elif self.statement_start_token and \
+                 self.statement_start_token.ast_link and \
+                 self.statement_start_token.ast_link.causes_indentation():
                 # We've got a previous AST node. We remember it,
                 # and indent one level below it, but only if it is
                 # a statement that would create nesting.
-                enclosing_ast = statement_start_token.ast_link
+                self.enclosing_ast = self.statement_start_token.ast_link
 
-            statement_start_token = token
+            self.statement_start_token = token
 
-        # Recognize justifications
-        if token.kind in ("COMMENT", "CONTINUATION"):
-            if "mh:ignore_style" in token.value:
-                mh.register_justification(token)
+        # Complain about indentation
+        if token.kind != NEWLINE and \
+           token.first_in_line and not token.block_comment:
+            if token.first_in_statement:
+                if token.ast_link:
+                    self.current_indent = token.ast_link.get_indentation()
+                elif self.enclosing_ast:
+                    self.current_indent = \
+                        self.enclosing_ast.get_indentation() + 1
+                offset = 0
 
-        # Don't ever check anonymous tokens
-        if token.anonymous:
-            continue
+            else:
+                # This is a continued line. We try to preserve
+                # the offset. We work out how much extra space
+                # this token has based on the statement
+                # starting token.
+                offset = token.location.col_start - \
+                    self.statement_start_token.location.col_start
+
+                # If positive, we can just add it. If 0 or
+                # negative, then we add 1/2 tabs to continue
+                # the line, since previously it was not offset
+                # at all.
+                if offset <= 0:
+                    offset = cfg["tab_width"] // 2
+
+            correct_spaces = cfg["tab_width"] * self.current_indent + offset
+            token.fix.correct_indent = correct_spaces
+
+            if token.location.col_start != correct_spaces:
+                mh.style_issue(token.location,
+                               "indentation not correct, should be"
+                               " %u spaces, not %u" %
+                               (correct_spaces,
+                                token.location.col_start),
+                               True)
 
-        # Corresponds to the old CodeChecker CopyrightCheck rule
-        if in_copyright_notice:
-            if token.kind == "COMMENT":
-                match = re.search(COPYRIGHT_REGEX, token.value)
-                if match:
-                    # We have a sane copyright string
-                    copyright_token = token
-                    generic_copyright_found = True
-                    if match.group("org").strip() in cfg["copyright_entity"]:
-                        company_copyright_found = True
-
-                elif copyright_token is None:
-                    # We might find something that could look like a
-                    # copyright, but is not quite right
-                    for org in cfg["copyright_entity"]:
-                        if org.lower() in token.value.lower():
-                            copyright_token = token
-                            break
-                    for substr in ("(c)", "copyright"):
-                        if substr in token.value.lower():
-                            copyright_token = token
-                            break
-
-                copyright_notice.append(token.value)
 
+def get_rules():
+    rules = {
+        "on_file" : [],
+        "on_line" : [],
+        "on_token" : [],
+    }
+
+    def rec(root):
+        is_leaf = True
+        for subclass in root.__subclasses__():
+            rec(subclass)
+            is_leaf = False
+
+        if is_leaf:
+            if issubclass(root, Style_Rule_File):
+                rules["on_file"].append(root)
+            elif issubclass(root, Style_Rule_Line):
+                rules["on_line"].append(root)
+            elif issubclass(root, Style_Rule_Token):
+                rules["on_token"].append(root)
             else:
-                # Once we get a non-comment token, the header has
-                # ended. We then emit messages if we could not find
-                # anything.
-                in_copyright_notice = False
+                raise ICE("Unable to categorize %s with base %s" %
+                          (root.__name__,
+                           " and ".join(b.__name__
+                                        for b in root.__bases__)))
 
-                if len(copyright_notice) == 0:
-                    mh.style_issue(token.location,
-                                   "file does not appear to contain any"
-                                   " copyright header")
-                elif company_copyright_found:
-                    # Everything is fine
-                    pass
-                elif generic_copyright_found:
-                    # If we have something basic, we only raise an
-                    # issue if we're supposed to have something
-                    # specific.
-                    if cfg["copyright_entity"]:
-                        mh.style_issue(copyright_token.location,
-                                       "Copyright does not mention one of %s" %
-                                       (" or ".join(cfg["copyright_entity"])))
-                elif copyright_token:
-                    # We found something that might be a copyright,
-                    # but is not in a sane format
-                    mh.style_issue(copyright_token.location,
-                                   "Copyright notice not in right format")
-                else:
-                    # We found nothing
-                    mh.style_issue(token.location,
-                                   "No copyright notice found in header")
-
-        # Corresponds to the old CodeChecker CommaWhitespace
-        # rule. CommaLineEndings is now folded into the new
-        # end_of_statements rule, which is much more strict and
-        # complete.
-        if token.kind == "COMMA":
-            if config.active(cfg, "whitespace_comma"):
-                token.fix.ensure_trim_before = True
-                token.fix.ensure_ws_after = True
+    rec(Style_Rule)
+    return rules
 
-                if (next_in_line and ws_after == 0) or \
-                   (prev_in_line and ws_before > 0):
-                    mh.style_issue(token.location,
-                                   "comma cannot be preceeded by whitespace "
-                                   "and must be followed by whitespace",
-                                   True)
 
-        elif token.kind == "COLON":
-            if config.active(cfg, "whitespace_colon"):
-                if prev_in_line and prev_in_line.kind == "COMMA":
-                    pass
-                    # We don't deal with this here. If anything it's the
-                    # problem of the comma whitespace rules.
-                elif next_in_line and \
-                     next_in_line.kind == "CONTINUATION":
-                    # Special exception in the rare cases we
-                    # continue a range expression
-                    if prev_in_line and ws_before > 0:
-                        token.fix.ensure_trim_before = True
-                        mh.style_issue(token.location,
-                                       "no whitespace before colon",
-                                       True)
-                elif (prev_in_line and ws_before > 0) or \
-                     (next_in_line and ws_after > 0):
-                    token.fix.ensure_trim_before = True
-                    token.fix.ensure_trim_after = True
-                    mh.style_issue(token.location,
-                                   "no whitespace around colon"
-                                   " allowed",
-                                   True)
+def select_rules(cfg, rules):
+    # Returns the rules (classes, not instances) that apply for the
+    # given configuration. For compiled configurations this is only
+    # worked out once.
+    key = ("mh_style.select_rules",
+           tuple((kind, tuple(rules[kind])) for kind in sorted(rules)))
+    if isinstance(cfg, config.Compiled_Config) and key in cfg.memo:
+        return cfg.memo[key]
 
-        # Corresponds to the old CodeChecker EqualSignWhitespace rule
-        elif token.kind == "ASSIGNMENT":
-            if config.active(cfg, "whitespace_assignment"):
-                token.fix.ensure_ws_before = True
-                token.fix.ensure_ws_after = True
+    selected = {}
+    for kind in rules:
+        selected[kind] = []
+        for rule in rules[kind]:
+            inst = rule()
+            if inst.mandatory or config.active(cfg, inst.name):
+                selected[kind].append(rule)
 
-                if prev_in_line and ws_before == 0:
-                    mh.style_issue(token.location,
-                                   "= must be preceeded by whitespace",
-                                   True)
-                elif next_in_line and ws_after == 0:
-                    mh.style_issue(token.location,
-                                   "= must be succeeded by whitespace",
-                                   True)
+    if isinstance(cfg, config.Compiled_Config):
+        cfg.memo[key] = selected
+    return selected
 
-        # Corresponds to the old CodeChecker ParenthesisWhitespace and
-        # BracketsWhitespace rules
-        elif token.kind in ("BRA", "A_BRA", "M_BRA"):
-            if config.active(cfg, "whitespace_brackets") and \
-               next_in_line and ws_after > 0 and \
-               next_in_line.kind != "CONTINUATION":
-                mh.style_issue(token.location,
-                               "%s must not be followed by whitespace" %
-                               token.raw_text,
-                               True)
-                token.fix.ensure_trim_after = True
 
-        elif token.kind in ("KET", "A_KET", "M_KET"):
-            if config.active(cfg, "whitespace_brackets") and \
-               prev_in_line and ws_before > 0:
-                mh.style_issue(token.location,
-                               "%s must not be preceeded by whitespace" %
-                               token.raw_text,
-                               True)
-                token.fix.ensure_trim_before = True
+def build_library(cfg, rules):
+    lib = {
+        "on_file" : [],
+        "on_line" : [],
+        "on_token" : []
+    }
 
-        # Corresponds to the old CodeChecker KeywordWhitespace rule
-        elif (token.kind == "KEYWORD" and
-              token.value in KEYWORDS_WITH_WS):
-            if config.active(cfg, "whitespace_keywords") and \
-               next_in_line and ws_after == 0:
-                mh.style_issue(token.location,
-                               "keyword must be succeeded by whitespace",
-                               True)
-                token.fix.ensure_ws_after = True
-
-        # Corresponds to the old CodeChecker CommentWhitespace rule
-        elif token.kind == "COMMENT":
-            if config.active(cfg, "whitespace_comments"):
-                comment_char = token.raw_text[0]
-                comment_body = token.raw_text.lstrip(comment_char)
-                if re.match("^%#[a-zA-Z]", token.raw_text):
-                    # Stuff like %#codegen or %#ok are pragmas and should
-                    # not be subject to style checks
-                    pass
-
-                elif token.raw_text.startswith("%|"):
-                    # This is a miss-hit pragma, but we've not
-                    # processed it. This is fine.
-                    pass
-
-                elif token.block_comment:
-                    # Ignore block comments
-                    pass
-
-                elif token.raw_text.strip() in ("%s%s" % (cc, cb)
-                                                for cc in tbuf.comment_char
-                                                for cb in "{}"):
-                    # Leave block comment indicators alone
-                    pass
-
-                elif re.match("^%# +[a-zA-Z]", token.raw_text):
-                    # This looks like a pragma, but there is a spurious
-                    # space
-                    mh.style_issue(token.location,
-                                   "MATLAB pragma must not contain whitespace "
-                                   "between %# and the pragma",
-                                   True)
-                    token.raw_text = "%#" + token.raw_text[2:].strip()
+    # Rules can remember things while processing a file, so each
+    # file gets new instances
+    selected = select_rules(cfg, rules)
+    for kind in selected:
+        for rule in selected[kind]:
+            lib[kind].append(rule())
 
-                elif re.match("^% +#[a-zA-Z]", token.raw_text):
-                    # This looks like a pragma that got "fixed" before we
-                    # fixed our pragma handling
-                    mh.style_issue(token.location,
-                                   "MATLAB pragma must not contain whitespace "
-                                   "between % and the pragma",
-                                   True)
-                    token.raw_text = "%#" + token.raw_text.split("#", 1)[1]
+    return lib
 
-                elif comment_body and not comment_body.startswith(" "):
-                    # Normal comments should contain whitespace
-                    mh.style_issue(token.location,
-                                   "comment body must be separated with "
-                                   "whitespace from the starting %s" %
-                                   comment_char,
-                                   True)
-                    token.raw_text = (comment_char * (len(token.raw_text) -
-                                                      len(comment_body)) +
-                                      " " +
-                                      comment_body)
 
-                # Make sure we have whitespace before each comment
-                if prev_in_line and ws_before == 0:
-                    mh.style_issue(token.location,
-                                   "comment must be preceeded by whitespace",
-                                   True)
-                    token.fix.ensure_ws_before = True
+def required_stage(cfg, lib, text):
+    # Returns the last stage any of the rules in the library needs
+    # for a file with the given text
+    assert isinstance(lib, dict)
+    assert isinstance(text, str)
 
-        elif token.kind == "CONTINUATION":
-            # Make sure we have whitespace before each line continuation
-            if config.active(cfg, "whitespace_continuation") and \
-               prev_in_line and ws_before == 0:
-                mh.style_issue(token.location,
-                               "continuation must be preceeded by whitespace",
-                               True)
-                token.fix.ensure_ws_before = True
-
-            if config.active(cfg, "operator_after_continuation") and \
-               next_token and next_token.first_in_line and \
-               next_token.kind == "OPERATOR" and \
-               next_token.fix.binary_operator:
-                # Continuations should not start with operators unless
-                # its a unary.
-                mh.style_issue(next_token.location,
-                               "continuations should not start with binary "
-                               "operators")
-
-            if config.active(cfg, "useless_continuation"):
-                if next_token and next_token.kind in ("NEWLINE", "COMMENT"):
-                    # Continuations followed immediately by a new-line
-                    # or comment are not actually helpful at all.
-                    mh.style_issue(token.location,
-                                   "useless line continuation",
-                                   True)
-                    token.fix.replace_with_newline = True
-                elif prev_token and prev_token.fix.statement_terminator:
-                    mh.style_issue(token.location,
-                                   "useless line continuation",
-                                   True)
-                    token.fix.delete = True
+    if any(config.active(cfg, name) for name in PARSER_RULES):
+        return "tree"
 
-        elif token.kind == "OPERATOR":
-            if not config.active(cfg, "operator_whitespace"):
-                pass
-            elif token.fix.unary_operator:
-                if (prev_in_line and ws_before > 0) and \
-                   token.value in (".'", "'"):
-                    mh.style_issue(token.location,
-                                   "suffix operator must not be preceeded by"
-                                   " whitespace",
-                                   True)
-                    token.fix.ensure_trim_before = True
-                elif (next_in_line and ws_after > 0) and \
-                     token.value not in (".'", "'"):
-                    mh.style_issue(token.location,
-                                   "unary operator must not be followed by"
-                                   " whitespace",
-                                   True)
-                    token.fix.ensure_trim_after = True
-            elif token.fix.binary_operator:
-                if token.value in (".^", "^"):
-                    if (prev_in_line and ws_before > 0) or \
-                       (next_in_line and ws_after > 0):
-                        mh.style_issue(token.location,
-                                       "power binary operator"
-                                       " must not be surrounded by whitespace",
-                                       True)
-                        token.fix.ensure_trim_before = True
-                        token.fix.ensure_trim_after = True
-                else:
-                    if (prev_in_line and ws_before == 0) or \
-                       (next_in_line and ws_after == 0):
-                        mh.style_issue(token.location,
-                                       "non power binary operator"
-                                       " must be surrounded by whitespace",
-                                       True)
-                        token.fix.ensure_ws_before = True
-                        token.fix.ensure_ws_after = True
-
-            if config.active(cfg, "implicit_shortcircuit") and \
-               token.value in ("&", "|") and \
-               token.ast_link and \
-               isinstance(token.ast_link, Binary_Logical_Operation) and \
-               token.ast_link.short_circuit:
-                # This rule is *disabled* for now since it does not
-                # work in all circumstances. Curiously, this bug is
-                # shared by mlint which also mis-classifies & when
-                # applied to arrays.
-                #
-                # To fix this we need to perform semantic analysis and
-                # type inference. We're leaving this in for
-                # compatibility with miss_hit.cfg files that contain
-                # reference to this rules.
-                #
-                # mh.style_issue(token.location,
-                #                "implicit short-circuit operation due to"
-                #                " expression being contained in "
-                #                " if/while guard",
-                #                True)
-                # token.fix.make_shortcircuit_explicit = True
-                pass
+    rv = 0
+    for kind in lib:
+        for rule in lib[kind]:
+            rv = max(rv, STAGES.index(rule.required_stage(text)))
+    return STAGES[rv]
 
-        elif token.kind == "ANNOTATION":
-            if config.active(cfg, "annotation_whitespace"):
-                token.fix.ensure_ws_after = True
 
-                if next_in_line and ws_after == 0:
-                    mh.style_issue(token.location,
-                                   "annotation indication must be succeeded"
-                                   " by whitespace",
-                                   True)
+##############################################################################
 
-        elif token.kind == "NEWLINE":
-            if n == 0 and config.active(cfg, "no_starting_newline"):
-                # Files should not *start* with newline(s)
-                mh.style_issue(token.location,
-                               "files should not start with a newline",
-                               True)
-                token.fix.delete = True
 
-        # Check some specific problems with continuations
-        if token.fix.flag_continuations and \
-           next_in_line and next_in_line.kind == "CONTINUATION":
-            fixed = False
-            token.fix.add_newline = False
-            if config.active(cfg, "dangerous_continuation"):
-                next_in_line.fix.replace_with_newline = True
-                fixed = True
-            mh.style_issue(next_in_line.location,
-                           "this continuation is dangerously misleading",
-                           fixed)
+def stage_2_analysis(mh, cfg, filename, lines, rules, only_lines=None):
+    assert isinstance(mh, Message_Handler)
+    assert isinstance(filename, str)
+    assert isinstance(lines, list)
+    assert isinstance(rules, list)
+    assert only_lines is None or isinstance(only_lines, set)
 
-        # Complain about indentation
-        if config.active(cfg, "indentation") and token.kind != "NEWLINE":
-            if token.first_in_line and not token.block_comment:
-                if token.first_in_statement:
-                    if token.ast_link:
-                        current_indent = token.ast_link.get_indentation()
-                    elif enclosing_ast:
-                        current_indent = enclosing_ast.get_indentation() + 1
-                    offset = 0
+    patterns = [rule.pattern(cfg) for rule in rules]
+
+    if None in patterns:
+        # At least one rule wants to see everything
+        for line_no, line in enumerate(lines, 1):
+            if only_lines is not None and line_no not in only_lines:
+                continue
+            for rule in rules:
+                rule.apply(mh, cfg, filename, line_no, line)
+        return
+
+    # Otherwise we search the whole text for each rule, and then
+    # apply the rules to the lines found, in the same order as above
+    text = "\n".join(lines)
+    found = {}
+    for rule_no, pattern in enumerate(patterns):
+        line_no = 1
+        pos = 0
+        for match in pattern.finditer(text):
+            line_no += text.count("\n", pos, match.end())
+            pos = match.end()
+            if only_lines is not None and line_no not in only_lines:
+                continue
+            elif line_no in found:
+                if found[line_no][-1] != rule_no:
+                    found[line_no].append(rule_no)
+            else:
+                found[line_no] = [rule_no]
+
+    for line_no in sorted(found):
+        for rule_no in found[line_no]:
+            rules[rule_no].apply(mh, cfg, filename,
+                                 line_no, lines[line_no - 1])
+
+
+def stage_3_analysis(mh, cfg, tbuf, is_embedded, rules, stats=None,
+                     only_lines=None):
+    assert isinstance(mh, Message_Handler)
+    assert isinstance(tbuf, Token_Buffer)
+    assert isinstance(is_embedded, bool)
+    assert isinstance(rules, list)
+    assert stats is None or isinstance(stats, dict)
+    assert only_lines is None or isinstance(only_lines, set)
+
+    rules = list(rules)
+
+    dispatch = [[None] * len(TOKEN_KINDS), [None] * len(TOKEN_KINDS)]
+    # The rules for each kind of token, in the order given. We work
+    # this out when we first see a token of that kind. The first
+    # table is for tokens on lines we do not check (so only stateful
+    # rules), the second for all other tokens.
+
+    neighbours = [[False] * len(TOKEN_KINDS), [False] * len(TOKEN_KINDS)]
+    # If any of these rules need the neighbours of a token
+
+    ctx = Token_Context(tbuf, is_embedded)
 
+    for n, token in enumerate(tbuf.tokens):
+        # Recognize justifications
+        if token.kind in (COMMENT, CONTINUATION):
+            if "mh:ignore_style" in token.value:
+                mh.register_justification(token)
+
+        # Don't ever check anonymous tokens
+        if token.anonymous:
+            continue
+
+        checked = int(only_lines is None or
+                      token.location.line in only_lines)
+
+        kind_rules = dispatch[checked][token.kind]
+        if kind_rules is None:
+            kind_rules = [rule
+                          for rule in rules
+                          if (checked or rule.stateful) and
+                          (rule.kinds is None or token.kind in rule.kinds)]
+            dispatch[checked][token.kind] = kind_rules
+            neighbours[checked][token.kind] = any(rule.neighbours
+                                                  for rule in kind_rules)
+        if not kind_rules:
+            continue
+
+        ctx.set_token(n, neighbours[checked][token.kind])
+
+        if stats is None:
+            for rule in kind_rules:
+                rule.apply(mh, cfg, ctx)
+        else:
+            # Count how many tokens each rule looks at, and how long
+            # it takes
+            for rule in kind_rules:
+                start = time.perf_counter()
+                rule.apply(mh, cfg, ctx)
+                duration = time.perf_counter() - start
+                if rule.name in stats:
+                    stats[rule.name][0] += 1
+                    stats[rule.name][1] += duration
                 else:
-                    # This is a continued line. We try to preserve
-                    # the offset. We work out how much extra space
-                    # this token has based on the statement
-                    # starting token.
-                    offset = token.location.col_start - \
-                        statement_start_token.location.col_start
-
-                    # If positive, we can just add it. If 0 or
-                    # negative, then we add 1/2 tabs to continue
-                    # the line, since previously it was not offset
-                    # at all.
-                    if offset <= 0:
-                        offset = cfg["tab_width"] // 2
-
-                correct_spaces = cfg["tab_width"] * current_indent + offset
-                token.fix.correct_indent = correct_spaces
-
-                if token.location.col_start != correct_spaces:
-                    mh.style_issue(token.location,
-                                   "indentation not correct, should be"
-                                   " %u spaces, not %u" %
-                                   (correct_spaces,
-                                    token.location.col_start),
-                                   True)
+                    stats[rule.name] = [1, duration]
+
+        # Rules that have nothing more to do (e.g. the copyright
+        # notice, once we are past the header) are dropped
+        if ctx.finished:
+            for rule in ctx.finished:
+                rules.remove(rule)
+            ctx.finished = []
+            dispatch = [[None] * len(TOKEN_KINDS), [None] * len(TOKEN_KINDS)]
+
+
+def fix_round(mh, wp, rule_set, content):
+    # Lexes, parses, and fixes the given text once, returning the
+    # fixed text. This is only the part of the pipeline that can
+    # change the text; messages go to the given message handler.
+    # Raises Error if the text cannot be parsed.
+    rule_lib = build_library(wp.cfg, rule_set)
+
+    lexer = MATLAB_Lexer(mh, content, wp.filename, wp.blockname)
+    if wp.cfg["octave"]:
+        lexer.set_octave_mode()
+    if wp.cfg["ignore_pragmas"]:
+        lexer.process_pragmas = False
+    lexer.correct_tabs(wp.cfg["tab_width"])
+
+    tbuf = Token_Buffer(lexer, wp.cfg)
+    MATLAB_Parser(mh, tbuf, wp.cfg).parse_file()
+    stage_3_analysis(mh, wp.cfg,
+                     tbuf,
+                     isinstance(wp, work_package.Embedded_MATLAB_WP),
+                     rule_lib["on_token"])
+
+    return tbuf.replay()
+
+
+def fix_until_stable(wp, rule_set, original, fixed, max_rounds):
+    # Keeps fixing the text in memory until fixing it again does not
+    # change it any more, or we have done max_rounds rounds. We are
+    # given the text after the first round. Returns the final text,
+    # the number of rounds that changed something, and a status
+    # ("stable", "unstable", or "error" if a round produced text we
+    # cannot parse, in which case the last text we could parse is
+    # returned).
+    assert isinstance(original, str)
+    assert isinstance(fixed, str)
+    assert isinstance(max_rounds, int) and max_rounds >= 1
+
+    rounds = 0
+    while fixed != original:
+        rounds += 1
+
+        # Messages from the later rounds refer to text the user has
+        # never seen, so we drop them
+        mh = wp.mh.fork()
+        mh.register_file(wp.filename)
+        try:
+            fixed_again = fix_round(mh, wp, rule_set, fixed)
+        except Error:
+            return original, rounds - 1, "error"
+
+        if rounds == max_rounds:
+            if fixed_again == fixed:
+                return fixed, rounds, "stable"
+            else:
+                return fixed, rounds, "unstable"
+
+        original, fixed = fixed, fixed_again
+
+    return fixed, rounds, "stable"
 
 
 class MH_Style_Result(work_package.Result):
-    def __init__(self, wp):
+    def __init__(self, wp, rule_stats=None, fix_diff=None, fix_rounds=None):
+        assert fix_diff is None or isinstance(fix_diff, str)
+        assert fix_rounds is None or isinstance(fix_rounds, tuple)
         super().__init__(wp, True)
+        self.rule_stats = rule_stats
+        self.fix_diff   = fix_diff
+        self.fix_rounds = fix_rounds
+        # Number of rounds and status from fix_until_stable
 
 
 class MH_Style(command_line.MISS_HIT_Back_End):
-    def __init__(self):
+    def __init__(self, show_rule_stats=False, show_fix_rounds=False,
+                 changes=None):
+        assert changes is None or isinstance(changes,
+                                             changed_lines.Changed_Lines)
         super().__init__("MH Style")
+        self.show_rule_stats = show_rule_stats
+        self.rule_stats = {}
+        self.show_fix_rounds = show_fix_rounds
+        self.fix_rounds = {}
+        self.changes = changes
+
+    def select_wp(self, wp):
+        # When only checking changed lines, we skip all files that
+        # have not changed. We also skip SIMULINK models, since
+        # their diffs do not tell us which lines of code changed.
+        if self.changes is None:
+            return True
+        else:
+            return (isinstance(wp, work_package.MATLAB_File_WP) and
+                    self.changes.lines(wp.filename) is not None)
+
+    def process_result(self, result):
+        if result.fix_diff:
+            sys.stdout.write(result.fix_diff)
+
+        if result.fix_rounds:
+            self.fix_rounds[result.fix_rounds] = \
+                self.fix_rounds.get(result.fix_rounds, 0) + 1
+
+        if result.rule_stats:
+            for name, (tokens, duration) in result.rule_stats.items():
+                if name in self.rule_stats:
+                    self.rule_stats[name][0] += tokens
+                    self.rule_stats[name][1] += duration
+                else:
+                    self.rule_stats[name] = [tokens, duration]
+
+    def post_process(self):
+        if self.show_fix_rounds:
+            print("Fix rounds until stable:")
+            for (rounds, status), files in sorted(self.fix_rounds.items()):
+                if status == "stable":
+                    print("   %u round(s): %u file(s)" % (rounds, files))
+                elif status == "unstable":
+                    print("   %u round(s), not stable: %u file(s)" %
+                          (rounds, files))
+                else:
+                    print("   %u round(s), then parse errors: %u file(s)" %
+                          (rounds, files))
+
+        if self.show_rule_stats:
+            print("Token rule statistics (slowest first):")
+            for name, (tokens, duration) in sorted(
+                    self.rule_stats.items(),
+                    key=lambda item: (-item[1][1], item[0])):
+                print("   %-30s %8u token(s) %8.3fs" %
+                      (name, tokens, duration))
 
     @classmethod
     def process_wp(cls, wp):
@@ -816,6 +1433,14 @@ class MH_Style(command_line.MISS_HIT_Back_End):
 
         rule_lib = build_library(wp.cfg, rule_set)
 
+        # Work out which lines to check (all of them, unless we only
+        # check lines that have changed)
+
+        if wp.extra_options["changed_lines"]:
+            only_lines = wp.extra_options["changed_lines"].lines(wp.filename)
+        else:
+            only_lines = None
+
         # Load file content
 
         content = wp.get_content()
@@ -833,6 +1458,25 @@ class MH_Style(command_line.MISS_HIT_Back_End):
         if len(lexer.text.strip()) == 0:
             return MH_Style_Result(wp)
 
+        # Check if this is generated code
+
+        light_profile = config.generated(wp.cfg,
+                                         wp.filename,
+                                         lexer.context_line)
+        if light_profile:
+            wp.mh.light_files += 1
+            for rule in rule_lib["on_file"] + rule_lib["on_line"]:
+                rule.autofix = False
+
+        # Work out how far we need to go: only as far as the rules
+        # for this file need, unless we fix or debug something
+
+        if autofix or fd_tree or debug_validate_links or \
+           wp.options.debug_cfg:
+            stage = "tree"
+        else:
+            stage = required_stage(wp.cfg, rule_lib, lexer.text)
+
         # Stage 1 - rules around the file itself
 
         for rule in rule_lib["on_file"]:
@@ -843,12 +1487,18 @@ class MH_Style(command_line.MISS_HIT_Back_End):
 
         # Stage 2 - rules around raw text lines
 
-        for line_no, line in enumerate(lexer.context_line, 1):
-            for rule in rule_lib["on_line"]:
-                rule.apply(wp.mh, wp.cfg,
-                           lexer.filename,
-                           line_no,
-                           line)
+        stage_2_analysis(wp.mh, wp.cfg,
+                         lexer.filename,
+                         lexer.context_line,
+                         rule_lib["on_line"],
+                         only_lines)
+
+        # Generated code only gets the light profile: stages 1 and 2
+        # are cheap, but we do not build a token buffer, parse, or
+        # attempt to fix anything.
+
+        if light_profile:
+            return MH_Style_Result(wp)
 
         # Tabs are just super annoying, and they require special
         # treatment. There is a known but obscure bug here, in that tabs
@@ -880,25 +1530,37 @@ class MH_Style(command_line.MISS_HIT_Back_End):
             # If there are lex errors, we can stop here
             return MH_Style_Result(wp)
 
-        # Create parse tree
+        # If no rule needs tokens we're done. We still lex the file
+        # (above) so that lexer errors are reported, but syntax errors
+        # are not.
 
-        try:
-            parser = MATLAB_Parser(wp.mh, tbuf, wp.cfg)
-            parse_tree = parser.parse_file()
+        if stage in ("text", "lines"):
+            wp.mh.unparsed_files += 1
+            return MH_Style_Result(wp)
 
-            # Check naming (we do this after parsing, not during,
-            # since we may beed to re-write functions without end).
-            parse_tree.sty_check_naming(wp.mh, wp.cfg)
+        # Create parse tree, if anything needs it
 
-            if debug_validate_links:
-                tbuf.debug_validate_links()
+        if stage == "tree":
+            try:
+                parser = MATLAB_Parser(wp.mh, tbuf, wp.cfg)
+                parse_tree = parser.parse_file()
 
-            if fd_tree:
-                fd_tree.write("-- Parse tree for %s\n" % wp.filename)
-                parse_tree.pp_node(fd_tree)
-                fd_tree.write("\n\n")
+                # Check naming (we do this after parsing, not during,
+                # since we may beed to re-write functions without end).
+                parse_tree.sty_check_naming(wp.mh, wp.cfg)
 
-        except Error:
+                if debug_validate_links:
+                    tbuf.debug_validate_links()
+
+                if fd_tree:
+                    fd_tree.write("-- Parse tree for %s\n" % wp.filename)
+                    parse_tree.pp_node(fd_tree)
+                    fd_tree.write("\n\n")
+
+            except Error:
+                parse_tree = None
+        else:
+            wp.mh.unparsed_files += 1
             parse_tree = None
 
         # Create CFG for debugging purposes
@@ -908,9 +1570,16 @@ class MH_Style(command_line.MISS_HIT_Back_End):
 
         # Stage 3 - rules around individual tokens
 
+        if wp.options.debug_rule_stats:
+            rule_stats = {}
+        else:
+            rule_stats = None
         stage_3_analysis(wp.mh, wp.cfg,
                          tbuf,
-                         isinstance(wp, work_package.Embedded_MATLAB_WP))
+                         isinstance(wp, work_package.Embedded_MATLAB_WP),
+                         rule_lib["on_token"],
+                         rule_stats,
+                         only_lines)
 
         # Stage 4 - rules involving the parse tree
 
@@ -926,11 +1595,54 @@ class MH_Style(command_line.MISS_HIT_Back_End):
                             fatal=False)
             else:
                 # TODO: call modify()
-                wp.write_modified(tbuf.replay())
+                new_content = tbuf.replay()
+                fix_rounds = None
+                if wp.options.fix_until_stable:
+                    new_content, rounds, status = fix_until_stable(
+                        wp, rule_set,
+                        content, new_content,
+                        wp.options.max_fix_rounds)
+                    fix_rounds = (rounds, status)
+                    if status == "unstable":
+                        wp.mh.warning(lexer.get_file_loc(),
+                                      "fixes did not stabilise after %u"
+                                      " round(s)" % rounds)
+                    elif status == "error":
+                        wp.mh.error(lexer.get_file_loc(),
+                                    "fixing introduced parse errors, only"
+                                    " the first %u round(s) of fixes are"
+                                    " applied" % rounds,
+                                    fatal=False)
+
+                if only_lines is not None:
+                    new_content = changed_lines.restrict_fixes(content,
+                                                               new_content,
+                                                               only_lines)
+
+                if wp.options.diff:
+                    if wp.blockname is None:
+                        label = wp.filename
+                    else:
+                        label = "%s/%s" % (wp.filename, wp.blockname)
+                    fix_diff = []
+                    for line in difflib.unified_diff(
+                            content.splitlines(True),
+                            new_content.splitlines(True),
+                            label, label):
+                        fix_diff.append(line)
+                        if not line.endswith("\n"):
+                            fix_diff.append("\n\\ No newline at end of file\n")
+                    return MH_Style_Result(wp, rule_stats,
+                                           "".join(fix_diff),
+                                           fix_rounds)
+                else:
+                    wp.write_modified(new_content)
+                    return MH_Style_Result(wp, rule_stats,
+                                           fix_rounds = fix_rounds)
 
         # Return results
 
-        return MH_Style_Result(wp)
+        return MH_Style_Result(wp, rule_stats)
 
 
 def main():
@@ -942,6 +1654,22 @@ def main():
                            default=False,
                            help=("Automatically fix issues where the fix"
                                  " is obvious"))
+    clp["ap"].add_argument("--diff",
+                           action="store_true",
+                           default=False,
+                           help=("With --fix, show the fixes as a unified"
+                                 " diff instead of changing any files"))
+    clp["ap"].add_argument("--fix-until-stable",
+                           action="store_true",
+                           default=False,
+                           help=("Like --fix, but keep fixing (in memory)"
+                                 " until the result no longer changes"))
+    clp["ap"].add_argument("--max-fix-rounds",
+                           metavar="N",
+                           type=int,
+                           default=10,
+                           help=("Give up on --fix-until-stable after N"
+                                 " rounds, default is 10"))
 
     clp["ap"].add_argument("--process-slx",
                            action="store_true",
@@ -952,6 +1680,15 @@ def main():
                                  " future once the feature is good enough"
                                  " to be enabled by default."))
 
+    clp["ap"].add_argument("--only-changed-lines",
+                           metavar="DIFF|REF",
+                           default=None,
+                           help=("Only check (and fix) lines that have"
+                                 " changed, and skip unchanged files. The"
+                                 " changes are taken from a unified diff"
+                                 " file, or else from git (compared to"
+                                 " the given ref)."))
+
     # Extra output options
     clp["output_options"].add_argument(
         "--html",
@@ -979,6 +1716,12 @@ def main():
         action="store_true",
         default=False,
         help="Build CFG for every function")
+    clp["debug_options"].add_argument(
+        "--debug-rule-stats",
+        action="store_true",
+        default=False,
+        help=("Show how many tokens each token rule has checked, and how"
+              " long it took"))
 
     style_option = clp["ap"].add_argument_group("rule options")
 
@@ -1002,6 +1745,14 @@ def main():
 
     options = command_line.parse_args(clp)
 
+    if options.max_fix_rounds < 1:
+        clp["ap"].error("--max-fix-rounds must be at least 1")
+    if options.fix_until_stable:
+        options.fix = True
+
+    if options.diff and not options.fix:
+        clp["ap"].error("--diff can only be used together with --fix")
+
     if options.html:
         if os.path.exists(options.html) and not os.path.isfile(options.html):
             clp["ap"].error("Cannot write to %s: it is not a file" %
@@ -1013,16 +1764,30 @@ def main():
     mh.show_context = not options.brief
     mh.show_style   = not options.no_style
     mh.autofix      = options.fix
+    mh.dry_run      = options.diff
+
+    if options.only_changed_lines:
+        try:
+            changes = changed_lines.Changed_Lines.load(
+                options.only_changed_lines)
+        except ValueError as err:
+            clp["ap"].error("cannot determine changed lines: %s" % err)
+        mh.line_filter = changes.is_changed
+    else:
+        changes = None
 
     extra_options = {
-        "fd_tree"  : None,
-        "rule_set" : rule_set,
+        "fd_tree"       : None,
+        "rule_set"      : rule_set,
+        "changed_lines" : changes,
     }
 
     if options.debug_dump_tree:
         extra_options["fd_tree"] = open(options.debug_dump_tree, "w")
 
-    style_backend = MH_Style()
+    style_backend = MH_Style(options.debug_rule_stats,
+                             options.fix_until_stable,
+                             changes)
     command_line.execute(mh, options, extra_options,
                          style_backend,
                          options.process_slx)
@@ -61,6 +61,8 @@ class SLX_Reference(Source_Reference):
 
 
 class Node(metaclass=ABCMeta):
+    __slots__ = ("n_parent",)
+
     def __init__(self):
         self.n_parent = None
 
@@ -75,6 +77,7 @@ class Node(metaclass=ABCMeta):
 
 class Container(Node):
     # pylint: disable=abstract-method
+    __slots__ = ("filename", "name", "n_system", "encoding")
 
     def __init__(self, filename):
         super().__init__()
@@ -111,12 +114,16 @@ class Container(Node):
 
 
 class Model(Container):
+    __slots__ = ()
+
     def dump_hierarchy(self, indent=0):
         print(" " * indent, "Model")
         self.n_system.dump_hierarchy(indent + 1)
 
 
 class Library(Container):
+    __slots__ = ()
+
     def dump_hierarchy(self, indent=0):
         print(" " * indent, "Library")
         self.n_system.dump_hierarchy(indent + 1)
@@ -125,6 +132,8 @@ class Library(Container):
 class System(Node):
     # This is a system (in Simulink this is all you can see on each
     # screen).
+    __slots__ = ("d_blocks",)
+
     def __init__(self):
         super().__init__()
         self.d_blocks = {}
@@ -152,6 +161,8 @@ class System(Node):
 
 
 class Block(Node):
+    __slots__ = ("sid", "name", "kind")
+
     def __init__(self, sid, name, kind):
         assert isinstance(sid, str), "expected string, got %s" % type(sid)
         assert isinstance(name, str)
@@ -211,6 +222,8 @@ class Block(Node):
 
 
 class Sub_System(Block):
+    __slots__ = ("n_system",)
+
     def __init__(self, sid, name, n_system):
         super().__init__(sid, name, "SubSystem")
         assert isinstance(n_system, System)
@@ -234,6 +247,8 @@ class Matlab_Function(Block):
     # MATLAB function. We hide this as well, but in a different way:
     # we pretend it's a distinct top-level object (and not a special
     # kind of sub-system).
+    __slots__ = ("sref",)
+
     def __init__(self, sid, name, sref):
         super().__init__(sid, name, "SubSystem")
         assert isinstance(sref, Source_Reference)
@@ -266,7 +281,7 @@ class Link(Node):
     # blocks.
 
     # pylint: disable=abstract-method
-    pass
+    __slots__ = ()
 
 
 class Annotation(Node):
@@ -275,7 +290,7 @@ class Annotation(Node):
     # messages.
 
     # pylint: disable=abstract-method
-    pass
+    __slots__ = ()
 
 
 class Connector(Node):
@@ -283,4 +298,4 @@ class Connector(Node):
     # is used to connect an annotation to some block.
 
     # pylint: disable=abstract-method
-    pass
+    __slots__ = ()
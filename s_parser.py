@@ -466,6 +466,7 @@ class Simulink_SLX_Parser(Simulink_Parser):
 def sanity_test(mh, filename, _):
     # pylint: disable=import-outside-toplevel
     import m_lexer
+    from m_language import TOKEN_KIND_NAME
     # pylint: enable=import-outside-toplevel
 
     print("=== Parsing %s ===" % filename)
@@ -495,7 +496,7 @@ def sanity_test(mh, filename, _):
             token = lexer.token()
             if token is None:
                 break
-            mh.info(token.location, token.kind)
+            mh.info(token.location, TOKEN_KIND_NAME[token.kind])
     mh.finalize_file(filename)
 
     # Dump model hierarchy
@@ -0,0 +1,12 @@
+% (c) Copyright 2020 Florian Schanda
+
+function rv = legacy(x)
+  rv = x+1;
+  if rv>2
+  rv=rv*2;
+  new_line=rv+3 ;
+  end
+  disp(rv) ;
+
+
+end
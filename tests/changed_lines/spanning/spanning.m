@@ -0,0 +1,10 @@
+% (c) Copyright 2020 Florian Schanda
+
+function rv = spanning(x)
+    rv = x;
+    if rv > 2
+      rv = rv * 2;
+      rv = rv + 1;
+    end
+    disp(rv);
+end
@@ -0,0 +1,31 @@
+classdef Counter < handle
+    % A simple counter
+
+    properties
+        Value = 0
+    end
+
+    methods
+        function obj = Counter(start)
+            obj.Value = start;
+        end
+
+        function increment(obj)
+            obj.Value = obj.Value + 1;
+        end
+
+        function value = get.Value(obj)
+            value = obj.Value;
+        end
+    end
+
+    methods (Static)
+        function rv = zero()
+            rv = Counter(0);
+        end
+    end
+end
+
+function helper(x)
+    disp(x);
+end
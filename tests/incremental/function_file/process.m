@@ -0,0 +1,17 @@
+function rv = process(data)
+    % Process all items
+    rv = [];
+    for i = 1:numel(data)
+        rv(end + 1) = transform(data(i));
+    end
+end
+
+function y = transform(x)
+    y = x * 2;
+end
+
+% Some documentation between functions
+
+function check(x)
+    assert(x > 0);
+end
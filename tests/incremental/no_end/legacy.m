@@ -0,0 +1,6 @@
+function legacy()
+x = 1;
+other(x);
+
+function other(x)
+disp(x);
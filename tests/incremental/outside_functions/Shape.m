@@ -0,0 +1,11 @@
+classdef Shape
+    properties
+        Width
+    end
+
+    methods
+        function a = area(obj)
+            a = obj.Width ^ 2;
+        end
+    end
+end
@@ -0,0 +1,8 @@
+function calc()
+    x = 1;
+    show(x);
+end
+
+function show(x)
+    disp(x);
+end
@@ -0,0 +1,8 @@
+% "end" and ":" depend on what is indexed, so they are only shared
+% for the same array
+a = x(end - 1);
+b = y(end - 1);
+c = x(:);
+d = y(:);
+e = x(end - 1) + y(:);
+f = c{end}(end);
@@ -0,0 +1,10 @@
+function r = logical(a, b)
+    r = a & b;
+    if a & b
+        r = ~r;
+    end
+    r = r | (a & b);
+    while a | b
+        a = a & b;
+    end
+end
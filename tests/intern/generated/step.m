@@ -0,0 +1,15 @@
+function y = step(x, u)
+    y = zeros(4, 1);
+    y(1) = x(1) + 0.5 * (x(2) + u(1));
+    y(2) = x(2) + 0.5 * (x(2) + u(1));
+    y(3) = x(3) + 0.5 * (x(4) + u(2));
+    y(4) = x(4) + 0.5 * (x(4) + u(2));
+    K = [1 0; 0 1];
+    L = [1 0; 0 1];
+    if x(1) > 0 && x(2) > 0
+        y = K * y(1:2);
+    elseif (x(1) > 0) && x(2) > 0
+        y = L * y(1:2);
+    end
+    y = f(y, @(z) z + 1);
+end
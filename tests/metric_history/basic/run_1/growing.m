@@ -0,0 +1,5 @@
+function growing(x)
+    if x > 0
+        disp('positive');
+    end
+end
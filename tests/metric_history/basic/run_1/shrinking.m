@@ -0,0 +1,12 @@
+function shrinking(x)
+    switch x
+        case 1
+            disp('one');
+        case 2
+            disp('two');
+        case 3
+            disp('three');
+        otherwise
+            disp('many');
+    end
+end
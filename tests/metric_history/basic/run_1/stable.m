@@ -0,0 +1,5 @@
+function stable(x)
+    if x > 0
+        disp('positive');
+    end
+end
@@ -0,0 +1,16 @@
+function growing(x)
+    if x > 0
+        disp('positive');
+    elseif x < 0
+        disp('negative');
+    end
+    helper(x);
+end
+
+function helper(x)
+    for i = 1:x
+        if i > 2 && i < 5
+            disp(i);
+        end
+    end
+end
@@ -0,0 +1,3 @@
+function shrinking(x)
+    disp(x);
+end
@@ -0,0 +1,25 @@
+function legacy(x)
+    % This was already too complex, and is in the baseline
+    if x > 0
+        disp('positive');
+    elseif x < 0
+        disp('negative');
+    end
+    helper(x);
+end
+
+function helper(x)
+    % This got worse since the baseline was written
+    if x > 1 && x < 5
+        disp('small');
+    elseif x > 10
+        disp('large');
+    end
+end
+
+function fresh(x)
+    % This is new
+    if x || ~x
+        disp('both');
+    end
+end
@@ -0,0 +1,12 @@
+% (c) Copyright 2020 Florian Schanda
+
+%| pragma Justify(metric, "file_length", "needs to be long");
+
+function justified
+  disp(0);
+  disp(1);
+  disp(2);
+  disp(3);
+  disp(4);
+  disp(5);
+end
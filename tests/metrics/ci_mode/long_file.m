@@ -0,0 +1,12 @@
+% (c) Copyright 2020 Florian Schanda
+
+function long_file
+  disp(0);
+  disp(1);
+  disp(2);
+  disp(3);
+  disp(4);
+  disp(5);
+  disp(6);
+  disp(7);
+end
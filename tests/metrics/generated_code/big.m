@@ -0,0 +1,11 @@
+function rv = big()
+    rv(1) = 1;
+    rv(2) = 2;
+    rv(3) = 3;
+    rv(4) = 4;
+    rv(5) = 5;
+    rv(6) = 6;
+    rv(7) = 7;
+    rv(8) = 8;
+    rv(9) = 9;
+end
@@ -0,0 +1,6 @@
+function handwritten(x)
+    if x
+        disp(x);
+    end
+    disp(x);
+end
@@ -0,0 +1,7 @@
+% Generated by Simulink Coder
+function marker(x)
+    if x
+        disp(x);
+    end
+    disp(x);
+end
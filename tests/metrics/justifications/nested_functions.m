@@ -0,0 +1,28 @@
+%% (c) Copyright 2020 Florian Schanda
+
+function nested_functions
+  %| pragma Justify(metric, "npath", "outer function");
+  %| pragma Justify(metric, "npath", "duplicate");
+  if rand() > 0.5
+    disp heads;
+  end
+  if rand() > 0.5
+    disp heads;
+  end
+  if rand() > 0.5
+    disp heads;
+  end
+
+  function nested
+    %| pragma Justify(metric, "npath", "nested function");
+    if rand() > 0.5
+      disp heads;
+    end
+    if rand() > 0.5
+      disp heads;
+    end
+    if rand() > 0.5
+      disp heads;
+    end
+  end
+end
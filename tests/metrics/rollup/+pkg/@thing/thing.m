@@ -0,0 +1,21 @@
+classdef thing
+    properties
+        value
+    end
+    methods
+        function obj = thing(value)
+            obj.value = value;
+        end
+
+        function show(obj)
+            switch obj.value
+                case 1
+                    disp('one');
+                case 2
+                    disp('two');
+                otherwise
+                    disp('many');
+            end
+        end
+    end
+end
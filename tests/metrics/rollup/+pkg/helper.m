@@ -0,0 +1,7 @@
+function helper(x)
+    for i = 1:x
+        if mod(i, 2) == 0 && i > 4
+            disp(i);
+        end
+    end
+end
@@ -0,0 +1,5 @@
+function main(x)
+    if x > 0
+        pkg.helper(x);
+    end
+end
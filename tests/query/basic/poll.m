@@ -0,0 +1,24 @@
+function poll(n)
+    x = 0;
+    while x < n
+        disp(x);
+        if x > 5
+            disp('big');
+            x = helper(x);
+        end
+        x = x + 1;
+    end
+    for k = 1:n
+        disp(k);
+        while false
+            helper(k);
+        end
+    end
+end
+
+function y = helper(x)
+    y = x * 2;
+    while y > 100
+        y = y / 2;
+    end
+end
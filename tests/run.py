@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import sys
 import copy
+import shutil
+import tempfile
 import subprocess
 import multiprocessing
 import argparse
@@ -45,6 +48,24 @@ def execute_style_test(name):
                        env=TEST_ENV)
     html_out = r.stdout
 
+    # Run in diff mode, which must not change any file
+    r = subprocess.run([sys.executable,
+                        "../../../mh_style.py",
+                        ".",
+                        "--single",
+                        "--process-slx",
+                        "--fix",
+                        "--diff"],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    changed_by_diff = set()
+    for f in m_files + slx_files:
+        with open(f, "rb") as fd:
+            if fd.read() != orig[f]:
+                changed_by_diff.add(f)
+
     # Run in plaintext mode and fix
     r = subprocess.run([sys.executable,
                         "../../../mh_style.py",
@@ -61,11 +82,13 @@ def execute_style_test(name):
     plain_out = r.stdout
 
     # Write the fixed file to foo.m_fixed
+    mtime = {}
     for f in m_files + slx_files:
         with open(f, "rb") as fd:
             fixed[f] = fd.read()
         with open(f + "_fixed", "wb") as fd:
             fd.write(fixed[f])
+        mtime[f] = os.stat(f).st_mtime_ns
 
     # Run in plaintext mode, again, to see if more things need fixing
     r = subprocess.run([sys.executable,
@@ -80,19 +103,62 @@ def execute_style_test(name):
                        env=TEST_ENV)
     plain_out_again = r.stdout
 
-    # Check if fixed files not "fixed" again
+    # Check if fixed files not "fixed" again, and not even written
     broken_fixes = set()
+    rewritten = set()
     for f in m_files + slx_files:
         with open(f, "rb") as fd:
             tmp = fd.read()
         if tmp != fixed[f]:
             broken_fixes.add(f)
+        elif os.stat(f).st_mtime_ns != mtime[f]:
+            rewritten.add(f)
 
     # Restore original output
     for f in m_files + slx_files:
         with open(f, "wb") as fd:
             fd.write(orig[f])
 
+    # If fixing is not idempotent, fixing until stable should get us
+    # to a point where fixing again changes nothing
+    if broken_fixes:
+        r = subprocess.run([sys.executable,
+                            "../../../mh_style.py",
+                            ".",
+                            "--single",
+                            "--process-slx",
+                            "--brief",
+                            "--fix-until-stable"],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        stable_out = r.stdout
+
+        stable = {}
+        for f in m_files + slx_files:
+            with open(f, "rb") as fd:
+                stable[f] = fd.read()
+
+        subprocess.run([sys.executable,
+                        "../../../mh_style.py",
+                        ".",
+                        "--single",
+                        "--process-slx",
+                        "--fix"],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+
+        still_broken = set()
+        for f in m_files + slx_files:
+            with open(f, "rb") as fd:
+                if fd.read() != stable[f]:
+                    still_broken.add(f)
+            with open(f, "wb") as fd:
+                fd.write(orig[f])
+
     # Save stdout
     with open("expected_out.txt", "w") as fd:
         fd.write("=== PLAIN MODE ===\n")
@@ -105,6 +171,22 @@ def execute_style_test(name):
             fd.write("=== ! BROKEN FIXES ! ===\n")
             for fail in sorted(broken_fixes):
                 fd.write("Fixing is not idempotent for %s\n" % fail)
+            fd.write("\n")
+            fd.write("=== FIX UNTIL STABLE ===\n")
+            fd.write(stable_out)
+            for fail in sorted(still_broken):
+                fd.write("Fixing until stable is not stable for %s\n" %
+                         fail)
+        if rewritten:
+            fd.write("\n")
+            fd.write("=== ! UNCHANGED FILES WRITTEN ! ===\n")
+            for fail in sorted(rewritten):
+                fd.write("Fixing rewrote unchanged file %s\n" % fail)
+        if changed_by_diff:
+            fd.write("\n")
+            fd.write("=== ! DIFF MODE CHANGED FILES ! ===\n")
+            for fail in sorted(changed_by_diff):
+                fd.write("Diff mode changed %s\n" % fail)
 
 
     return "Ran style test %s" % name
@@ -115,10 +197,16 @@ def execute_metric_test(name):
                           "metrics",
                           name))
 
+    # Tests with a ROLLUP file also report metrics by directory
+    if os.path.isfile("ROLLUP"):
+        rollup = ["--rollup"]
+    else:
+        rollup = []
+
     # Run
     r = subprocess.run([sys.executable,
                         "../../../mh_metric.py",
-                        "--single",
+                        "--single"] + rollup + [
                         ".",],
                        stdout=subprocess.PIPE,
                        stderr=subprocess.STDOUT,
@@ -126,11 +214,24 @@ def execute_metric_test(name):
                        env=TEST_ENV)
     plain_out = r.stdout
 
+    # The same, but keeping the metrics on disk until the report is
+    # written. We only show its output if it is different.
+    r = subprocess.run([sys.executable,
+                        "../../../mh_metric.py",
+                        "--single",
+                        "--spill-to-disk"] + rollup + [
+                        ".",],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    spill_out = r.stdout
+
     # HTML
     r = subprocess.run([sys.executable,
                         "../../../mh_metric.py",
                         "--single",
-                        "--html=metrics.html",
+                        "--html=metrics.html"] + rollup + [
                         ".",],
                        stdout=subprocess.PIPE,
                        stderr=subprocess.STDOUT,
@@ -138,17 +239,288 @@ def execute_metric_test(name):
                        env=TEST_ENV)
     html_out = r.stdout
 
+    # CI mode should report the same violations, even though it
+    # computes less (and may not parse some files). We only show its
+    # output if it is different.
+    r = subprocess.run([sys.executable,
+                        "../../../mh_metric.py",
+                        "--single",
+                        "--ci",
+                        ".",],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    ci_out = r.stdout
+
+    # With a baseline written by the same run, nothing should be
+    # reported. Tests with a baseline file also check it is used.
+    baseline_problems = []
+    with tempfile.TemporaryDirectory() as baseline_dir:
+        baseline_name = os.path.join(baseline_dir, "baseline.txt")
+        subprocess.run([sys.executable,
+                        "../../../mh_metric.py",
+                        "--single",
+                        "--ci",
+                        "--write-baseline=" + baseline_name,
+                        "."],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.STDOUT,
+                       env=TEST_ENV)
+        r = subprocess.run([sys.executable,
+                            "../../../mh_metric.py",
+                            "--single",
+                            "--ci",
+                            "--baseline=" + baseline_name,
+                            "."],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        for line in r.stdout.splitlines():
+            if "exceeded" in line:
+                baseline_problems.append(line)
+    if os.path.isfile("baseline.txt"):
+        r = subprocess.run([sys.executable,
+                            "../../../mh_metric.py",
+                            "--single",
+                            "--ci",
+                            "--baseline=baseline.txt",
+                            "."],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        baseline_out = r.stdout
+
+        # File names in the baseline are relative to it, so it must
+        # also work from somewhere else
+        r = subprocess.run([sys.executable,
+                            "../../mh_metric.py",
+                            "--single",
+                            "--ci",
+                            "--baseline=" + os.path.join(name,
+                                                         "baseline.txt"),
+                            name],
+                           cwd="..",
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        baseline_elsewhere_out = r.stdout
+    else:
+        baseline_out = None
+        baseline_elsewhere_out = None
+
+    # JSON, which we only show for tests with a roll-up
+    if rollup:
+        with tempfile.TemporaryDirectory() as json_dir:
+            json_name = os.path.join(json_dir, "metrics.json")
+            subprocess.run([sys.executable,
+                            "../../../mh_metric.py",
+                            "--single",
+                            "--rollup",
+                            "--json=" + json_name,
+                            "."],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.STDOUT,
+                           env=TEST_ENV)
+            with open(json_name, "r", encoding="utf-8") as fd:
+                json_out = fd.read()
+    else:
+        json_out = None
+
+    # The HTML report split into pages should have the same metrics
+    # for each file as the single page, and running it again should
+    # not write any page again
+    html_pages_problems = []
+    with open("metrics.html", "r", encoding="utf-8") as fd:
+        sections = re.findall(r"<div class='metrics'>\n<h2>.*?</div>\n",
+                              fd.read(),
+                              re.DOTALL)
+    with tempfile.TemporaryDirectory() as pages_dir:
+        for run in (1, 2):
+            mtimes = {page: os.stat(os.path.join(pages_dir, page)).st_mtime_ns
+                      for page in os.listdir(pages_dir)}
+            subprocess.run([sys.executable,
+                            "../../../mh_metric.py",
+                            "--single",
+                            "--html-pages=" + pages_dir] + rollup + [
+                            "."],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.STDOUT,
+                           env=TEST_ENV)
+        for page in sorted(mtimes):
+            if page.startswith("metrics_") and \
+               os.stat(os.path.join(pages_dir,
+                                    page)).st_mtime_ns != mtimes[page]:
+                html_pages_problems.append("Unchanged page %s written" % page)
+        pages = ""
+        for page in sorted(os.listdir(pages_dir)):
+            with open(os.path.join(pages_dir, page), "r",
+                      encoding="utf-8") as fd:
+                pages += fd.read()
+        for section in sections:
+            if section not in pages:
+                html_pages_problems.append(
+                    "Section missing in pages: %s" %
+                    section.splitlines()[1])
+
     # Save stdout
     with open("expected_out.txt", "w") as fd:
         fd.write("=== PLAIN MODE ===\n")
         fd.write(plain_out)
 
+        if spill_out != plain_out:
+            fd.write("\n\n=== SPILL TO DISK MODE ===\n")
+            fd.write(spill_out)
+
         fd.write("\n\n=== HTML MODE ===\n")
         fd.write(html_out)
 
+        if re.sub(r"; \d+ file\(s\) not parsed \(syntax errors not reported\)",
+                  "", ci_out) != html_out:
+            fd.write("\n\n=== CI MODE ===\n")
+            fd.write(ci_out)
+
+        if json_out is not None:
+            fd.write("\n\n=== JSON MODE ===\n")
+            fd.write(json_out)
+
+        if baseline_out is not None:
+            fd.write("\n\n=== BASELINE MODE ===\n")
+            fd.write(baseline_out)
+            fd.write("\n\n=== BASELINE MODE (FROM PARENT DIRECTORY) ===\n")
+            fd.write(baseline_elsewhere_out)
+
+        if baseline_problems:
+            fd.write("\n\n=== ! OWN BASELINE NOT MATCHED ! ===\n")
+            for problem in baseline_problems:
+                fd.write(problem + "\n")
+
+        if html_pages_problems:
+            fd.write("\n\n=== ! HTML PAGES DIFFER ! ===\n")
+            for problem in html_pages_problems:
+                fd.write(problem + "\n")
+
     return "Ran metrics test %s" % name
 
 
+def execute_metric_history_test(name):
+    os.chdir(os.path.join(TEST_ROOT,
+                          "metric_history",
+                          name))
+
+    # Each directory run_N is one commit. We copy them in order into
+    # one working directory and record each, and then query the
+    # history. Each run is recorded from a different directory, which
+    # must not matter.
+    runs = sorted(d
+                  for d in os.listdir(".")
+                  if d.startswith("run_"))
+    places = [("work", "."),
+              (".", "work"),
+              ("..", os.path.join(".", name, "work"))]
+
+    db_name = os.path.abspath("history.db")
+    try:
+        for idx, run in enumerate(runs):
+            shutil.rmtree("work", ignore_errors=True)
+            shutil.copytree(run, "work")
+            cwd, item = places[idx % len(places)]
+            subprocess.run([sys.executable,
+                            os.path.relpath(os.path.join(TEST_ROOT,
+                                                         "..",
+                                                         "mh_metric.py"),
+                                            cwd),
+                            "--single",
+                            "--history=" + db_name,
+                            "--commit=" + run,
+                            item],
+                           cwd=cwd,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.STDOUT,
+                           env=TEST_ENV)
+
+        with open("queries", "r") as fd:
+            queries = [line.split()
+                       for line in fd
+                       if line.strip()]
+
+        with open("expected_out.txt", "w") as fd:
+            for query in queries:
+                r = subprocess.run([sys.executable,
+                                    "../../../metric_history.py",
+                                    db_name] + query,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   encoding="utf-8",
+                                   env=TEST_ENV)
+                fd.write("=== %s ===\n" % " ".join(query))
+                fd.write(r.stdout.replace(db_name, "history.db"))
+                fd.write("\n")
+    finally:
+        shutil.rmtree("work", ignore_errors=True)
+        if os.path.exists(db_name):
+            os.unlink(db_name)
+
+    return "Ran metric history test %s" % name
+
+
+def execute_changed_lines_test(name):
+    os.chdir(os.path.join(TEST_ROOT,
+                          "changed_lines",
+                          name))
+
+    # Changed lines found in the diff
+    r = subprocess.run([sys.executable,
+                        "../../../changed_lines.py",
+                        "changes.diff"],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    lines_out = r.stdout
+
+    # Style issues on these lines
+    r = subprocess.run([sys.executable,
+                        "../../../mh_style.py",
+                        "--single",
+                        "--brief",
+                        "--only-changed-lines=changes.diff",
+                        "."],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    style_out = r.stdout
+
+    # Fixes on these lines
+    r = subprocess.run([sys.executable,
+                        "../../../mh_style.py",
+                        "--single",
+                        "--brief",
+                        "--only-changed-lines=changes.diff",
+                        "--fix",
+                        "--diff",
+                        "."],
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.STDOUT,
+                       encoding="utf-8",
+                       env=TEST_ENV)
+    fix_out = r.stdout
+
+    with open("expected_out.txt", "w") as fd:
+        fd.write("=== CHANGED LINES ===\n")
+        fd.write(lines_out)
+        fd.write("\n=== STYLE ===\n")
+        fd.write(style_out)
+        fd.write("\n=== FIXES ===\n")
+        fd.write(fix_out)
+
+    return "Ran changed lines test %s" % name
+
+
 def execute_lexer_test(name):
     os.chdir(os.path.join(TEST_ROOT,
                           "lexer",
@@ -201,6 +573,83 @@ def execute_parser_test(name):
     return "Ran parser test %s" % name
 
 
+def execute_incremental_test(name):
+    os.chdir(os.path.join(TEST_ROOT,
+                          "incremental",
+                          name))
+
+    files = [f
+             for f in os.listdir(".")
+             if f.endswith(".m")]
+
+    for f in files:
+        r = subprocess.run([sys.executable,
+                            "../../../m_incremental.py",
+                            f,
+                            f + ".new"],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        plain_out = r.stdout
+
+        with open(f + ".out", "w") as fd:
+            fd.write(plain_out)
+
+    return "Ran incremental test %s" % name
+
+
+def execute_query_test(name):
+    os.chdir(os.path.join(TEST_ROOT,
+                          "query",
+                          name))
+
+    files = [f
+             for f in os.listdir(".")
+             if f.endswith(".m")]
+
+    for f in files:
+        r = subprocess.run([sys.executable,
+                            "../../../m_query.py",
+                            f,
+                            f + ".query"],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        plain_out = r.stdout
+
+        with open(f + ".out", "w") as fd:
+            fd.write(plain_out)
+
+    return "Ran query test %s" % name
+
+
+def execute_intern_test(name):
+    os.chdir(os.path.join(TEST_ROOT,
+                          "intern",
+                          name))
+
+    files = [f
+             for f in os.listdir(".")
+             if f.endswith(".m")]
+
+    for f in files:
+        r = subprocess.run([sys.executable,
+                            "../../../m_intern.py",
+                            f],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT,
+                           encoding="utf-8",
+                           env=TEST_ENV)
+        plain_out = r.stdout
+
+        with open(f + ".out", "w") as fd:
+            fd.write(plain_out)
+
+    return "Ran intern test %s" % name
+
+
 def execute_simulink_parser_test(name):
     os.chdir(os.path.join(TEST_ROOT,
                           "simulink_parser",
@@ -237,8 +686,13 @@ def run_test(test):
     fn = {
         "style"           : execute_style_test,
         "metrics"         : execute_metric_test,
+        "changed_lines"   : execute_changed_lines_test,
+        "metric_history"  : execute_metric_history_test,
         "lexer"           : execute_lexer_test,
         "parser"          : execute_parser_test,
+        "incremental"     : execute_incremental_test,
+        "query"           : execute_query_test,
+        "intern"          : execute_intern_test,
         "simulink_parser" : execute_simulink_parser_test,
     }
     return fn[test["kind"]](test["test"])
@@ -263,7 +717,9 @@ def main():
     if options.suite:
         suites = [options.suite]
     else:
-        suites = ["lexer", "parser", "simulink_parser", "style", "metrics"]
+        suites = ["lexer", "parser", "incremental", "query", "intern",
+                  "simulink_parser", "style", "changed_lines", "metrics",
+                  "metric_history"]
 
     for kind in suites:
         for t in os.listdir(kind):
@@ -0,0 +1,5 @@
+function continued (x)
+  y = [x, ...
+       1];
+  disp(y)
+end
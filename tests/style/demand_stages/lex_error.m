@@ -0,0 +1,3 @@
+function lex_error (x)
+  disp('unterminated);
+end
@@ -0,0 +1,4 @@
+function lines_only (x)  
+  y = x(1,2);
+  disp(y)
+end
@@ -0,0 +1,4 @@
+function tokens_only (x)
+  y = x(1,2);
+  disp(y ,1)
+end
@@ -0,0 +1,4 @@
+function handwritten(x)
+    y=x+1;
+    disp(y)
+end
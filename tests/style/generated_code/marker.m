@@ -0,0 +1,6 @@
+% This file was automatically generated by Embedded Coder.
+% Do not edit.
+function marker(x)
+    y=x+1;   
+    disp(y)
+end
@@ -0,0 +1,3 @@
+function rv = table_lut()
+  rv = [1,2,3,4];
+end
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+This little hack measures how long it takes to parse some MATLAB
+files, how much memory the resulting parse trees need, and how long
+it takes to walk them. It must be run from the root of the
+repository, for example:
+
+   util/benchmark_ast.py tests/parser
+"""
+
+import sys
+sys.path.append(".")
+
+import os
+import time
+import tracemalloc
+import argparse
+
+import config
+from errors import Message_Handler, Error
+from m_ast import AST_Visitor, Text_Visitor, traverse
+from m_intern import Expression_Table
+from m_lexer import MATLAB_Lexer, Token_Buffer
+from m_parser import MATLAB_Parser
+from mh_metric import get_function_metrics
+
+
+class Node_Counter(AST_Visitor):
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+
+    def visit(self, node, n_parent, relation):
+        self.count += 1
+        self.size += sys.getsizeof(node)
+        if hasattr(node, "__dict__"):
+            self.size += sys.getsizeof(node.__dict__)
+
+
+def time_walk(trees, walk, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for tree in trees:
+            walk(tree)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def parse(filename):
+    mh = Message_Handler("debug")
+    mh.register_file(filename)
+    with open(filename, "r", encoding="utf-8", errors="replace") as fd:
+        content = fd.read()
+    try:
+        lexer = MATLAB_Lexer(mh, content, filename)
+        tbuf = Token_Buffer(lexer, config.BASE_CONFIG)
+        return MATLAB_Parser(mh, tbuf, config.BASE_CONFIG).parse_file()
+    except Error:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("items", metavar="FILE|DIR", nargs="+")
+    ap.add_argument("--repeat", type=int, default=3)
+    options = ap.parse_args()
+
+    files = []
+    for item in options.items:
+        if os.path.isdir(item):
+            for path, _, dir_files in os.walk(item):
+                files += [os.path.join(path, f)
+                          for f in sorted(dir_files)
+                          if f.endswith(".m")]
+        else:
+            files.append(item)
+
+    # Parse time (best of N)
+    best = None
+    for _ in range(options.repeat):
+        start = time.perf_counter()
+        for filename in files:
+            parse(filename)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+
+    # Memory held by the parse trees (and the tokens they point to)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    trees = [tree for tree in map(parse, files) if tree]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    counter = Node_Counter()
+    table = Expression_Table()
+    for tree in trees:
+        traverse(tree, counter)
+        table.add_tree(tree)
+
+    # Traversal time (best of N): once with a visitor that does
+    # nothing, so that we only measure the cost of the walk itself,
+    # once with the tree printer (which has a handler for most kinds
+    # of node), and once for the function metrics (where visitors
+    # only care about a few kinds of node)
+    with open(os.devnull, "w") as fd:
+        walk_time = time_walk(
+            trees,
+            lambda tree: traverse(tree, AST_Visitor()),
+            options.repeat)
+        print_time = time_walk(
+            trees,
+            lambda tree: traverse(tree, Text_Visitor(fd)),
+            options.repeat)
+    metric_time = time_walk(
+        trees,
+        lambda tree: get_function_metrics(Message_Handler("debug"),
+                                          config.BASE_CONFIG,
+                                          tree),
+        options.repeat)
+
+    print("Files parsed    : %u (%u with errors)" %
+          (len(files), len(files) - len(trees)))
+    print("Nodes           : %u" % counter.count)
+    print("Expressions     : %u (%u distinct)" %
+          (len(table.node_id), len(table.representatives)))
+    print("Parse time      : %.3fs (best of %u)" % (best, options.repeat))
+    if counter.count:
+        print("Memory per node : %.1f bytes (node object only)" %
+              (counter.size / counter.count))
+        print("Memory per node : %.1f bytes (including tokens)" %
+              ((after - before) / counter.count))
+    print("Walk time       : %.3fs (best of %u)" %
+          (walk_time, options.repeat))
+    print("Print time      : %.3fs (best of %u)" %
+          (print_time, options.repeat))
+    print("Metric time     : %.3fs (best of %u)" %
+          (metric_time, options.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -75,9 +75,12 @@ def process(lines, rules):
 
 def main():
     rule_set = mh_style.get_rules()
+
+    # Token rules are documented by hand, since several of them
+    # share a section
     rules = [rule()
-             for rules in rule_set.values()
-             for rule in rules]
+             for kind in ("on_file", "on_line")
+             for rule in rule_set[kind]]
 
     mandatory_rules = [rule
                        for rule in rules
@@ -23,7 +23,10 @@
 ##                                                                          ##
 ##############################################################################
 
+import os
 import os.path
+import shutil
+import tempfile
 
 import s_ast
 import config_files
@@ -94,10 +97,42 @@ class MATLAB_File_WP(MATLAB_Work_Package):
         self.cfg = config_files.get_config(self.filename)
 
     def write_modified(self, content):
+        # We only write the file if it actually changes, so that its
+        # timestamp is not touched (and build systems do not rebuild
+        # everything after a no-op fix). We compare the bytes we
+        # would write, so that e.g. line endings are still fixed.
         assert isinstance(content, str)
+        new_content = content.replace("\n", os.linesep).encode(self.encoding)
+        with open(self.filename, "rb") as fd:
+            if fd.read() == new_content:
+                return
+
+        # Write to a temporary file next to the original, and then
+        # replace the original with it. This way the file is never
+        # seen half-written, even if we are interrupted. We replace
+        # the file a symlink points to, and not the symlink itself.
         self.modified = True
-        with open(self.filename, "w", encoding=self.encoding) as fd:
-            fd.write(content)
+        real_name = os.path.realpath(self.filename)
+
+        # A file with more than one hard link cannot be replaced
+        # without breaking the links, so we overwrite it in place.
+        if os.stat(real_name).st_nlink > 1:
+            with open(real_name, "wb") as fd:
+                fd.write(new_content)
+            return
+
+        fd, tmp_name = tempfile.mkstemp(
+            dir    = os.path.dirname(real_name),
+            prefix = "." + os.path.basename(real_name) + ".",
+            suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_fd:
+                tmp_fd.write(new_content)
+            shutil.copymode(real_name, tmp_name)
+            os.replace(tmp_name, real_name)
+        except OSError:
+            os.unlink(tmp_name)
+            raise
 
     def get_content(self):
         try:
@@ -145,6 +180,8 @@ class Embedded_MATLAB_WP(MATLAB_Work_Package):
 
     def write_modified(self, content):
         assert isinstance(content, str)
+        if content == self.block.get_text():
+            return
         self.modified = True
         self.simulink_wp.modified = True
         self.block.set_text(content)